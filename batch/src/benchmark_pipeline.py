@@ -0,0 +1,360 @@
+#
+# benchmark_pipeline
+#
+# Submission throughput benchmark for run_pipeline / run_batchjob.
+#
+# Each case runs run_pipeline on a synthetic pipeline (a chain of linear modules followed by one merge module) and a
+# synthetic input folder of paired FASTQs, against in-memory stand-ins for S3 and Batch - nothing leaves this machine,
+# and no job actually runs. Only the submission path is measured: plan compilation, input listing, IO JSON / manifest
+# uploads, job definitions and submit_job calls.
+#
+# Per case, it reports jobs/second, S3 and Batch API calls per job, bytes uploaded per job and peak RSS.
+# Every case runs in its own process, so that peak RSS and in-process caches are not shared between cases.
+# Results are appended to a JSON-lines file, one line per case. With --baseline, each case is compared with the latest
+# baseline result of the same case, and the benchmark exits with status 1 if any metric regressed by more than --tolerance.
+#
+#   python benchmark_pipeline.py --samples 10,100,1000,10000 --modes single,manifest,array --results benchmark_results.jsonl
+#   python benchmark_pipeline.py --samples 1000 --baseline benchmark_results.jsonl
+#
+import os, sys, io, json, time, hashlib, resource, tempfile, datetime, threading, subprocess, contextlib
+sys.path.append('global_utils/src/')
+import yaml
+import file_utils
+import aws_s3_utils
+import job_definitions
+import local_batch
+import run_batchjob
+import run_pipeline
+from argparse import ArgumentParser
+
+SCRIPT_DIR = str(os.path.dirname(os.path.realpath(__file__)))
+BENCHMARK_SAMPLE_COUNTS = [10, 100, 1000, 10000]
+BENCHMARK_MODULE_COUNT = 3
+BENCHMARK_MODES = ['single', 'manifest', 'array']
+BENCHMARK_RESULTS_FILE = 'benchmark_results.jsonl'
+BENCHMARK_TOLERANCE = 0.2
+BENCHMARK_BUCKET = 'hubseq-benchmark'
+BENCHMARK_PIPELINE = 'benchmark'
+# metrics compared against the baseline - True if higher is better
+BENCHMARK_METRICS = {'jobs_per_second': True, 'api_calls_per_job': False, 'bytes_uploaded_per_job': False, 'peak_rss_mb': False}
+
+
+class MemoryS3Client:
+    """ In-memory stand-in for the boto3 S3 client - the calls used on the submission path, counted by operation.
+    """
+    def __init__( self ):
+        self.objects = {}
+        self.calls = {}
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def _count( self, operation, nbytes = 0 ):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            self.bytes_uploaded += nbytes
+
+    def _put( self, bucket, key, body ):
+        with self._lock:
+            self.objects[(bucket, key)] = (body, datetime.datetime.now(datetime.timezone.utc))
+
+    def _get( self, bucket, key ):
+        if (bucket, key) not in self.objects:
+            raise aws_s3_utils.ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        return self.objects[(bucket, key)]
+
+    def put_object( self, Bucket, Key, Body = b'', **kwargs ):
+        body = Body.encode('utf-8') if type(Body) == type('') else Body
+        self._count('put_object', len(body))
+        self._put( Bucket, Key, body )
+        return {'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}
+
+    def upload_file( self, Filename, Bucket, Key, ExtraArgs = None, Config = None, **kwargs ):
+        with open(Filename, 'rb') as f:
+            body = f.read()
+        self._count('upload_file', len(body))
+        self._put( Bucket, Key, body )
+
+    def download_file( self, Bucket, Key, Filename, Config = None, **kwargs ):
+        self._count('download_file')
+        with open(Filename, 'wb') as f:
+            f.write(self._get( Bucket, Key )[0])
+
+    def get_object( self, Bucket, Key, Range = None, IfNoneMatch = None, **kwargs ):
+        self._count('get_object')
+        body = self._get( Bucket, Key )[0]
+        if IfNoneMatch != None and IfNoneMatch == '"{}"'.format(hashlib.md5(body).hexdigest()):
+            raise aws_s3_utils.ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        if Range != None:
+            first_byte, last_byte = Range.split('=')[1].split('-')
+            body = body[int(first_byte):int(last_byte)+1] if last_byte != '' else body[int(first_byte):]
+        return {'Body': io.BytesIO(body), 'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}
+
+    def head_object( self, Bucket, Key, **kwargs ):
+        self._count('head_object')
+        body, last_modified = self._get( Bucket, Key )
+        return {'ContentLength': len(body), 'ETag': '"{}"'.format(hashlib.md5(body).hexdigest()), 'LastModified': last_modified}
+
+    def copy_object( self, Bucket, Key, CopySource, **kwargs ):
+        self._count('copy_object')
+        self._put( Bucket, Key, self._get( CopySource['Bucket'], CopySource['Key'] )[0] )
+        return {}
+
+    def list_objects_v2( self, Bucket, Prefix = '', Delimiter = '', **kwargs ):
+        self._count('list_objects_v2')
+        contents = []
+        common_prefixes = set()
+        with self._lock:
+            keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        for key in keys:
+            if Delimiter != '' and Delimiter in key[len(Prefix):]:
+                common_prefixes.add(Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter)
+            else:
+                body, last_modified = self.objects[(Bucket, key)]
+                contents.append({'Key': key, 'Size': len(body), 'ETag': '"{}"'.format(hashlib.md5(body).hexdigest()), 'LastModified': last_modified})
+        # one page per call - listing costs are counted per 1000 keys, as for S3
+        return {'Contents': contents, 'CommonPrefixes': [{'Prefix': p} for p in sorted(common_prefixes)],
+                'KeyCount': len(contents) + len(common_prefixes), 'IsTruncated': False}
+
+    def get_paginator( self, operation_name ):
+        def paginate( **kwargs ):
+            page = self.list_objects_v2( **kwargs )
+            # S3 returns up to 1000 keys per page - count the extra pages of large listings
+            for i in range(1, (page['KeyCount'] - 1) // 1000 + 1):
+                self._count('list_objects_v2')
+            yield page
+        return type('MemoryPaginator', (), {'paginate': staticmethod(paginate)})()
+
+
+class MemoryBatchClient( local_batch.LocalBatchClient ):
+    """ In-memory stand-in for the boto3 Batch client: jobs are recorded, but never scheduled or run. Calls are counted by operation.
+    """
+    def __init__( self ):
+        local_batch.LocalBatchClient.__init__( self, max_workers = 1, runner = 'none' )
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        for operation in ['register_job_definition', 'describe_job_definitions', 'deregister_job_definition', 'submit_job', 'describe_jobs']:
+            setattr(self, operation, self._counted( operation, getattr(self, operation) ))
+
+    def _counted( self, operation, method ):
+        def counted_method( *args, **kwargs ):
+            with self._calls_lock:
+                self.calls[operation] = self.calls.get(operation, 0) + 1
+            return method( *args, **kwargs )
+        return counted_method
+
+    def get_paginator( self, operation_name ):
+        with self._calls_lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        return local_batch.LocalBatchClient.get_paginator( self, operation_name )
+
+    def _schedule( self ):
+        # submitted jobs stay SUBMITTED - only the submission path is benchmarked
+        return
+
+
+def createSyntheticPipeline( num_modules = BENCHMARK_MODULE_COUNT ):
+    """ Synthetic pipeline: num_modules-1 linear modules in a chain, followed by one merge module.
+
+    >>> createSyntheticPipeline( 3 )['order']
+    ['bench1', 'bench2', 'benchmerge']
+    """
+    modules = ['bench{}'.format(i+1) for i in range(max(1, num_modules-1))] + ['benchmerge']
+    pipeline_dict = {'order': modules}
+    for i in range(0, len(modules)-1):
+        pipeline_dict[modules[i]] = {'module_type': 'linear', 'input_file': 'fastq' if i == 0 else 'bam', 'output': '<sample_id>.bam'}
+        if i > 0:
+            pipeline_dict[modules[i]]['previous_module'] = modules[i-1]
+    pipeline_dict['benchmerge'] = {'module_type': 'merge', 'input_file': 'bam', 'output': 'merged.txt', 'previous_module': modules[-2]}
+    return pipeline_dict
+
+
+def createSyntheticTemplate( module ):
+    """ Module template for a synthetic module.
+    """
+    return {'module_version': '00.00.00', 'program_name': module, 'program_subname': '', 'program_version': '1.0',
+            'program_arguments': '', 'compute': {'vcpus': 1, 'memory': 1024},
+            'program_input': [{'input_type': 'file', 'input_file_type': 'FASTQ.GZ', 'input_position': -1, 'input_prefix': ''}],
+            'program_output': [{'output_type': 'folder', 'output_file_type': '', 'output_position': 0, 'output_prefix': '-o'}],
+            'alternate_inputs': [], 'alternate_outputs': []}
+
+
+def createSyntheticInputs( s3_client, num_samples, input_mode = 'folder' ):
+    """ Puts num_samples paired FASTQs into the in-memory S3 bucket.
+    input_mode: 'folder' - run_pipeline input is the FASTQ folder, 'list' - input is the list of FASTQ files
+    RETURN: run_pipeline input argument
+    """
+    fastq_files = []
+    for i in range(num_samples):
+        for read in ['R1', 'R2']:
+            key = 'fastq/sample{:05d}_{}.fastq.gz'.format(i, read)
+            s3_client._put( BENCHMARK_BUCKET, key, b'@read\nACGT\n+\nFFFF\n' )
+            fastq_files.append('s3://{}/{}'.format(BENCHMARK_BUCKET, key))
+    if input_mode == 'list':
+        return ','.join(fastq_files)
+    return 's3://{}/fastq/^fastq.gz'.format(BENCHMARK_BUCKET)
+
+
+def getPeakRSS( ):
+    """ Peak resident set size of this process, in MB (ru_maxrss is in KB on Linux, in bytes on macOS).
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024.0*1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+
+def getGitCommit( ):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = SCRIPT_DIR, stderr = subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def runBenchmarkCase( num_samples, num_modules = BENCHMARK_MODULE_COUNT, mode = 'single', input_mode = 'folder' ):
+    """ Runs one benchmark case in this process - see runBenchmarkCaseProcess() to run it in a separate process.
+    mode: 'single' (one submit_job per job), 'manifest' (IO manifest per module) or 'array' (array job per module)
+    RETURN: benchmark result DICT
+    """
+    work_dir = tempfile.mkdtemp( prefix = 'hubseq_benchmark_' )
+    pipeline_dict = createSyntheticPipeline( num_modules )
+    with open(os.path.join(work_dir, BENCHMARK_PIPELINE+'.pipeline.yaml'), 'w') as f:
+        yaml.safe_dump( pipeline_dict, f )
+    for module in pipeline_dict['order']:
+        file_utils.writeJSON( createSyntheticTemplate( module ), os.path.join(work_dir, module+'.template.json') )
+    batch_settings_file = file_utils.writeJSON( {'aws_region': local_batch.LOCAL_REGION, 'jobqueue': 'benchmark_queue', 'ecr_registry': 'benchmark',
+                                                 'vcpus': 1, 'memory': 1024, 'aws_ecs_job_role': 'benchmark_role', 'working_dir': '/home/'},
+                                                os.path.join(work_dir, 'batch.settings.json') )
+
+    # in-memory S3 and Batch, and a fresh job definition cache
+    s3_client = MemoryS3Client()
+    aws_s3_utils.s3_client = s3_client
+    batch_client = MemoryBatchClient()
+    run_batchjob.setBatchExecutor( 'local', client = batch_client )
+    run_batchjob.BATCH_SETTINGS_FILE = batch_settings_file
+    job_definitions.JOB_DEFINITION_CACHE_FILE = os.path.join(work_dir, 'job_definitions.json')
+    input_arg = createSyntheticInputs( s3_client, num_samples, input_mode )
+    s3_client.calls = {}
+
+    args_json = {'pipeline': BENCHMARK_PIPELINE, 'teamid': 'benchteam', 'userid': 'benchuser', 'runid': 'benchrun',
+                 'modules': ','.join(pipeline_dict['order']), 'input': input_arg, 'output': 's3://{}/runs/benchrun/'.format(BENCHMARK_BUCKET),
+                 'scratchdir': work_dir, 'arrayjobs': mode == 'array', 'manifest': mode == 'manifest'}
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        start_time = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout( devnull ):
+            dependency_dict, timing = run_pipeline.run_pipeline( args_json, True )
+        seconds = time.time() - start_time
+    finally:
+        os.chdir(cwd)
+
+    num_jobs = sum(len(dependency_dict[m]) for m in dependency_dict)
+    s3_calls = sum(s3_client.calls.values())
+    batch_calls = sum(batch_client.calls.values())
+    return {'timestamp': datetime.datetime.now().isoformat(), 'git_commit': getGitCommit(),
+            'case': {'samples': num_samples, 'modules': num_modules, 'mode': mode, 'input_mode': input_mode},
+            'jobs': num_jobs, 'seconds': seconds, 'jobs_per_second': num_jobs / seconds if seconds > 0 else 0.0,
+            's3_calls_per_job': s3_calls / float(num_jobs), 'batch_calls_per_job': batch_calls / float(num_jobs),
+            'api_calls_per_job': (s3_calls + batch_calls) / float(num_jobs),
+            'bytes_uploaded_per_job': s3_client.bytes_uploaded / float(num_jobs), 'peak_rss_mb': getPeakRSS(),
+            's3_calls': s3_client.calls, 'batch_calls': batch_client.calls, 'stages': timing['stages']}
+
+
+def runBenchmarkCaseProcess( num_samples, num_modules = BENCHMARK_MODULE_COUNT, mode = 'single', input_mode = 'folder' ):
+    """ Runs one benchmark case in a new process, so that its peak RSS and caches are its own. RETURN: benchmark result DICT
+    """
+    with tempfile.NamedTemporaryFile( suffix = '.json', delete = False ) as f:
+        result_file = f.name
+    subprocess.check_call([sys.executable, os.path.realpath(__file__), '--case', json.dumps([num_samples, num_modules, mode, input_mode]),
+                           '--caseresult', result_file], cwd = SCRIPT_DIR)
+    result = file_utils.loadJSON( result_file )
+    os.remove(result_file)
+    return result
+
+
+def getCaseKey( result ):
+    """ Key of the benchmark case of a result - results of the same case are compared.
+
+    >>> getCaseKey( {'case': {'samples': 10, 'modules': 3, 'mode': 'array', 'input_mode': 'folder'}} )
+    'samples=10,modules=3,mode=array,input_mode=folder'
+    """
+    return ','.join('{}={}'.format(k, result['case'][k]) for k in ['samples', 'modules', 'mode', 'input_mode'])
+
+
+def loadResults( results_file ):
+    """ Loads benchmark results from a JSON-lines file. RETURN: LIST of result DICTs, oldest first
+    """
+    results = []
+    if os.path.isfile(results_file):
+        with open(results_file) as f:
+            for line in f:
+                if line.strip() != '':
+                    results.append(json.loads(line))
+    return results
+
+
+def appendResults( results, results_file ):
+    """ Appends benchmark results to a JSON-lines file, one line per case. RETURN: results file
+    """
+    with open(results_file, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result, sort_keys=True)+'\n')
+    return results_file
+
+
+def findRegressions( results, baseline_results, tolerance = BENCHMARK_TOLERANCE ):
+    """ Compares results with the latest baseline result of the same case.
+        A metric regressed if it is worse than the baseline by more than tolerance (a fraction of the baseline value).
+
+    >>> base = {'case': {'samples': 10, 'modules': 3, 'mode': 'single', 'input_mode': 'folder'}, 'jobs_per_second': 100.0, 'api_calls_per_job': 2.0, 'bytes_uploaded_per_job': 500.0, 'peak_rss_mb': 50.0}
+    >>> [r['metric'] for r in findRegressions( [dict(base, jobs_per_second = 70.0, api_calls_per_job = 2.1)], [base], 0.2 )]
+    ['jobs_per_second']
+    """
+    latest_baseline = {getCaseKey( b ): b for b in baseline_results}
+    regressions = []
+    for result in results:
+        baseline = latest_baseline.get(getCaseKey( result ))
+        if baseline == None:
+            continue
+        for metric, higher_is_better in BENCHMARK_METRICS.items():
+            if metric not in result or metric not in baseline or baseline[metric] == 0:
+                continue
+            change = (result[metric] - baseline[metric]) / float(baseline[metric])
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append({'case': getCaseKey( result ), 'metric': metric, 'baseline': baseline[metric],
+                                    'result': result[metric], 'change': change})
+    return regressions
+
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    file_path_group = argparser.add_argument_group(title='Pipeline submission benchmark arguments')
+    file_path_group.add_argument('--samples', help='comma-separated sample counts, e.g. 10,100,1000,10000', required=False, default=','.join(map(str, BENCHMARK_SAMPLE_COUNTS)))
+    file_path_group.add_argument('--modules', help='number of modules in the synthetic pipeline', required=False, type=int, default=BENCHMARK_MODULE_COUNT)
+    file_path_group.add_argument('--modes', help='comma-separated submission modes: single, manifest, array', required=False, default=','.join(BENCHMARK_MODES))
+    file_path_group.add_argument('--inputmode', help='input as a FASTQ folder (folder) or as a list of FASTQ files (list)', required=False, choices=['folder', 'list'], default='folder')
+    file_path_group.add_argument('--results', help='JSON-lines file to append results to', required=False, default=BENCHMARK_RESULTS_FILE)
+    file_path_group.add_argument('--baseline', help='JSON-lines file with baseline results to compare with', required=False, default='')
+    file_path_group.add_argument('--tolerance', help='allowed regression, as a fraction of the baseline value', required=False, type=float, default=BENCHMARK_TOLERANCE)
+    file_path_group.add_argument('--case', help='internal: run one case in this process', required=False, default='')
+    file_path_group.add_argument('--caseresult', help='internal: file to write the result of --case to', required=False, default='')
+    benchmark_args = argparser.parse_args()
+
+    if benchmark_args.case != '':
+        file_utils.writeJSON( runBenchmarkCase( *json.loads(benchmark_args.case) ), benchmark_args.caseresult )
+        sys.exit(0)
+
+    baseline_results = loadResults( benchmark_args.baseline ) if benchmark_args.baseline != '' else []
+    results = []
+    for num_samples in [int(n) for n in benchmark_args.samples.split(',')]:
+        for mode in benchmark_args.modes.split(','):
+            result = runBenchmarkCaseProcess( num_samples, benchmark_args.modules, mode, benchmark_args.inputmode )
+            print('{}: {} jobs in {:.2f}s - {:.1f} jobs/s, {:.2f} API calls/job ({:.2f} S3, {:.2f} Batch), {:.0f} bytes uploaded/job, peak RSS {:.0f} MB'.format(
+                  getCaseKey( result ), result['jobs'], result['seconds'], result['jobs_per_second'], result['api_calls_per_job'],
+                  result['s3_calls_per_job'], result['batch_calls_per_job'], result['bytes_uploaded_per_job'], result['peak_rss_mb']))
+            results.append(result)
+    print('RESULTS: '+str(appendResults( results, benchmark_args.results )))
+
+    regressions = findRegressions( results, baseline_results, benchmark_args.tolerance )
+    for regression in regressions:
+        print('REGRESSION {}: {} {:.3g} -> {:.3g} ({:+.0%})'.format(regression['case'], regression['metric'], regression['baseline'],
+                                                                     regression['result'], regression['change']))
+    sys.exit(1 if regressions != [] else 0)
@@ -0,0 +1,218 @@
+#
+# job_definitions
+#
+# Registry of Batch job definitions, shared by all jobs that run the same container.
+#
+# A job definition is named after its module and a hash of its container properties (image, vcpus, memory, role),
+# so all samples of a module - and all runs with the same module settings - reuse one ACTIVE revision,
+# instead of registering a new definition for every job. Definition ARNs are cached in a local JSON file across runs.
+#
+# Cleanup mode deregisters stale definitions: superseded revisions and the old one-per-job definitions (jdef_<module>_<uuid>).
+# The latest ACTIVE revision of every other definition is kept, whatever the local cache holds - other machines may use it:
+#
+#   python job_definitions.py --cleanup [--dryrun]
+#
+import os, sys, re, json, hashlib, threading, boto3
+sys.path.append('global_utils/src/')
+import module_utils
+from argparse import ArgumentParser
+
+SCRIPT_DIR = str(os.path.dirname(os.path.realpath(__file__)))
+BATCH_SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'batch.settings.json')
+JOB_DEFINITION_CACHE_FILE = os.environ.get('HUBSEQ_JOB_DEFINITION_CACHE', os.path.join(os.path.expanduser('~'), '.hubseq', 'job_definitions.json'))
+JOB_DEFINITION_HASH_LENGTH = 12
+JOB_DEFINITION_RETRY_STRATEGY = {'attempts': 3}
+
+# <region>/<job definition name> -> ARN of its ACTIVE revision
+_job_definitions = None
+_job_definitions_lock = threading.Lock()
+# one lock per job definition name, so concurrent submissions of the same module register it only once
+_name_locks = {}
+# job definition names whose cached ARN was checked as ACTIVE in this process
+_verified_names = set()
+
+
+def getJobDefinitionHash( job_properties, retry_strategy = JOB_DEFINITION_RETRY_STRATEGY ):
+    """ Hash of the container properties (and retry strategy) of a job definition.
+    Key order does not matter.
+
+    >>> getJobDefinitionHash( {'image': 'a', 'vcpus': 1} ) == getJobDefinitionHash( {'vcpus': 1, 'image': 'a'} )
+    True
+    >>> len(getJobDefinitionHash( {'image': 'a', 'vcpus': 1} ))
+    12
+    """
+    properties_str = json.dumps({'containerProperties': job_properties, 'retryStrategy': retry_strategy}, sort_keys=True)
+    return hashlib.sha1(properties_str.encode('utf-8')).hexdigest()[:JOB_DEFINITION_HASH_LENGTH]
+
+
+def getJobDefinitionName( module_name, job_properties, retry_strategy = JOB_DEFINITION_RETRY_STRATEGY ):
+    """ Job definition name for a module with the given container properties: jdef_<module>_<hash>
+    """
+    return module_utils.getModuleRunNameID( module_name, getJobDefinitionHash( job_properties, retry_strategy ), 'job_def' )
+
+
+def _isLegacyName( job_def_name ):
+    """ True if a job definition name is an old one-per-job name: jdef_<module>_<uuid>
+
+    >>> _isLegacyName( 'jdef_fastqc_5c7edea8-69d1-4c65-9d33-57e01b2e79d8' )
+    True
+    >>> _isLegacyName( 'jdef_fastqc_0123456789ab' )
+    False
+    """
+    return re.match(r'^jdef_.+_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', job_def_name) != None
+
+
+def _cacheKey( client, job_def_name ):
+    return '{}/{}'.format(client.meta.region_name, job_def_name)
+
+
+def _loadCache():
+    global _job_definitions
+    if _job_definitions == None:
+        try:
+            with open(JOB_DEFINITION_CACHE_FILE) as f:
+                _job_definitions = json.load(f)
+        except (OSError, ValueError):
+            _job_definitions = {}
+    return _job_definitions
+
+
+def _saveCache():
+    # write to a temp file first, so that an interrupted write never leaves a corrupt cache
+    try:
+        os.makedirs(os.path.dirname(JOB_DEFINITION_CACHE_FILE), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(JOB_DEFINITION_CACHE_FILE, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(_job_definitions, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, JOB_DEFINITION_CACHE_FILE)
+    except OSError as e:
+        print('WARNING: could not save job definition cache {}: {}'.format(JOB_DEFINITION_CACHE_FILE, str(e)))
+
+
+def _getCachedARN( client, job_def_name ):
+    with _job_definitions_lock:
+        return _loadCache().get(_cacheKey( client, job_def_name ))
+
+
+def _setCachedARN( client, job_def_name, job_def_arn ):
+    with _job_definitions_lock:
+        cache = _loadCache()
+        if job_def_arn == None:
+            cache.pop(_cacheKey( client, job_def_name ), None)
+        else:
+            cache[_cacheKey( client, job_def_name )] = job_def_arn
+        _saveCache()
+
+
+def _getNameLock( job_def_name ):
+    with _job_definitions_lock:
+        if job_def_name not in _name_locks:
+            _name_locks[job_def_name] = threading.Lock()
+        return _name_locks[job_def_name]
+
+
+def _findActiveARN( client, job_def_name ):
+    """ ARN of the latest ACTIVE revision of a job definition, or None
+    """
+    latest = None
+    for page in client.get_paginator('describe_job_definitions').paginate( jobDefinitionName = job_def_name, status = 'ACTIVE' ):
+        for job_def in page['jobDefinitions']:
+            if latest == None or job_def['revision'] > latest['revision']:
+                latest = job_def
+    return latest['jobDefinitionArn'] if latest != None else None
+
+
+def _isActiveARN( client, job_def_arn ):
+    response = client.describe_job_definitions( jobDefinitions = [job_def_arn] )
+    return any(job_def['status'] == 'ACTIVE' for job_def in response['jobDefinitions'])
+
+
+def getJobDefinition( client, module_name, job_properties, retry_strategy = JOB_DEFINITION_RETRY_STRATEGY ):
+    """ Returns the ARN of an ACTIVE job definition with the given container properties.
+    The ARN comes from the local cache, or from an existing ACTIVE revision. A new definition is registered only when neither is found.
+    A cached ARN is checked against Batch the first time this process uses it, in case it was deregistered.
+
+    client: boto3 Batch client
+    """
+    job_def_name = getJobDefinitionName( module_name, job_properties, retry_strategy )
+    with _getNameLock( job_def_name ):
+        job_def_arn = _getCachedARN( client, job_def_name )
+        if job_def_arn != None and (job_def_name in _verified_names or _isActiveARN( client, job_def_arn )):
+            _verified_names.add(job_def_name)
+            return job_def_arn
+        job_def_arn = _findActiveARN( client, job_def_name )
+        if job_def_arn == None:
+            print('\nRegistering Job Definition: '+str(job_def_name))
+            response = client.register_job_definition( jobDefinitionName = job_def_name,
+                                                       type = 'container',
+                                                       retryStrategy = retry_strategy,
+                                                       containerProperties = job_properties )
+            job_def_arn = response['jobDefinitionArn']
+        else:
+            print('\nUsing Job Definition: '+str(job_def_arn))
+        _setCachedARN( client, job_def_name, job_def_arn )
+        _verified_names.add(job_def_name)
+        return job_def_arn
+
+
+def cleanupJobDefinitions( client, module_names = [], dryrun = False ):
+    """ Deregisters stale ACTIVE job definitions (named jdef_*):
+        - old one-per-job definitions (jdef_<module>_<uuid>)
+        - any revision of a definition other than its latest ACTIVE one
+    The latest ACTIVE revision of every other definition is kept, even if it is not in the local cache,
+    since jobs submitted from other machines (or before the cache was cleared) may still use it.
+
+    module_names: only clean up definitions of these modules (default: all modules)
+    RETURN: LIST of deregistered (or, for dry runs, to-be-deregistered) ARNs
+    """
+    prefixes = ['jdef_{}_'.format(m) for m in module_names] if module_names not in [[], '', None] else ['jdef_']
+    stale_arns = []
+    # latest ACTIVE revision of each definition name
+    latest = {}
+    for page in client.get_paginator('describe_job_definitions').paginate( status = 'ACTIVE' ):
+        for job_def in page['jobDefinitions']:
+            job_def_name = job_def['jobDefinitionName']
+            if not any(job_def_name.startswith(prefix) for prefix in prefixes):
+                continue
+            if _isLegacyName( job_def_name ):
+                stale_arns.append(job_def['jobDefinitionArn'])
+            elif job_def_name not in latest or job_def['revision'] > latest[job_def_name]['revision']:
+                if job_def_name in latest:
+                    stale_arns.append(latest[job_def_name]['jobDefinitionArn'])
+                latest[job_def_name] = job_def
+            else:
+                stale_arns.append(job_def['jobDefinitionArn'])
+
+    for job_def_arn in stale_arns:
+        print('{}Deregistering Job Definition: {}'.format('DRY RUN: ' if dryrun else '', job_def_arn))
+        if not dryrun:
+            client.deregister_job_definition( jobDefinition = job_def_arn )
+    # drop cached names that now point to a deregistered revision
+    if not dryrun:
+        with _job_definitions_lock:
+            cache = _loadCache()
+            for k in [k for k, v in cache.items() if v in stale_arns]:
+                cache.pop(k)
+            _saveCache()
+    print('{} stale job definitions {}'.format(len(stale_arns), 'found' if dryrun else 'deregistered'))
+    return stale_arns
+
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    file_path_group = argparser.add_argument_group(title='Job definition registry arguments')
+    file_path_group.add_argument('--cleanup', help='deregister stale job definitions', required=False, action='store_true')
+    file_path_group.add_argument('--modules', help='only clean up job definitions of these modules, e.g. fastqc,rnastar', required=False, default='')
+    file_path_group.add_argument('--region', help='AWS region of Batch (default: from batch.settings.json)', required=False, default='')
+    file_path_group.add_argument('--dryrun', help='dry run only - list stale job definitions', required=False, action='store_true')
+    jobdef_args = argparser.parse_args()
+    if jobdef_args.cleanup:
+        aws_region = jobdef_args.region
+        if aws_region == '':
+            with open(BATCH_SETTINGS_FILE) as f:
+                aws_region = json.load(f)['aws_region']
+        cleanupJobDefinitions( boto3.client('batch', region_name=aws_region),
+                               jobdef_args.modules.split(',') if jobdef_args.modules != '' else [],
+                               jobdef_args.dryrun )
+    else:
+        argparser.print_help()
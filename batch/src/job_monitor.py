@@ -0,0 +1,209 @@
+#
+# job_monitor
+#
+# Tracks the Batch jobs of a pipeline run after submission.
+#
+# Job states are polled with describe_jobs, up to 100 jobs per call, and only for jobs that are not finished yet.
+# The poll interval adapts: it drops back to the minimum whenever a job changes state, and backs off towards the maximum
+# while nothing changes. A job that Batch no longer returns (e.g., its record expired) for MISSING_JOB_POLLS polls in a row
+# is given up as LOST, so that monitoring ends. Each state change is emitted as an event:
+#
+#   {'module': 'rnastar', 'sample_id': 'S1', 'job_id': '...', 'from': 'RUNNABLE', 'to': 'RUNNING', 'reason': '', 'time': 1660000000.0}
+#
+# After each poll with changes, the run status table is written into the run output folder (file_utils.RUN_STATUS_FILE),
+# where the dashboards read it (see dashboard_file_utils.getRunStatus()).
+# With the catalog option, the expected output files of each job that succeeded are added to the file catalog
+# (catalog_utils.catalogAddFiles()), so that the dashboards find them without listing the run folder.
+#
+#   python job_monitor.py --jobs <dependency JSON from run_pipeline> --output s3://<run output folder>/
+#
+import os, sys, time, shutil, tempfile, boto3
+sys.path.append('global_utils/src/')
+import file_utils
+import catalog_utils
+from argparse import ArgumentParser
+
+SCRIPT_DIR = str(os.path.dirname(os.path.realpath(__file__)))
+BATCH_SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'batch.settings.json')
+# maximum number of job IDs per describe_jobs call
+DESCRIBE_JOBS_BATCH_SIZE = 100
+POLL_MIN_INTERVAL = float(os.environ.get('HUBSEQ_POLL_MIN_INTERVAL', 5))
+POLL_MAX_INTERVAL = float(os.environ.get('HUBSEQ_POLL_MAX_INTERVAL', 60))
+POLL_BACKOFF = 1.5
+# polls in a row that a job must be missing from describe_jobs before it is LOST - new jobs may take a moment to show up
+MISSING_JOB_POLLS = int(os.environ.get('HUBSEQ_MISSING_JOB_POLLS', 5))
+LOST_STATE = 'LOST'
+TERMINAL_STATES = ['SUCCEEDED', 'FAILED', LOST_STATE]
+
+
+def getMonitoredJobs( dependency_dict ):
+    """ Flattens the dependency dictionary returned by run_pipeline into the jobs to monitor.
+
+    >>> getMonitoredJobs( {'fastqc': {'S1': {'job_id': 'a'}, 'S2': {'job_id': ''}}, 'deqc': {'run_combined': {'job_id': 'b'}}} )
+    [('fastqc', 'S1', 'a'), ('deqc', 'run_combined', 'b')]
+    """
+    jobs = []
+    for module in dependency_dict:
+        for sid in dependency_dict[module]:
+            if 'job_id' in dependency_dict[module][sid] and dependency_dict[module][sid]['job_id'] != '':
+                jobs.append((module, sid, dependency_dict[module][sid]['job_id']))
+    return jobs
+
+
+def describeJobs( client, job_ids ):
+    """ Gets the current state of Batch jobs, with one describe_jobs call per 100 jobs.
+        Child jobs of array jobs (<array job ID>:<index>) can be described like any other job.
+    RETURN: {job_id: {'status', 'reason', 'created', 'started', 'stopped'}} - jobs unknown to Batch are left out
+    """
+    job_states = {}
+    for i in range(0, len(job_ids), DESCRIBE_JOBS_BATCH_SIZE):
+        response = client.describe_jobs( jobs = job_ids[i:i+DESCRIBE_JOBS_BATCH_SIZE] )
+        for job in response['jobs']:
+            # Batch timestamps are in milliseconds
+            job_states[job['jobId']] = {'status': job['status'],
+                                        'reason': job['statusReason'] if 'statusReason' in job else '',
+                                        'created': job['createdAt']/1000.0 if 'createdAt' in job else None,
+                                        'started': job['startedAt']/1000.0 if 'startedAt' in job else None,
+                                        'stopped': job['stoppedAt']/1000.0 if 'stoppedAt' in job else None}
+    return job_states
+
+
+def getNextInterval( interval, changed, min_interval = POLL_MIN_INTERVAL, max_interval = POLL_MAX_INTERVAL ):
+    """ Poll interval after a poll - back to the minimum if any job changed state, otherwise backed off up to the maximum.
+
+    >>> getNextInterval( 40, False, 5, 60 )
+    60
+    >>> getNextInterval( 40, True, 5, 60 )
+    5
+    """
+    return min_interval if changed else min(max_interval, interval * POLL_BACKOFF)
+
+
+def createRunStatus( run_status, jobs ):
+    """ Run status table: job states by module and sample, with counts by state.
+    """
+    status_counts = {}
+    for module in run_status:
+        for sid in run_status[module]:
+            status = run_status[module][sid]['status']
+            status_counts[status] = status_counts.get(status, 0) + 1
+    return {'updated': time.time(), 'jobs_total': len(jobs), 'counts': status_counts,
+            'done': all(run_status[m][s]['status'] in TERMINAL_STATES for m in run_status for s in run_status[m]),
+            'jobs': run_status}
+
+
+def writeRunStatus( run_status_json, run_folder, scratch_dir = '/tmp' ):
+    """ Writes the run status table into the run output folder. RETURN: path of run status file
+    """
+    run_status_file = file_utils.getRunStatusFile( run_folder )
+    if file_utils.inferFileSystem( run_folder ) == 's3':
+        # uploads go to a folder, under the local file name - so the scratch copy keeps the name, in a folder of its own
+        # (several monitors may run on this machine)
+        local_dir = tempfile.mkdtemp( dir = scratch_dir )
+        try:
+            local_file = file_utils.writeJSON( run_status_json, os.path.join(local_dir, file_utils.RUN_STATUS_FILE) )
+            return file_utils.uploadFile( local_file, run_status_file[0:run_status_file.rfind('/')+1] )
+        finally:
+            shutil.rmtree( local_dir, ignore_errors = True )
+    return file_utils.writeJSON( run_status_json, run_status_file )
+
+
+def updateCatalog( dependency_dict, events, run_folder ):
+    """ Adds the output files of jobs that succeeded to the file catalog, without listing any folders.
+        If the outputs of a job are not known (or are not in the catalog folder layout), the run folder is marked stale instead.
+
+    dependency_dict: {<module>: {<sample_id>: {'job_id': <job_id>, 'outputs': [<expected output file>, ...]}}}
+    events: state-transition events of jobs that succeeded
+    RETURN: number of files added to the catalog
+    """
+    output_files = []
+    all_known = True
+    for event in events:
+        job_outputs = dependency_dict[event['module']][event['sample_id']].get('outputs', [])
+        all_known = all_known and job_outputs != []
+        output_files += job_outputs
+    n_added = catalog_utils.catalogAddFiles( output_files ) if output_files != [] else 0
+    if not all_known or n_added < len(output_files):
+        catalog_utils.markCatalogStale( run_folder )
+    return n_added
+
+
+def monitorJobs( client, dependency_dict, run_folder = '', on_event = None, update_catalog = False, \
+                 min_interval = POLL_MIN_INTERVAL, max_interval = POLL_MAX_INTERVAL, timeout = None, scratch_dir = '/tmp', missing_polls = MISSING_JOB_POLLS ):
+    """ Polls the jobs of a pipeline run until all of them have finished (or until timeout seconds have passed).
+    Jobs that describe_jobs has not returned for missing_polls polls in a row are LOST.
+
+    client: boto3 Batch client
+    dependency_dict: {<module>: {<sample_id>: {'job_id': <job_id>}}}, as returned by run_pipeline
+    run_folder: run output folder to write the run status table to ('' = do not write)
+    on_event: function called with each state-transition event DICT
+    update_catalog: on job completions, add their output files to the file catalog (see updateCatalog()) and drop cached listings of the run folder
+    RETURN: run status table (see createRunStatus())
+    """
+    jobs = getMonitoredJobs( dependency_dict )
+    job_keys = {job_id: (module, sid) for module, sid, job_id in jobs}
+    run_status = {}
+    for module, sid, job_id in jobs:
+        run_status.setdefault(module, {})[sid] = {'job_id': job_id, 'status': 'SUBMITTED', 'reason': '', 'created': None, 'started': None, 'stopped': None}
+    active_job_ids = [job_id for module, sid, job_id in jobs]
+    missing_counts = {}
+    interval = min_interval
+    start_time = time.time()
+    run_status_json = createRunStatus( run_status, jobs )
+    first_poll = True
+    while active_job_ids != []:
+        events = []
+        job_states = describeJobs( client, active_job_ids )
+        for job_id in active_job_ids:
+            missing_counts[job_id] = missing_counts.get(job_id, 0) + 1 if job_id not in job_states else 0
+            if missing_counts[job_id] >= missing_polls:
+                job_states[job_id] = {'status': LOST_STATE, 'reason': 'not found by describe_jobs in {} polls'.format(missing_counts[job_id])}
+        for job_id, job_state in job_states.items():
+            if job_id not in job_keys:
+                continue
+            module, sid = job_keys[job_id]
+            if job_state['status'] != run_status[module][sid]['status']:
+                events.append({'module': module, 'sample_id': sid, 'job_id': job_id, 'from': run_status[module][sid]['status'],
+                               'to': job_state['status'], 'reason': job_state['reason'], 'time': time.time()})
+            run_status[module][sid].update(job_state)
+        for event in events:
+            print('JOB {} ({} {}): {} -> {} {}'.format(event['job_id'], event['module'], event['sample_id'], event['from'], event['to'], event['reason']))
+            if on_event != None:
+                on_event( event )
+        active_job_ids = [job_id for job_id in active_job_ids if run_status[job_keys[job_id][0]][job_keys[job_id][1]]['status'] not in TERMINAL_STATES]
+
+        if events != [] or first_poll:
+            first_poll = False
+            run_status_json = createRunStatus( run_status, jobs )
+            if run_folder != '':
+                writeRunStatus( run_status_json, run_folder, scratch_dir )
+            # new output files are in the run folder - no need to wait for the next catalog refresh
+            succeeded_events = [event for event in events if event['to'] == 'SUCCEEDED']
+            if update_catalog and run_folder != '' and succeeded_events != []:
+                file_utils.invalidateListingCache( run_folder )
+                updateCatalog( dependency_dict, succeeded_events, run_folder )
+        if active_job_ids == [] or (timeout != None and time.time() - start_time + interval > timeout):
+            break
+        interval = getNextInterval( interval, events != [], min_interval, max_interval )
+        time.sleep( interval )
+    print('RUN STATUS: {}'.format(str(run_status_json['counts'])))
+    return run_status_json
+
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    file_path_group = argparser.add_argument_group(title='Job monitor arguments')
+    file_path_group.add_argument('--jobs', help='JSON file with the job IDs and dependencies returned by run_pipeline', required=True)
+    file_path_group.add_argument('--output', help='run output folder, for the run status table', required=False, default='')
+    file_path_group.add_argument('--region', help='AWS region of Batch (default: from batch.settings.json)', required=False, default='')
+    file_path_group.add_argument('--mininterval', help='minimum poll interval in seconds', required=False, type=float, default=POLL_MIN_INTERVAL)
+    file_path_group.add_argument('--maxinterval', help='maximum poll interval in seconds', required=False, type=float, default=POLL_MAX_INTERVAL)
+    file_path_group.add_argument('--timeout', help='stop monitoring after this many seconds', required=False, type=float, default=None)
+    file_path_group.add_argument('--catalog', help='update the file catalog when jobs finish', required=False, action='store_true')
+    monitor_args = argparser.parse_args()
+    aws_region = monitor_args.region
+    if aws_region == '':
+        aws_region = file_utils.loadJSON(BATCH_SETTINGS_FILE)['aws_region']
+    run_status_json = monitorJobs( boto3.client('batch', region_name=aws_region), file_utils.loadJSON(monitor_args.jobs), monitor_args.output,
+                                   None, monitor_args.catalog, monitor_args.mininterval, monitor_args.maxinterval, monitor_args.timeout )
+    sys.exit(0 if run_status_json['done'] and 'FAILED' not in run_status_json['counts'] and LOST_STATE not in run_status_json['counts'] else 1)
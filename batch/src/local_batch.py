@@ -0,0 +1,305 @@
+#
+# local_batch
+#
+# Local stand-in for the AWS Batch client, for running and load-testing pipelines on one machine without the Batch service.
+#
+# LocalBatchClient implements the subset of the boto3 Batch client that run_batchjob, job_definitions and job_monitor use
+# (register / describe / deregister job definitions, submit_job, describe_jobs), so it can be swapped in for
+# boto3.client('batch') - see run_batchjob.setBatchExecutor() and run_pipeline --executor local.
+#
+# Jobs run in a process pool. A job waits until all jobs in its dependsOn list have succeeded (N_TO_N dependencies of
+# array jobs wait for the child job with the same index), then stays RUNNABLE for the simulated queue latency before it starts.
+# A job fails if a job it depends on fails. Job states follow Batch: SUBMITTED, PENDING, RUNNABLE, RUNNING, SUCCEEDED, FAILED.
+#
+# Runners:
+#   'docker'  - runs the module container: docker run <image> <command overrides>
+#   'command' - runs <command prefix> <command overrides>, e.g. ['python', 'run_main.py'] to run a module script without docker
+#   'none'    - runs nothing - each job just takes job_seconds, for load tests of the scheduling path
+#
+# Wall time, CPU time and queue time of each job are recorded - see getJobTimings().
+#
+import os, time, uuid, subprocess, threading
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+
+LOCAL_MAX_WORKERS = int(os.environ.get('HUBSEQ_LOCAL_MAX_WORKERS', os.cpu_count() or 1))
+LOCAL_QUEUE_LATENCY = float(os.environ.get('HUBSEQ_LOCAL_QUEUE_LATENCY', 0.0))
+LOCAL_RUNNER = os.environ.get('HUBSEQ_LOCAL_RUNNER', 'docker')
+LOCAL_REGION = 'local'
+LOCAL_RUNNERS = ['docker', 'command', 'none']
+TERMINAL_STATES = ['SUCCEEDED', 'FAILED']
+# operations that get_paginator() supports
+LOCAL_PAGINATORS = ['describe_job_definitions']
+
+
+def _runLocalJob( command, env, job_seconds ):
+    """ Runs one job in a worker process. RETURN: (exit code, wall seconds, CPU seconds, status reason)
+    """
+    start_wall = time.time()
+    start_times = os.times()
+    if command == []:
+        time.sleep(job_seconds)
+        exit_code, reason = 0, ''
+    else:
+        try:
+            result = subprocess.run(command, env = dict(os.environ, **env), stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            exit_code = result.returncode
+            reason = '' if exit_code == 0 else result.stdout.decode('utf-8', 'replace')[-500:]
+        except OSError as e:
+            exit_code, reason = 127, str(e)
+    end_times = os.times()
+    # CPU time of the worker process itself plus the finished commands it ran
+    cpu_seconds = sum(end_times[:4]) - sum(start_times[:4])
+    return (exit_code, time.time() - start_wall, cpu_seconds, reason)
+
+
+def getLocalCommand( runner, job_definition, command_overrides, command_prefix = [], array_index = None ):
+    """ Command line to run a job locally.
+
+    >>> getLocalCommand( 'command', {'containerProperties': {'image': 'ecr/fastqc:latest'}}, ['--module_name', 'fastqc'], ['python', 'run_main.py'] )
+    ['python', 'run_main.py', '--module_name', 'fastqc']
+    >>> getLocalCommand( 'docker', {'containerProperties': {'image': 'ecr/fastqc:latest', 'vcpus': 2}}, ['--module_name', 'fastqc'], [], 3 )
+    ['docker', 'run', '--rm', '--cpus', '2', '-e', 'AWS_BATCH_JOB_ARRAY_INDEX=3', 'ecr/fastqc:latest', '--module_name', 'fastqc']
+    >>> getLocalCommand( 'none', {}, ['--module_name', 'fastqc'] )
+    []
+    """
+    if runner == 'none':
+        return []
+    elif runner == 'command':
+        return list(command_prefix) + list(command_overrides)
+    container_properties = job_definition['containerProperties']
+    docker_command = ['docker', 'run', '--rm']
+    if 'vcpus' in container_properties:
+        docker_command += ['--cpus', str(container_properties['vcpus'])]
+    if 'memory' in container_properties:
+        docker_command += ['--memory', '{}m'.format(container_properties['memory'])]
+    for env_var in container_properties.get('environment', []):
+        docker_command += ['-e', '{}={}'.format(env_var['name'], env_var['value'])]
+    if array_index != None:
+        docker_command += ['-e', 'AWS_BATCH_JOB_ARRAY_INDEX={}'.format(array_index)]
+    return docker_command + [container_properties['image']] + list(command_overrides)
+
+
+class LocalBatchClient:
+    """ boto3 Batch client stand-in that runs jobs on this machine - see the module description.
+
+    max_workers: maximum number of jobs running at the same time
+    queue_latency: seconds a job stays RUNNABLE before it starts, to simulate Batch scheduling delays
+    runner: 'docker', 'command' or 'none'
+    command_prefix: command to run the container command overrides with, for the 'command' runner
+    job_seconds: run time of each job, for the 'none' runner
+    """
+    def __init__( self, max_workers = LOCAL_MAX_WORKERS, queue_latency = LOCAL_QUEUE_LATENCY, runner = LOCAL_RUNNER, \
+                  command_prefix = [], job_seconds = 0.0, region_name = LOCAL_REGION ):
+        if runner not in LOCAL_RUNNERS:
+            raise ValueError('Unknown local runner {} - must be one of {}'.format(runner, str(LOCAL_RUNNERS)))
+        self.meta = SimpleNamespace( region_name = region_name )
+        self.queue_latency = queue_latency
+        self.runner = runner
+        self.command_prefix = command_prefix
+        self.job_seconds = job_seconds
+        self._pool = ProcessPoolExecutor( max_workers = max(1, max_workers) )
+        self._lock = threading.RLock()
+        self._done = threading.Condition( self._lock )
+        self._job_definitions = {}
+        self._jobs = {}
+        # jobs waiting for their dependencies, in submission order
+        self._waiting = []
+
+    #####################################################
+    # JOB DEFINITIONS
+    #####################################################
+
+    def register_job_definition( self, jobDefinitionName, type = 'container', containerProperties = {}, retryStrategy = {}, **kwargs ):
+        with self._lock:
+            revision = 1 + max([d['revision'] for d in self._job_definitions.values() if d['jobDefinitionName'] == jobDefinitionName] + [0])
+            job_def_arn = 'arn:local:batch:{}:job-definition/{}:{}'.format(self.meta.region_name, jobDefinitionName, revision)
+            self._job_definitions[job_def_arn] = {'jobDefinitionName': jobDefinitionName, 'jobDefinitionArn': job_def_arn, 'revision': revision,
+                                                  'status': 'ACTIVE', 'type': type, 'containerProperties': containerProperties,
+                                                  'retryStrategy': retryStrategy}
+            return {'jobDefinitionName': jobDefinitionName, 'jobDefinitionArn': job_def_arn, 'revision': revision}
+
+    def describe_job_definitions( self, jobDefinitions = [], jobDefinitionName = None, status = None, **kwargs ):
+        with self._lock:
+            job_defs = [dict(d) for d in self._job_definitions.values()
+                        if (jobDefinitions == [] or d['jobDefinitionArn'] in jobDefinitions) and
+                           (jobDefinitionName == None or d['jobDefinitionName'] == jobDefinitionName) and
+                           (status == None or d['status'] == status)]
+        return {'jobDefinitions': job_defs}
+
+    def deregister_job_definition( self, jobDefinition ):
+        with self._lock:
+            if jobDefinition in self._job_definitions:
+                self._job_definitions[jobDefinition]['status'] = 'INACTIVE'
+        return {}
+
+    def get_paginator( self, operation_name ):
+        # only job definitions are listed page by page (see job_definitions) - describe_jobs has no paginator in boto3 either
+        if operation_name not in LOCAL_PAGINATORS:
+            raise ValueError('LocalBatchClient has no paginator for {} - supported: {}'.format(str(operation_name), ', '.join(LOCAL_PAGINATORS)))
+        # everything fits on one page
+        return SimpleNamespace( paginate = lambda **kwargs: iter([self.describe_job_definitions( **kwargs )]) )
+
+    #####################################################
+    # JOBS
+    #####################################################
+
+    def submit_job( self, jobName, jobQueue, jobDefinition, containerOverrides = {}, dependsOn = [], arrayProperties = {}, **kwargs ):
+        with self._lock:
+            if jobDefinition not in self._job_definitions or self._job_definitions[jobDefinition]['status'] != 'ACTIVE':
+                raise ValueError('Job definition {} is not registered or not ACTIVE'.format(jobDefinition))
+            job_id = str(uuid.uuid4())
+            array_size = arrayProperties['size'] if 'size' in arrayProperties else 0
+            job = self._createJob( job_id, jobName, jobQueue, jobDefinition, containerOverrides.get('command', []), dependsOn, None )
+            if array_size > 0:
+                job['arrayProperties'] = {'size': array_size}
+                job['children'] = [self._createJob( '{}:{}'.format(job_id, i), jobName, jobQueue, jobDefinition, containerOverrides.get('command', []),
+                                                    self._getChildDependencies( dependsOn, i ), i )['jobId'] for i in range(array_size)]
+                # the child jobs run - the array job itself only follows their states
+                self._waiting += job['children']
+            else:
+                self._waiting.append(job_id)
+            self._schedule()
+        return {'jobName': jobName, 'jobId': job_id}
+
+    def describe_jobs( self, jobs = [] ):
+        with self._lock:
+            job_list = []
+            for job_id in jobs:
+                if job_id in self._jobs:
+                    job = self._jobs[job_id]
+                    job_json = {k: job[k] for k in ['jobId', 'jobName', 'jobQueue', 'jobDefinition', 'status', 'statusReason', 'createdAt']}
+                    for k in ['startedAt', 'stoppedAt', 'arrayProperties']:
+                        if k in job:
+                            job_json[k] = job[k]
+                    job_json['dependsOn'] = list(job['dependsOn'])
+                    if 'exitCode' in job:
+                        job_json['container'] = {'exitCode': job['exitCode']}
+                    job_list.append(job_json)
+        return {'jobs': job_list}
+
+    def getJobTimings( self ):
+        """ Per-job timing of finished jobs: {job ID: {'job_name', 'status', 'queued_seconds', 'wall_seconds', 'cpu_seconds'}}
+            Array parent jobs are left out - their child jobs are listed.
+        """
+        with self._lock:
+            return {job_id: {'job_name': job['jobName'], 'status': job['status'], 'queued_seconds': job['queuedSeconds'],
+                             'wall_seconds': job['wallSeconds'], 'cpu_seconds': job['cpuSeconds']}
+                    for job_id, job in self._jobs.items() if 'children' not in job and 'wallSeconds' in job}
+
+    def wait( self, job_ids = None, timeout = None ):
+        """ Waits until the given jobs (default: all jobs) have finished. RETURN: True if they all finished before timeout
+        """
+        end_time = time.time() + timeout if timeout != None else None
+        with self._done:
+            while any(self._jobs[j]['status'] not in TERMINAL_STATES for j in (job_ids if job_ids != None else list(self._jobs.keys())) if j in self._jobs):
+                remaining = end_time - time.time() if end_time != None else None
+                if remaining != None and remaining <= 0:
+                    return False
+                self._done.wait( remaining )
+        return True
+
+    def shutdown( self ):
+        """ Waits for all jobs, then stops the worker processes.
+        """
+        self.wait()
+        self._pool.shutdown()
+
+    #####################################################
+    # SCHEDULING - all methods below are called with self._lock held
+    #####################################################
+
+    def _createJob( self, job_id, job_name, job_queue, job_definition, command, depends_on, array_index ):
+        self._jobs[job_id] = {'jobId': job_id, 'jobName': job_name, 'jobQueue': job_queue, 'jobDefinition': job_definition,
+                              'command': command, 'dependsOn': list(depends_on), 'arrayIndex': array_index,
+                              'status': 'SUBMITTED', 'statusReason': '', 'createdAt': int(time.time()*1000)}
+        return self._jobs[job_id]
+
+    def _getChildDependencies( self, depends_on, array_index ):
+        # an N_TO_N dependency on an array job is a dependency of each child job on the child job with the same index
+        child_depends_on = []
+        for dep in depends_on:
+            if dep.get('type') == 'N_TO_N':
+                child_depends_on.append({'jobId': '{}:{}'.format(dep['jobId'], array_index)})
+            else:
+                child_depends_on.append({'jobId': dep['jobId']})
+        return child_depends_on
+
+    def _schedule( self ):
+        """ Moves waiting jobs whose dependencies have all succeeded to RUNNABLE, and fails jobs with a failed dependency.
+        """
+        still_waiting = []
+        for job_id in self._waiting:
+            job = self._jobs[job_id]
+            dep_states = [self._jobs[dep['jobId']]['status'] if dep['jobId'] in self._jobs else 'FAILED' for dep in job['dependsOn']]
+            if 'FAILED' in dep_states:
+                self._finishJob( job, 'FAILED', 'Dependent Job failed' )
+            elif all(state == 'SUCCEEDED' for state in dep_states):
+                job['status'] = 'RUNNABLE'
+                job['runnableAt'] = time.time()
+                self._updateArrayJob( job )
+                if self.queue_latency > 0:
+                    timer = threading.Timer( self.queue_latency, self._startJob, [job_id] )
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self._startJob( job_id )
+            else:
+                job['status'] = 'PENDING'
+                self._updateArrayJob( job )
+                still_waiting.append(job_id)
+        self._waiting = still_waiting
+
+    def _startJob( self, job_id ):
+        with self._lock:
+            job = self._jobs[job_id]
+            job_definition = self._job_definitions[job['jobDefinition']]
+            command = getLocalCommand( self.runner, job_definition, job['command'], self.command_prefix, job['arrayIndex'] )
+            env = {'AWS_BATCH_JOB_ID': job_id}
+            if job['arrayIndex'] != None:
+                env['AWS_BATCH_JOB_ARRAY_INDEX'] = str(job['arrayIndex'])
+            job['status'] = 'RUNNING'
+            job['startedAt'] = int(time.time()*1000)
+            job['queuedSeconds'] = time.time() - job['runnableAt']
+            self._updateArrayJob( job )
+            future = self._pool.submit( _runLocalJob, command, env, self.job_seconds )
+        future.add_done_callback( lambda f: self._onJobDone( job_id, f ) )
+
+    def _onJobDone( self, job_id, future ):
+        with self._lock:
+            job = self._jobs[job_id]
+            try:
+                exit_code, job['wallSeconds'], job['cpuSeconds'], reason = future.result()
+            except Exception as e:
+                exit_code, job['wallSeconds'], job['cpuSeconds'], reason = 1, 0.0, 0.0, str(e)
+            job['exitCode'] = exit_code
+            self._finishJob( job, 'SUCCEEDED' if exit_code == 0 else 'FAILED', reason if exit_code != 0 else 'Essential container in task exited' )
+            self._schedule()
+
+    def _finishJob( self, job, status, reason ):
+        job['status'] = status
+        job['statusReason'] = reason
+        job['stoppedAt'] = int(time.time()*1000)
+        job.setdefault('queuedSeconds', 0.0)
+        job.setdefault('wallSeconds', 0.0)
+        job.setdefault('cpuSeconds', 0.0)
+        self._updateArrayJob( job )
+        self._done.notify_all()
+
+    def _updateArrayJob( self, child_job ):
+        """ The state of an array job follows its child jobs.
+        """
+        if child_job['arrayIndex'] == None:
+            return
+        parent = self._jobs[child_job['jobId'].split(':')[0]]
+        child_states = [self._jobs[c]['status'] for c in parent['children']]
+        if all(state in TERMINAL_STATES for state in child_states):
+            parent['status'] = 'FAILED' if 'FAILED' in child_states else 'SUCCEEDED'
+            parent['stoppedAt'] = int(time.time()*1000)
+        elif any(state in ['RUNNING', 'SUCCEEDED', 'FAILED'] for state in child_states):
+            parent['status'] = 'RUNNING'
+            parent.setdefault('startedAt', int(time.time()*1000))
+        elif any(state == 'RUNNABLE' for state in child_states):
+            parent['status'] = 'RUNNABLE'
+        else:
+            parent['status'] = 'PENDING'
@@ -0,0 +1,343 @@
+#
+# pipeline_plan
+#
+# Compiles a pipeline run - <pipeline>.pipeline.yaml plus run_pipeline arguments - into an immutable plan:
+# one level per module to run, one node per (module, sample) with its resolved input/output paths and the nodes it depends on.
+#
+# The plan is computed once, before anything is submitted, and can be saved to / loaded from JSON,
+# so the same plan can be dry-run, inspected and then submitted (see run_pipeline --planonly / --plan).
+#
+#   plan = compilePipelinePlan( args_json )
+#   savePlan( plan, 'myrun.plan.json' )
+#
+import os, sys, json, yaml
+from collections import namedtuple
+from pathlib import Path
+from datetime import datetime
+sys.path.append('global_utils/src/')
+import file_utils
+
+CLIENT_BASE_DIR = 'hubtenants'
+PLAN_VERSION = '20221019'
+
+# one job: a module run on one sample (or on a merged sample ID). depends_on: tuple of (module, sample_id) of the nodes it waits for
+# expected_outputs: tuple of the output files the job should write (from the 'output' patterns of the pipeline YAML)
+PlanNode = namedtuple('PlanNode', ['module', 'submodule', 'sample_id', 'level', 'input_files', 'output', \
+                                   'alternate_inputs', 'alternate_outputs', 'module_args', 'depends_on', 'expected_outputs'])
+# all jobs of one module - submitted together, after all previous levels
+PlanLevel = namedtuple('PlanLevel', ['level', 'module', 'submodule', 'module_type', 'previous_modules', 'nodes'])
+PipelinePlan = namedtuple('PipelinePlan', ['version', 'pipeline', 'genome', 'teamid', 'userid', 'runid', 'base_output_dir', 'levels'])
+
+
+def getDateAsString():
+    """ move this to utils eventually
+    """
+    return datetime.now().strftime("%Y%m%d-%H%M")
+
+def cleanList( mylist, remove_chars ):
+    """ Cleans up list - removes chars before and after elements.
+        Move this to utils eventually
+    """
+    return list(map(lambda x: x.lstrip(remove_chars).rstrip(remove_chars), mylist))
+
+def parseStringList( strlist ):
+    listout = []
+    curr_str = ''
+    prev_char = ""
+    for e in strlist:
+        if e == ',' and prev_char in ["'", '"']:
+            listout.append(curr_str)
+            curr_str = ''
+        elif e in ["'", '"']:
+            pass
+        else:
+            curr_str += e
+        prev_char = e
+    listout.append(curr_str)
+    return listout
+
+def replaceInString( s, replace_dict ):
+    """ Replace all keys found in s with their values. This should go in utils at some point.
+    >>> replaceInString( 's3://foo/<run_id>/<sample_id>.out', {'<run_id>': 'RUN1', '<sample_id>': 'sample1'})
+    's3://foo/RUN1/sample1.out'
+    """
+    s_out = s
+    for k, v in replace_dict.items():
+        s_out = s_out.replace(k, v)
+    return s_out
+
+def mergeOrdered( L1, L2 ):
+    """ Merges two lists without duplicates, keeping the order of first appearance - so that plans are deterministic.
+
+    >>> mergeOrdered( ['S2', 'S1'], ['S1', 'S3'] )
+    ['S2', 'S1', 'S3']
+    """
+    return list(dict.fromkeys(L1 + L2))
+
+
+def getModuleIndex( module_list ):
+    """ Maps each module name to its position in a DAG or module list.
+        Module List may contain special characters.
+        Example module list: ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2']
+
+    >>> getModuleIndex( ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2'] )['bwamem']
+    2
+    """
+    module_index = {}
+    for j in range(0, len(module_list)):
+        # a given step in DAG may allow multiple modules
+        for m in cleanList(module_list[j].split(','), ' ^*~'):
+            module_index[m] = j
+    return module_index
+
+
+def getPreviousModules( current_module, initial_module, dag_index, module_index, pipeline_dict ):
+    """ Gets the previous module(s) in DAG workflow.
+        Example DAG: ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2']
+        Example submitted workflow: ['fastqc', 'rnastar', 'expressionqc']
+
+        dag_index, module_index: see getModuleIndex() - for the DAG ('order' in the pipeline YAML) and for the submitted modules
+        Returns list of previous modules
+    """
+    dag_modules = pipeline_dict['order']
+    if current_module in dag_index and initial_module in dag_index:
+        if 'previous_module' not in pipeline_dict[current_module]:
+            for j in range(dag_index[initial_module], dag_index[current_module])[::-1]:
+                # current modules in search
+                for m in cleanList(dag_modules[j].split(','), ' '):
+                    if m[0] != '*' and m in module_index:
+                        return [m]
+        else:
+            return pipeline_dict[current_module]['previous_module'].split(',')
+    return []
+
+
+def createFilePath( output_base_dir, file_pattern_list, module_type, prev_module_type, sid, sids ):
+    """ Creates a list of file paths for given module
+        output_base_dir: output base directory
+        file_pattern_list: file pattern to create - e.g., ['<sample_id>.bam', '<sample_id>.sam'], ['deqc.out.txt']
+        module_type: linear or merge
+        prev_module_type: module type of previous module, linear or merge
+        sid: current sample id
+        sids: all sample ids
+    """
+    outfiles = []
+    if module_type.lower() == 'merge' and prev_module_type.lower() == 'linear':
+        for f in file_pattern_list:
+            for s in sids:
+                outfiles.append(os.path.join(output_base_dir, f.replace('<sample_id>', s).replace('<folder>', '')))
+    else:  # module_type = linear
+        for f in file_pattern_list:
+            outfiles.append(os.path.join(output_base_dir, f.replace('<sample_id>', sid).replace('<folder>', '')))
+    return outfiles
+
+
+def getPreviousOutput( base_output_dir, curr_module, prev_modules, curr_sid, all_sids, pipeline_dict ):
+    """ Gets the previous output files as input files for current module.
+        If files not found, then empty list is returned.
+    """
+    input_files = []
+    for prev_module in prev_modules:
+        if prev_module != '':
+            prev_module_output_dir = os.path.join(base_output_dir, prev_module)
+            # lstrip rstrip are to remove spaces in a comma-separated list
+            prev_module_output_file_extensions = cleanList(pipeline_dict[curr_module]['input_file'].split(','), ' ')
+            for e in prev_module_output_file_extensions:
+                if e != '' and '<folder>' not in e:
+                    input_files = mergeOrdered( input_files, createFilePath( prev_module_output_dir, cleanList(pipeline_dict[prev_module]['output'].split(','), ' '), \
+                                                                             pipeline_dict[curr_module]['module_type'], pipeline_dict[prev_module]['module_type'], curr_sid, all_sids ))
+                else:
+                    input_files.append( replaceInString(e, {'<sample_id>': curr_sid, '<folder>': prev_module_output_dir}).rstrip('/')+'/' )
+    return input_files
+
+
+def getCurrentOutput( base_output_dir, module, pipeline_dict ):
+    """ Gets current output files or directory
+    """
+    return os.path.join( base_output_dir, module ).rstrip('/')+'/'
+
+
+def getExpectedOutput( output_dir, module, sid, all_sids, pipeline_dict ):
+    """ Gets the output files that a module is expected to write for a sample, from its 'output' patterns.
+        Output folders (<folder>) cannot be checked file by file, and are left out.
+
+    >>> getExpectedOutput( 's3://out/rnastar/', 'rnastar', 'S1', ['S1'], {'rnastar': {'output': '<sample_id>.bam, <sample_id>.bai', 'module_type': 'linear'}} )
+    ['s3://out/rnastar/S1.bam', 's3://out/rnastar/S1.bai']
+    """
+    if module not in pipeline_dict or 'output' not in pipeline_dict[module]:
+        return []
+    output_patterns = [f for f in cleanList(str(pipeline_dict[module]['output']).split(','), ' ') if f != '' and '<folder>' not in f]
+    module_type = pipeline_dict[module]['module_type']
+    return createFilePath( output_dir, output_patterns, module_type, module_type, sid, all_sids )
+
+
+def getSubModule( module, pipeline_dict ):
+    """ Returns subprogram name if specified in the workflow
+    """
+    if module in pipeline_dict and 'submodule' in pipeline_dict[module]:
+        return pipeline_dict[module]['submodule']
+    else:
+        return ''
+
+
+def getDependentNodes( curr_module, prev_modules, sid, level_sids, pipeline_dict ):
+    """ Gets the (module, sample_id) nodes that a node depends on.
+        A merge after a linear module depends on all samples of that module, otherwise on the same sample.
+        level_sids: {<module>: LIST of sample ids planned for that module}
+    """
+    module_type = pipeline_dict[curr_module]['module_type']
+    dep_nodes = []
+    for prev_module in prev_modules:
+        if prev_module != '' and prev_module in level_sids:
+            if module_type == 'merge' and pipeline_dict[prev_module]['module_type'] == 'linear':
+                dep_nodes += [(prev_module, s) for s in level_sids[prev_module]]
+            elif sid in level_sids[prev_module]:
+                dep_nodes.append((prev_module, sid))
+    return tuple(dep_nodes)
+
+
+def compilePipelinePlan( args_json, pipeline_dict = None ):
+    """ Compiles run_pipeline arguments into a pipeline plan (see PipelinePlan) - nothing is submitted.
+        The DAG is resolved once per module; per sample, only the I/O paths and dependencies are filled in.
+
+    args_json: run_pipeline arguments - pipeline, teamid, userid, runid, modules, input, output, moduleargs, altinputs, altoutputs, sampleids
+    pipeline_dict: parsed pipeline YAML (default: read <pipeline>.pipeline.yaml)
+    """
+    # read pipeline YAML
+    pipeline = args_json['pipeline'].split('.')[0]
+    genome = args_json['pipeline'].split('.')[1] if len(args_json['pipeline'].split('.')) > 1 else 'human'
+    if pipeline_dict == None:
+        pipeline_dict = yaml.safe_load(Path('{}.pipeline.yaml'.format(pipeline)).read_text())
+
+    # teamid, userid, runid
+    teamid = args_json['teamid']
+    userid = args_json['userid']
+    runid = args_json['runid'] if ('runid' in args_json and args_json['runid']!='') else '{}-{}'.format(userid, getDateAsString())
+    # get list of modules and module arguments the user wants to run
+    module_list = args_json['modules'].split(',')
+    module_args_list = parseStringList(args_json['moduleargs']) if ('moduleargs' in args_json and args_json['moduleargs'] not in ['', []]) else ['']*len(module_list)
+    alt_input_list = parseStringList(args_json['altinputs']) if ('altinputs' in args_json and args_json['altinputs'] not in ['', []]) else ['']*len(module_list)
+    alt_output_list = parseStringList(args_json['altoutputs']) if ('altoutputs' in args_json and args_json['altoutputs'] not in ['', []]) else ['']*len(module_list)
+    sampleids_list = args_json['sampleids'].split(',') if ('sampleids' in args_json and args_json['sampleids'] not in ['', []]) else []
+
+    # initial input files REQUIRED - these will feed into first module. Has format {'sampleid': [files],...}
+    datafiles_list_by_group = file_utils.groupInputFilesBySample(str(args_json['input']).split(','), sampleids_list)
+    print('DATAFILES LIST BY GROUP: '+str(datafiles_list_by_group))
+
+    # base_output dir
+    base_output_dir = args_json['output'].rstrip('/')+'/' if ('output' in args_json and args_json['output'] not in ['',[]]) else 's3://{}/{}/runs/{}/'.format(CLIENT_BASE_DIR, teamid, runid)
+
+    print('BASE OUTPUT DIR '+str(base_output_dir))
+    print('PIPELINE DICT: '+str(pipeline_dict))
+    print('MODULE_list: '+str(module_list))
+
+    # resolve module positions once, instead of scanning the DAG for every sample
+    dag_index = getModuleIndex( pipeline_dict['order'] )
+    module_index = getModuleIndex( module_list )
+    initial_module = module_list[0]
+    sids_all = list(datafiles_list_by_group.keys())
+    level_sids = {}
+    levels = []
+    for i in range(0, len(module_list)):
+        module = module_list[i]
+        submodule = getSubModule( module, pipeline_dict )
+        prev_modules = getPreviousModules( module, initial_module, dag_index, module_index, pipeline_dict )  # returns a list of previous modules
+        sids = []
+        if prev_modules != []:
+            for prev_module in prev_modules:
+                # if we merge multiple samples, then the sample ID changes to become a merged ID
+                if pipeline_dict[module]['module_type'] == 'merge' and \
+                   (prev_module in pipeline_dict and pipeline_dict[prev_module]['module_type'] == 'linear'):
+                    sids = mergeOrdered( sids, [runid+'_combined'] )
+                elif prev_module != '':
+                    sids = mergeOrdered( sids, level_sids[prev_module] if prev_module in level_sids else [] ) # otherwise the SID is the same as the previous module
+                else:
+                    sids = sids_all
+        else:
+            sids = sids_all
+
+        nodes = []
+        output_dir = getCurrentOutput( base_output_dir, module, pipeline_dict )
+        for sid in sids:
+            replace_dict = {'<run_id>': runid, '<sample_id>': sid, '<team_id>': teamid, '<user_id>': userid}
+            # input_files of this docker are the output files of the previous docker
+            input_files = getPreviousOutput( base_output_dir, module, prev_modules, sid, sids_all, pipeline_dict )
+            if input_files == []:
+                input_files = datafiles_list_by_group[sid] if sid in datafiles_list_by_group else []
+            nodes.append(PlanNode( module, submodule if submodule not in [[], None] else '', sid, i, tuple(input_files), output_dir,
+                                   replaceInString(alt_input_list[i], replace_dict) if len(alt_input_list) > i else '',
+                                   replaceInString(alt_output_list[i], replace_dict) if len(alt_output_list) > i else '',
+                                   module_args_list[i] if len(module_args_list) > i else '',
+                                   getDependentNodes( module, prev_modules, sid, level_sids, pipeline_dict ),
+                                   tuple(getExpectedOutput( output_dir, module, sid, sids_all, pipeline_dict ))))
+        level_sids[module] = sids
+        levels.append(PlanLevel( i, module, submodule if submodule not in [[], None] else '', pipeline_dict[module]['module_type'], tuple(prev_modules), tuple(nodes) ))
+        print('PLANNED MODULE {}: {} jobs, previous modules {}'.format(module, len(nodes), str(prev_modules)))
+
+    return PipelinePlan( PLAN_VERSION, pipeline, genome, teamid, userid, runid, base_output_dir, tuple(levels) )
+
+
+def getPlanNode( plan, module, sample_id ):
+    """ Gets the node of a module and sample in a plan, or None
+    """
+    for level in plan.levels:
+        if level.module == module:
+            for node in level.nodes:
+                if node.sample_id == sample_id:
+                    return node
+    return None
+
+
+def planToJSON( plan ):
+    """ Converts a plan to a JSON-serializable DICT.
+    """
+    plan_json = plan._asdict()
+    plan_json['levels'] = []
+    for level in plan.levels:
+        level_json = level._asdict()
+        level_json['previous_modules'] = list(level.previous_modules)
+        level_json['nodes'] = []
+        for node in level.nodes:
+            node_json = node._asdict()
+            node_json['input_files'] = list(node.input_files)
+            node_json['depends_on'] = [list(dep) for dep in node.depends_on]
+            node_json['expected_outputs'] = list(node.expected_outputs)
+            level_json['nodes'].append(node_json)
+        plan_json['levels'].append(level_json)
+    return plan_json
+
+
+def planFromJSON( plan_json ):
+    """ Converts a plan JSON (see planToJSON()) back to a plan.
+        Plans saved before expected outputs were planned have no expected outputs.
+
+    >>> plan = PipelinePlan( PLAN_VERSION, 'rnaseq', 'human', 't', 'u', 'r', 's3://out/', (PlanLevel( 0, 'fastqc', '', 'linear', (), (PlanNode( 'fastqc', '', 'S1', 0, ('s3://in/S1.fastq',), 's3://out/fastqc/', '', '', '', (), ('s3://out/fastqc/S1.html',) ),) ),) )
+    >>> planFromJSON( json.loads( json.dumps( planToJSON( plan )))) == plan
+    True
+    """
+    levels = []
+    for level_json in plan_json['levels']:
+        nodes = tuple(PlanNode( **dict(node_json, input_files = tuple(node_json['input_files']), \
+                                       depends_on = tuple(tuple(dep) for dep in node_json['depends_on']), \
+                                       expected_outputs = tuple(node_json.get('expected_outputs', []))) ) \
+                      for node_json in level_json['nodes'])
+        levels.append(PlanLevel( **dict(level_json, previous_modules = tuple(level_json['previous_modules']), nodes = nodes) ))
+    return PipelinePlan( **dict(plan_json, levels = tuple(levels)) )
+
+
+def savePlan( plan, plan_file ):
+    """ Saves a plan as JSON. RETURN: plan file
+    """
+    return file_utils.writeJSON( planToJSON( plan ), plan_file )
+
+
+def loadPlan( plan_file ):
+    """ Loads a plan saved with savePlan().
+    """
+    return planFromJSON( file_utils.loadJSON( plan_file ))
+
+
+def getPlanSummary( plan ):
+    """ Number of jobs per module of a plan.
+    """
+    return {level.module: len(level.nodes) for level in plan.levels}
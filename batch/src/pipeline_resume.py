@@ -0,0 +1,129 @@
+#
+# pipeline_resume
+#
+# Resume mode for pipeline runs: finds the jobs of a pipeline plan that already completed in an earlier submission of the run,
+# so that run_pipeline --resume only submits the jobs that still need to run.
+#
+# A job is complete if all of its expected output files exist and a job with its current fingerprint succeeded.
+# The fingerprint covers the job's module template (program and module versions, compute settings), arguments and I/O paths,
+# and the ETags of its initial input files - files written by earlier jobs of the run are covered by the rule that a job is
+# only complete if all the jobs it depends on are complete.
+#
+# Each job is submitted with the path of its fingerprint marker, <run folder>/.fingerprints/<module>/<sample_id>.<fingerprint>
+# (see file_utils.RUN_FINGERPRINTS_FOLDER). The job writes this empty file only after its outputs are uploaded
+# (module_utils.uploadOutput()), so a job that failed - even one that left outputs of an earlier submission behind - is never complete.
+#
+# Existing outputs are found with one listing per module output folder, markers with one listing of the fingerprints folder,
+# and input ETags with one listing per input folder.
+#
+import sys, json, hashlib
+sys.path.append('global_utils/src/')
+import file_utils
+import module_utils
+
+
+def getNodeKey( node ):
+    """ Key of a plan node in the run fingerprints: <module>/<sample_id>
+    """
+    return '{}/{}'.format(node.module, node.sample_id)
+
+
+def getRunOutputFolders( plan ):
+    """ Output folders of all modules of a plan - input files in these folders are written by jobs of the run.
+    """
+    return sorted(set(node.output for level in plan.levels for node in level.nodes))
+
+
+def _isRunOutput( f, run_output_folders ):
+    return any(f.startswith(output_folder) for output_folder in run_output_folders)
+
+
+def getInputETags( plan ):
+    """ Gets the ETags of the initial input files of a plan - input files that are not written by jobs of the run.
+        Files are listed once per parent folder. A folder input gets one ETag for all files under it.
+    RETURN: {<input file or folder>: <etag>} - '' for input files that were not found
+    """
+    run_output_folders = getRunOutputFolders( plan )
+    input_files = set(f for level in plan.levels for node in level.nodes for f in node.input_files if not _isRunOutput( f, run_output_folders ))
+    return file_utils.getFileETags( sorted(input_files) )
+
+
+def getNodeFingerprint( node, input_etags, module_template_json = {} ):
+    """ Fingerprint of a plan node: hash of its module template, arguments, I/O paths and the ETags of its initial input files.
+
+    >>> from pipeline_plan import PlanNode
+    >>> node = PlanNode( 'fastqc', '', 'S1', 0, ('s3://in/S1.fastq',), 's3://out/fastqc/', '', '', '', (), ('s3://out/fastqc/S1.html',) )
+    >>> getNodeFingerprint( node, {'s3://in/S1.fastq': 'abc'} ) == getNodeFingerprint( node, {'s3://in/S1.fastq': 'abc'} )
+    True
+    >>> getNodeFingerprint( node, {'s3://in/S1.fastq': 'abc'} ) == getNodeFingerprint( node, {'s3://in/S1.fastq': 'def'} )
+    False
+    >>> getNodeFingerprint( node, {}, {'program_version': '0.11.9'} ) == getNodeFingerprint( node, {}, {'program_version': '0.12.1'} )
+    False
+    """
+    node_json = {'module': node.module, 'submodule': node.submodule, 'sample_id': node.sample_id,
+                 'input_files': list(node.input_files), 'output': node.output, 'alternate_inputs': node.alternate_inputs,
+                 'alternate_outputs': node.alternate_outputs, 'module_args': node.module_args,
+                 'expected_outputs': list(node.expected_outputs), 'module_template': module_template_json,
+                 'input_etags': [input_etags[f] for f in node.input_files if f in input_etags]}
+    return hashlib.sha1(json.dumps(node_json, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def getPlanFingerprints( plan, input_etags = None, module_templates = None ):
+    """ Fingerprints of all nodes of a plan. RETURN: {<module>/<sample_id>: <fingerprint>}
+
+    input_etags: {<input file>: <etag>} (default: see getInputETags())
+    module_templates: {(module, submodule): module template JSON} (default: load the local module templates)
+    """
+    if input_etags == None:
+        input_etags = getInputETags( plan )
+    if module_templates == None:
+        module_templates = {(level.module, level.submodule): module_utils.loadModuleTemplate( level.module, level.submodule, 'local' ) for level in plan.levels}
+    return {getNodeKey( node ): getNodeFingerprint( node, input_etags, module_templates[(level.module, level.submodule)] ) for level in plan.levels for node in level.nodes}
+
+
+def getFingerprintFile( run_folder, node, fingerprint ):
+    """ Path of the marker file that a job writes once it succeeded with the given fingerprint.
+
+    >>> from pipeline_plan import PlanNode
+    >>> node = PlanNode( 'fastqc', '', 'S1', 0, ('s3://in/S1.fastq',), 's3://out/fastqc/', '', '', '', (), () )
+    >>> getFingerprintFile( 's3://out/', node, 'abc' )
+    's3://out/.fingerprints/fastqc/S1.abc'
+    """
+    return '{}{}.{}'.format(file_utils.getRunFingerprintsFolder( run_folder ), getNodeKey( node ), fingerprint)
+
+
+def loadRunFingerprints( run_folder ):
+    """ Lists the fingerprint markers written by succeeded jobs of a run, with one listing. RETURN: set of marker file paths
+    """
+    return set(file_utils.listFileETags( file_utils.getRunFingerprintsFolder( run_folder ), True ).keys())
+
+
+def recordNodeFingerprint( run_folder, node, fingerprint, scratch_dir = '/tmp' ):
+    """ Writes the fingerprint marker of a node whose outputs were written without a job (e.g., restored from the result cache).
+    RETURN: path of marker file
+    """
+    return file_utils.touchFile( getFingerprintFile( run_folder, node, fingerprint ), scratch_dir )
+
+
+def findCompletedNodes( plan, fingerprints, run_fingerprints ):
+    """ Finds the nodes of a plan whose jobs already completed, level by level.
+        A node is complete if it has expected outputs and all of them exist, a job with its current fingerprint succeeded,
+        and all nodes it depends on are complete. Each module output folder is listed once.
+
+    fingerprints: current fingerprints of the plan nodes - see getPlanFingerprints()
+    run_fingerprints: fingerprint markers of succeeded jobs of the run - see loadRunFingerprints()
+    RETURN: set of (module, sample_id) of completed nodes
+    """
+    completed = set()
+    folder_listings = {}
+    for level in plan.levels:
+        for node in level.nodes:
+            if node.expected_outputs == () or getFingerprintFile( plan.base_output_dir, node, fingerprints[getNodeKey( node )] ) not in run_fingerprints or \
+               any(dep not in completed for dep in node.depends_on):
+                continue
+            if node.output not in folder_listings:
+                folder_listings[node.output] = file_utils.listFileETags( node.output, True )
+            if all(f in folder_listings[node.output] for f in node.expected_outputs):
+                completed.add((node.module, node.sample_id))
+        print('RESUME MODULE {}: {} of {} jobs already completed'.format(level.module, sum(1 for node in level.nodes if (node.module, node.sample_id) in completed), len(level.nodes)))
+    return completed
@@ -17,15 +17,72 @@
 # -userid
 # -runid
 #
-import os, sys, uuid, json, boto3
+# Array jobs: args_json['array'] is a list of per-sample args JSONs (one per array index). One array job is submitted,
+# with one IO list JSON - each child job runs the IO JSON at its AWS_BATCH_JOB_ARRAY_INDEX (see module_utils.initProgram()).
+#
+# IO manifests: uploadIOManifest() writes the IO and job JSONs of many jobs of a module to one gzipped JSON-lines file,
+# uploaded once. Each job then gets args_json['run_arguments_file'] = <manifest>#<offset>:<length>, and its container reads
+# just its own entry with a ranged GET - no per-job IO / job JSON uploads.
+#
+# Executors: jobs go to AWS Batch by default. setBatchExecutor('local') submits them to a local_batch.LocalBatchClient instead,
+# which runs them in a process pool on this machine (HUBSEQ_BATCH_EXECUTOR sets the default executor).
+#
+import os, sys, uuid, time, threading, boto3
 sys.path.append('global_utils/src/')
 import module_utils
 import file_utils
+import job_definitions
+import local_batch
 from argparse import ArgumentParser
 from datetime import datetime
 
 SCRIPT_DIR = str(os.path.dirname(os.path.realpath(__file__)))
 BATCH_SETTINGS_FILE = os.path.join(SCRIPT_DIR, 'batch.settings.json')
+# AWS Batch limits on array job size
+MIN_ARRAY_SIZE = 2
+MAX_ARRAY_SIZE = 10000
+# AWS Batch limit on the number of jobs that a job can depend on
+MAX_DEPENDENCIES = 20
+BATCH_EXECUTORS = ['batch', 'local']
+BATCH_EXECUTOR = os.environ.get('HUBSEQ_BATCH_EXECUTOR', 'batch')
+
+# one Batch client per region, shared by all submission threads - boto3 clients are thread-safe, but creating them is not
+_batch_clients = {}
+_batch_clients_lock = threading.Lock()
+_batch_executor = BATCH_EXECUTOR
+_local_client_options = {}
+
+
+def setBatchExecutor( executor = 'batch', client = None, **local_options ):
+    """ Selects where jobs are submitted: 'batch' (AWS Batch) or 'local' (local_batch.LocalBatchClient).
+    client: client to use for the local executor - any object with the LocalBatchClient methods (default: a new LocalBatchClient)
+    local_options: LocalBatchClient settings - max_workers, queue_latency, runner, command_prefix, job_seconds
+    """
+    global _batch_executor, _local_client_options
+    if executor not in BATCH_EXECUTORS:
+        raise ValueError('Unknown executor {} - must be one of {}'.format(executor, str(BATCH_EXECUTORS)))
+    with _batch_clients_lock:
+        _batch_executor = executor
+        _local_client_options = local_options
+        _batch_clients.pop(local_batch.LOCAL_REGION, None)
+        if client != None:
+            _batch_clients[local_batch.LOCAL_REGION] = client
+    return executor
+
+
+def getBatchClient( aws_region ):
+    """ Batch client of the selected executor - one per region (the local executor has one client for all regions).
+    """
+    with _batch_clients_lock:
+        if _batch_executor == 'local':
+            if local_batch.LOCAL_REGION not in _batch_clients:
+                print('\nSetting up local Batch executor...')
+                _batch_clients[local_batch.LOCAL_REGION] = local_batch.LocalBatchClient( **_local_client_options )
+            return _batch_clients[local_batch.LOCAL_REGION]
+        if aws_region not in _batch_clients:
+            print('\nSetting up boto3 client in {}...'.format(aws_region))
+            _batch_clients[aws_region] = boto3.session.Session().client('batch', region_name=aws_region)
+        return _batch_clients[aws_region]
 
 
 def setJobProperties( module_name, batch_defaults_json, module_template_json):
@@ -43,6 +100,33 @@ def setJobProperties( module_name, batch_defaults_json, module_template_json):
     return job_properties
 
 
+def uploadIOManifest( args_json_list, scratch_dir = '/home/' ):
+    """ Writes the IO JSONs (and job JSONs) for a list of jobs of the same module to one IO manifest, and uploads it.
+        RETURN: LIST of copies of args_json_list, each with its 'unique_id' and its manifest entry as 'run_arguments_file'
+    """
+    if args_json_list == []:
+        return []
+    batch_defaults_json = file_utils.loadJSON(BATCH_SETTINGS_FILE)
+    module_name = args_json_list[0]['module']
+    manifest_id = str(uuid.uuid4())
+    job_submission_timestamp = str(datetime.now())
+    manifest_entries = []
+    args_json_list_out = []
+    for args_json in args_json_list:
+        unique_id = str(uuid.uuid4())
+        job_json = {'jobqueue': args_json['jobqueue'] if 'jobqueue' in args_json and args_json['jobqueue'] != '' else batch_defaults_json['jobqueue'],
+                    'jobname': module_utils.getModuleRunNameID( module_name, unique_id, 'job_name' ),
+                    'job_submission_timestamp': job_submission_timestamp}
+        manifest_entries.append({'job_id': unique_id, 'io': module_utils.createIOJSON(args_json), 'job': job_json})
+        args_json_list_out.append(dict(args_json, unique_id = unique_id))
+    manifest_name = os.path.join( scratch_dir, module_utils.getModuleRunNameID( module_name, manifest_id, 'io_manifest' ))
+    entry_refs = file_utils.writeJSONManifest( manifest_entries, manifest_name )
+    manifest_remote_path = file_utils.uploadFile(manifest_name, module_utils.getModuleIODirectory( module_name ))
+    for args_json, entry_ref in zip(args_json_list_out, entry_refs):
+        args_json['run_arguments_file'] = manifest_remote_path + '#' + entry_ref
+    return args_json_list_out
+
+
 def run_batchjob( args_json ):
 
     def getCommandArg( args_dict, _arg, _default ):        
@@ -52,7 +136,10 @@ def run_batchjob( args_json ):
         jobid_list_final=[]
         jobid_list = jobid_list.split(',') if type(getCommandArg(args_json, 'dependentid', []))==str else jobid_list
         for jobid in jobid_list:
-            if jobid != '':
+            # dependencies on array jobs may come with a type, e.g. {'jobId': <ID>, 'type': 'N_TO_N'}
+            if type(jobid) == type({}):
+                jobid_list_final.append(jobid)
+            elif jobid != '':
                 jobid_list_final.append({'jobId': jobid})
         return jobid_list_final
     
@@ -81,26 +168,43 @@ def run_batchjob( args_json ):
         mock_json = {'jobid': '5c7edea8-69d1-4c65-9d33-57e01b2e79d8', 'jobqueue': 'batch_scratch_queue_public', 'run_arguments_file': 's3://hubseq-data/modules/rnastar/io/rnastar.6b8cc8af-be08-44dc-8b26-71ad6db8c1b8.io.json', 'joboverrides': {'command': ['--module_name', 'rnastar', '--run_arguments', 's3://hubseq-data/modules/rnastar/io/rnastar.6b8cc8af-be08-44dc-8b26-71ad6db8c1b8.io.json', '--working_dir', '/home']}}
         return mock_json
 
+    # time spent in each submission stage, in seconds
+    timing = {}
+    stage_start = time.time()
+    def endStage( stage ):
+        nonlocal stage_start
+        timing[stage] = time.time() - stage_start
+        stage_start = time.time()
+
     # module template
-    module_template_file = module_utils.downloadModuleTemplate( module_name, scratch_dir, submodule_name, 'local' ) # os.path.join( os.getcwd(), module_name+'.template.json' )
-    module_template_json = file_utils.loadJSON(module_template_file)
+    module_template_json = module_utils.loadModuleTemplate( module_name, submodule_name, 'local' ) # os.path.join( os.getcwd(), module_name+'.template.json' )
+    endStage('template')
 
-    # unique ID for this job
-    unique_id = str(uuid.uuid4())
+    # unique ID for this job - jobs in an IO manifest already have one
+    unique_id = args_json['unique_id'] if 'unique_id' in args_json else str(uuid.uuid4())
+    use_manifest = 'run_arguments_file' in args_json and file_utils.isJSONManifestEntry( args_json['run_arguments_file'] )
     
-    # convert command-line string of arguments into an IO JSON
-    io_json = module_utils.createIOJSON(args_json)
-    io_json_name = os.path.join( scratch_dir, module_utils.getModuleRunNameID( module_name, unique_id, 'io_json' ))
-    file_utils.writeJSON( io_json, io_json_name )
+    # convert command-line string of arguments into an IO JSON - for array jobs, a list of IO JSONs ordered by array index
+    array_size = len(args_json['array']) if 'array' in args_json and args_json['array'] not in ['', [], None] else 0
+    if array_size > 0:
+        io_json = [module_utils.createIOJSON(array_args_json) for array_args_json in args_json['array']]
+    else:
+        io_json = module_utils.createIOJSON(args_json)
     print('ARGS JSON: '+str(args_json))
+    if use_manifest:
+        # IO JSON is already uploaded, in an IO manifest
+        io_json_remote_full_path = args_json['run_arguments_file']
+    else:
+        io_json_name = os.path.join( scratch_dir, module_utils.getModuleRunNameID( module_name, unique_id, 'io_json' ))
+        file_utils.writeJSON( io_json, io_json_name )
 
-    # upload IO JSON to module directory
-    io_json_remote_folder = file_utils.uploadFile(io_json_name, module_utils.getModuleIODirectory( module_name ))
-    io_json_remote_full_path = io_json_remote_folder #os.path.join(io_json_remote_folder, io_json_name)
+        # upload IO JSON to module directory
+        io_json_remote_folder = file_utils.uploadFile(io_json_name, module_utils.getModuleIODirectory( module_name ))
+        io_json_remote_full_path = io_json_remote_folder #os.path.join(io_json_remote_folder, io_json_name)
+    endStage('io_json')
 
     # initialize Batch boto3 client access
-    print('\nSetting up boto3 client in {}...'.format(batch_defaults_json['aws_region']))
-    client = boto3.client('batch', region_name=batch_defaults_json['aws_region'])
+    client = getBatchClient( batch_defaults_json['aws_region'] )
 
     # initialize job jobQueue and dependent IDs
     JOB_QUEUE = getCommandArg( args_json, 'jobqueue', batch_defaults_json['jobqueue'] )
@@ -120,37 +224,43 @@ def run_batchjob( args_json ):
     job_json['jobqueue'] = JOB_QUEUE
     job_json['jobname'] = job_name
     job_json['job_submission_timestamp'] = job_submission_timestamp
-    job_json_name = os.path.join( scratch_dir, module_utils.getModuleRunNameID( module_name, unique_id, 'job_json' ))
-    file_utils.writeJSON( job_json, job_json_name )
-    job_json_remote_folder = file_utils.uploadFile(job_json_name, module_utils.getModuleJobDirectory( module_name ))
-    job_json_remote_fullpath = os.path.join(job_json_remote_folder, job_json_name)
+    # jobs in an IO manifest have their job JSON in the manifest entry
+    if not use_manifest:
+        job_json_name = os.path.join( scratch_dir, module_utils.getModuleRunNameID( module_name, unique_id, 'job_json' ))
+        file_utils.writeJSON( job_json, job_json_name )
+        job_json_remote_folder = file_utils.uploadFile(job_json_name, module_utils.getModuleJobDirectory( module_name ))
+        job_json_remote_fullpath = os.path.join(job_json_remote_folder, job_json_name)
+    endStage('job_json')
 
-    job_def_name = module_utils.getModuleRunNameID( module_name, unique_id, 'job_def' )
     jobid_final = ''
+    job_def_arn = ''
     if not module_utils.isDryRun( args_json ):
-        # register job definition
-        job_def_response = client.register_job_definition( jobDefinitionName = job_def_name,
-                                                           type='container',
-                                                           retryStrategy={'attempts': 3},
-                                                           containerProperties=job_properties)
-        print('\nRegistering Job Definition: '+str(job_def_name))
+        # reuse the job definition for these container properties - registered only if it does not exist yet
+        job_def_arn = job_definitions.getJobDefinition( client, module_name, job_properties )
+        endStage('job_definition')
 
         # submit job
+        job_submit_args = {}
+        if array_size > 0:
+            job_submit_args['arrayProperties'] = {'size': array_size}
         job_submit_response = client.submit_job( jobName = job_name,
                                                  jobQueue = JOB_QUEUE,
-                                                 jobDefinition = job_def_name,
+                                                 jobDefinition = job_def_arn,
                                                  containerOverrides = job_overrides,
-                                                 dependsOn=DEPENDENT_IDS)
+                                                 dependsOn=DEPENDENT_IDS,
+                                                 **job_submit_args)
         job_name_submitted = str(job_submit_response['jobName'])
         jobid_final = str(job_submit_response['jobId'])
         print('Job submitted: '+str(job_name_submitted))
         print('Job ID: '+jobid_final)
         print('JOB SUBMISSION SUCCESS!')
+        endStage('submit_job')
     else:
         print('\nDRY RUN: nothing formally submitted to Batch.')
 
     return_json={'jobid': jobid_final, 'jobqueue': JOB_QUEUE, 'run_arguments_file': io_json_remote_full_path, \
-                 'joboverrides': job_overrides, 'sampleid': io_json['sample_id'] if 'sample_id' in io_json else ''}
+                 'joboverrides': job_overrides, 'sampleid': [j['sample_id'] for j in io_json] if array_size > 0 else (io_json['sample_id'] if 'sample_id' in io_json else ''), \
+                 'arraysize': array_size, 'jobdefinition': job_def_arn, 'timing': timing}
     print(str(return_json))
     print('\n<======================================================>\n')
     return return_json
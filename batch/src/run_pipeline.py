@@ -16,342 +16,319 @@
 # --altoutputs <LIST_OF_ALT_OUTPUTS_FOR_EACH_MODULE> - e.g., '','s3://bed/out1.bed,s3://bed/out2.bed','',... LIST SAME SIZE AS --modules.
 # --mock : for mock run
 # --dryrun : for dry run
+# --planonly : only compile the pipeline plan (see pipeline_plan.py) - with --planfile <FILE> to save it
+# --plan <PLAN_FILE> : submit a saved pipeline plan, instead of compiling one from the arguments above
+# --resume : re-run of an earlier submission - skip jobs whose outputs already exist (see pipeline_resume.py)
+# --executor <batch|local> : submit jobs to AWS Batch (default) or run them on this machine (see local_batch.py)
+# --resultcache : use the result cache (off by default, unless HUBSEQ_RESULT_CACHE is set) - jobs whose results are in the cache are not
+#                 submitted, their cached outputs are copied instead (see module_utils.restoreResultCache()), and submitted jobs add their outputs to it
 #
 # Deprecated:
 # --samples <LIST_OF_RUN:SAMPLES> - e.g., run1:sample1,run1:sample2,run2:sample1,run2:sample2
 #
 # [TO-DO]: Need to figure out specifying I/O for each module in a DAG list, in a more flexible way. Right now its rigid (fixed output names)
 #
-import os, sys, uuid, json, boto3, yaml
+import os, sys, uuid, json, time, boto3, yaml
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 sys.path.append('global_utils/src/')
 import module_utils
 import file_utils
 import aws_s3_utils
+import catalog_utils
+import job_monitor
 from argparse import ArgumentParser
 from datetime import datetime
-from run_batchjob import run_batchjob
+import pipeline_plan
+import pipeline_resume
+from pipeline_plan import getDateAsString, cleanList, parseStringList, replaceInString
+from run_batchjob import run_batchjob, getBatchClient, setBatchExecutor, uploadIOManifest, MIN_ARRAY_SIZE, MAX_ARRAY_SIZE, MAX_DEPENDENCIES, BATCH_EXECUTORS, BATCH_EXECUTOR
 
-CLIENT_BASE_DIR = 'hubtenants'
+CLIENT_BASE_DIR = pipeline_plan.CLIENT_BASE_DIR
 SCRIPT_DIR = str(os.path.dirname(os.path.realpath(__file__)))
+# maximum number of jobs submitted at the same time, within one DAG level
+SUBMIT_MAX_WORKERS = int(os.environ.get('HUBSEQ_SUBMIT_MAX_WORKERS', 16))
 
-def getDateAsString():
-    """ move this to utils eventually
-    """
-    return datetime.now().strftime("%Y%m%d-%H%M")
+MOCK_RETURN_DICT = {'fastqc': {'rnaseq_mouse_test_tiny1': {'job_id': '86126ddd-7ccf-403c-a1fe-633b5b99adad'}, 'rnaseq_mouse_test_tiny2': {'job_id': '188bc937-fa0d-4b5d-af9c-9f80c6310104'}, 'rnaseq_mouse_test_tiny4': {'job_id': '36244988-bca9-4a0e-af23-240f4ea4b320'}, 'rnaseq_mouse_test_tiny5': {'job_id': '418e2b6c-ab55-41fb-8674-7b71e26a6433'}}, 'rnastar': {'rnaseq_mouse_test_tiny1': {'job_id': '5c7edea8-69d1-4c65-9d33-57e01b2e79d8'}, 'rnaseq_mouse_test_tiny2': {'job_id': '164496e7-9269-4921-ba88-ded8faa27531'}, 'rnaseq_mouse_test_tiny4': {'job_id': '8579109c-41c6-46fc-b6c2-a0df7f7e0db2'}, 'rnaseq_mouse_test_tiny5': {'job_id': '1ac19773-46aa-465d-9c1e-076b20de2ca4'}}, 'expressionqc': {'test-20220714-1722_combined': {'job_id': 'e9c61818-bdec-4dc0-809b-95559396b515'}}, 'deseq2': {'test-20220714-1722_combined': {'job_id': '6a0b6d7f-d346-4fb5-aeaf-049a3e9c56cd'}}, 'deqc': {'test-20220714-1722_combined': {'job_id': '652d8bc8-8794-4aca-a1a6-cb1fd291a4fe'}}, 'david_go': {'test-20220714-1722_combined': {'job_id': 'ff8c849f-fdd8-4965-bd99-62be112a02bb'}}, 'goqc': {'test-20220714-1722_combined': {'job_id': '3c8621bb-2676-4282-b94d-3a7c51d3ccfd'}}}
 
-def cleanList( mylist, remove_chars ):
-    """ Cleans up list - removes chars before and after elements.
-        Move this to utils eventually
-    """
-    return list(map(lambda x: x.lstrip(remove_chars).rstrip(remove_chars), mylist))
 
-def parseStringList( strlist ):
-    listout = []
-    curr_str = ''
-    prev_char = ""
-    for e in strlist:
-        if e == ',' and prev_char in ["'", '"']:
-            listout.append(curr_str)
-            curr_str = ''
-        elif e in ["'", '"']:
-            pass
-        else:
-            curr_str += e
-        prev_char = e
-    listout.append(curr_str)
-    return listout
+def run_pipeline( args_json, return_timing = False ):
+    """ Submits batch jobs for all modules and samples of a pipeline run.
+    The run is first compiled into a pipeline plan (see pipeline_plan.compilePipelinePlan()), or loaded from args_json['plan'],
+    and the plan is then executed by executePipelinePlan().
+    With args_json['planonly'], the plan is only compiled (and saved to args_json['planfile'], if given), and nothing is submitted.
 
-def replaceInString( s, replace_dict ):
-    """ Replace all keys found in s with their values. This should go in utils at some point.
-    >>> replaceInString( 's3://foo/<run_id>/<sample_id>.out', {'<run_id>': 'RUN1', '<sample_id>': 'sample1'})
-    's3://foo/RUN1/sample1.out'
+    RETURN: dependency_dict - {<module>: {<sample_id>: {'job_id': <job_id>, 'outputs': <expected output files>}}}
+            (array jobs also add 'array_job_id' and 'array_index' for each sample)
+            and, if return_timing is True, a timing DICT - see executePipelinePlan() - that also has the run output folder, as 'base_output_dir'
+            For plan-only runs, the plan JSON is returned instead.
     """
-    s_out = s
-    for k, v in replace_dict.items():
-        s_out = s_out.replace(k, v)
-    return s_out
-
-def run_pipeline( args_json ):
-    global SCRIPT_DIR
+    if 'plan' in args_json and args_json['plan'] not in ['', None]:
+        plan = pipeline_plan.loadPlan( args_json['plan'] )
+        print('LOADED PIPELINE PLAN {}: {}'.format(args_json['plan'], str(pipeline_plan.getPlanSummary( plan ))))
+    else:
+        plan = pipeline_plan.compilePipelinePlan( args_json )
+    if 'planfile' in args_json and args_json['planfile'] not in ['', None]:
+        print('SAVED PIPELINE PLAN: '+str(pipeline_plan.savePlan( plan, args_json['planfile'] )))
+    if 'planonly' in args_json and (args_json['planonly'] == True or str(args_json['planonly']).upper()[0:1] == 'T'):
+        return pipeline_plan.planToJSON( plan )
 
-    def moduleIndex(current_module, module_list):
-        """ Module List may contain special characters.
-            Example module list: ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2']
+    # if this is a mock run, output parameters with a mock dependencies list, and return
+    if 'mock' in args_json and (args_json['mock'] == True or str(args_json['mock']).upper()[0] == 'T'):
+        print('MOCK RUN')
+        mock_return_dict = MOCK_RETURN_DICT
+        return (mock_return_dict, {}) if return_timing else mock_return_dict
 
-        >>> moduleIndex( 'expressionqc', ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2'])
-        3
-        """
-        i = -1
-        for j in range(0,len(module_list)):
-            # a given step in DAG may allow multiple modules
-            modules = cleanList(module_list[j].split(','), ' ^*~')
-            for m in modules:
-                if current_module == m:
-                    i = j
-                    break
-        return i
+    dependency_dict, timing = executePipelinePlan( plan, args_json )
+    timing['base_output_dir'] = plan.base_output_dir
+    return (dependency_dict, timing) if return_timing else dependency_dict
 
-    def getPreviousModule( current_module, initial_module, module_list, pipeline_dict ):
-        """ Gets the previous module(s) in DAG workflow.
-            Example DAG: ['bcl2fastq', '*fastqc', 'rnastar, bwamem', 'expressionqc', 'deseq2']
-            Example submitted workflow: ['fastqc', 'rnastar', 'expressionqc']
 
-            Returns list of previous modules
-    
-            [TO-DO] Needs some error checking
-        """
-        dag_modules = pipeline_dict['order']
-        i = moduleIndex(current_module, dag_modules)
-        start = moduleIndex(initial_module, dag_modules)
-        if i != -1 and start != -1:
-            if 'previous_module' not in pipeline_dict[current_module]:
-                for j in range(start,i)[::-1]:
-                    # current modules in search
-                    loop_modules = cleanList(dag_modules[j].split(','), ' ')
-                    for m in loop_modules:
-                        if m[0] != '*' and moduleIndex(m, module_list) != -1:
-                            return [m]
-            else:
-                return pipeline_dict[current_module]['previous_module'].split(',')
-        return []
+def executePipelinePlan( plan, args_json = {} ):
+    """ Submits the jobs of a pipeline plan, one level (module) at a time.
+    All samples of a module are submitted concurrently, by up to args_json['maxworkers'] threads.
+    A module is submitted only after all jobs of the previous module, so that their job IDs are known.
+    With args_json['arrayjobs'], the samples of a module are submitted as one array job instead (see submitArrayJob()).
+    With args_json['manifest'], the IO JSONs of all samples of a module are uploaded as one IO manifest (see run_batchjob.uploadIOManifest()).
+    With args_json['resume'], jobs that already completed in an earlier submission of the run are not submitted again
+    (see pipeline_resume.findCompletedNodes()). They get an empty job ID, so jobs that depend on them do not wait for them.
+    Each job is submitted with the path of its fingerprint marker, which it writes into the run output folder once it succeeded,
+    for later resumed runs.
+    With args_json['resultcache'], jobs whose result is in the result cache are not submitted either - their cached outputs
+    are copied into the run output folder instead. Only jobs whose dependencies were all skipped or cached are looked up,
+    since the inputs of the other jobs do not exist yet.
 
-    def createFilePath( output_base_dir, file_pattern_list, module_type, prev_module_type, sid, sids):
-        """ Creates a list of file paths for given module
-            output_base_dir: output base directory
-            file_pattern_list: file pattern to create - e.g., ['<sample_id>.bam', '<sample_id>.sam'], ['deqc.out.txt']
-            module_type: linear or merge
-            prev_module_type: module type of previous module, linear or merge
-            sid: current sample id
-            sids: all sample ids
-        """
-        outfiles = []
-        if module_type.lower() == 'merge' and prev_module_type.lower() == 'linear':
-            for f in file_pattern_list:
-                for s in sids:
-                    outfiles.append(os.path.join(output_base_dir, f.replace('<sample_id>', s).replace('<folder>', '')))
-        else:  # module_type = linear
-            for f in file_pattern_list:
-                outfiles.append(os.path.join(output_base_dir, f.replace('<sample_id>', sid).replace('<folder>', '')))
-        return outfiles
-    
-    def getPreviousOutput( base_output_dir, curr_module, prev_modules, curr_sid, all_sids, pipeline_dict ):
-        """ Gets the previous output files as input files for current module.
-            If files not found, then empty list is returned.
-        """
-        input_files = []
-        for prev_module in prev_modules:
-            if prev_module != '':                
-                prev_module_output_dir = os.path.join(base_output_dir, prev_module)
-                # lstrip rstrip are to remove spaces in a comma-separated list
-                prev_module_output_file_extensions = list(map(lambda x: x.lstrip(' ').rstrip(' '), \
-                                                              pipeline_dict[curr_module]['input_file'].split(',')))
-                prev_module_ignore_file_patterns = list(map(lambda x: x.lstrip(' ').rstrip(' '), \
-                                                            pipeline_dict[curr_module]['ignore'].split(','))) \
-                                                            if 'ignore' in pipeline_dict[curr_module] \
-                                                               else []
-                print('PREV MODULE FILE EXTENSIONS: '+str(prev_module_output_file_extensions))
-                for e in prev_module_output_file_extensions:
-                    if e != '' and '<folder>' not in e:
-                        print('listsubfiles args: {} {} {}'.format(str(prev_module_output_dir), str([curr_sid,'^'+e]), str(prev_module_ignore_file_patterns)))
-                        input_files = file_utils.mergeLists( input_files, createFilePath( prev_module_output_dir, cleanList(pipeline_dict[prev_module]['output'].split(','), ' '), pipeline_dict[curr_module]['module_type'], pipeline_dict[prev_module]['module_type'], curr_sid, all_sids) )
-                        # input_files = aws_s3_utils.listSubFiles(prev_module_output_dir, [sid,'^'+e], prev_module_ignore_file_patterns)
-                    else:
-                        input_files.append( replaceInString(e, {'<sample_id>': curr_sid, '<folder>': prev_module_output_dir}).rstrip('/')+'/' )
-                        # input_files.append(prev_module_output_dir.rstrip('/')+'/')
-        return input_files
+    args_json: execution settings - jobqueue, dryrun, scratchdir, arrayjobs, manifest, maxworkers, resume, resultcache
+    RETURN: dependency_dict (skipped jobs are {'job_id': '', 'skipped': True}, cached jobs {'job_id': '', 'cached': True}), and a timing DICT:
+            {'total_seconds': FLOAT, 'levels': [{'module', 'jobs', 'skipped', 'cached', 'seconds'}, ...], 'stages': {<submission stage>: total seconds over all jobs}}
+    """
+    def isTrue( _arg ):
+        return True if (_arg in args_json and (args_json[_arg] == True or str(args_json[_arg]).upper()[0:1]=='T')) else False
 
-    def getCurrentOutput( base_output_dir, module, pipeline_dict ):
-        """ Gets current output files or directory
+    def getArraySampleIds( module, dependency_dict ):
+        """ Sample IDs of a module submitted as an array job, ordered by array index - or [] if it was not an array job
         """
-        module_output_dir = os.path.join( base_output_dir, module ).rstrip('/')+'/'
-        return module_output_dir
+        if module not in dependency_dict or dependency_dict[module] == {} or \
+           not all('array_index' in job for job in dependency_dict[module].values()):
+            return []
+        return sorted(dependency_dict[module].keys(), key = lambda s: dependency_dict[module][s]['array_index'])
 
-    def getDependentIDs( curr_module, prev_modules, sid, dependency_dict, pipeline_dict):
-        """ Gets the job IDs that this current job depend on, as a list
-            dependency_dict looks like:
-            {<module>: {<sample_id>: {'job_id': <job_id>,...}}}
-           [TO-DO] need more error checking with this
+    def getDependentIDs( node, dependency_dict ):
+        """ Gets the job IDs that a plan node depends on, as a list.
+            A node that depends on all child jobs of an array job depends on the whole array job instead.
         """
-        module_type = pipeline_dict[curr_module]['module_type']
         dep_ids = []
-        for prev_module in prev_modules:
-            if prev_module != '':
-                prev_module_type = pipeline_dict[prev_module]['module_type']
-                print('CURRENT  MODULE TYPE: '+str(module_type))
-                print('PREVIOUS MODULE TYPE: '+str(prev_module_type))
-                if module_type == 'merge' and prev_module_type == 'linear':
-                    for s in dependency_dict[prev_module].keys():
-                        if 'job_id' in dependency_dict[prev_module][s] and dependency_dict[prev_module][s]['job_id'] != '':
-                            dep_ids.append(dependency_dict[prev_module][s]['job_id'])
-                else: # module_type = linear
-                    if 'job_id' in dependency_dict[prev_module][sid] and dependency_dict[prev_module][sid]['job_id'] != '':
-                        dep_ids.append(dependency_dict[prev_module][sid]['job_id'])
+        for dep_module, dep_sid in node.depends_on:
+            dep_job = dependency_dict[dep_module][dep_sid] if dep_module in dependency_dict and dep_sid in dependency_dict[dep_module] else {}
+            if 'array_job_id' in dep_job and \
+               sum(1 for m, s in node.depends_on if m == dep_module) == len(dependency_dict[dep_module]):
+                if dep_job['array_job_id'] not in ['']+dep_ids:
+                    dep_ids.append(dep_job['array_job_id'])
+            elif 'job_id' in dep_job and dep_job['job_id'] not in ['']+dep_ids:
+                dep_ids.append(dep_job['job_id'])
         return dep_ids
 
-    def getSubModule( module, pipeline_dict ):
-        """ Returns subprogram name if specified in the workflow
+    def getArrayDependentIDs( level, dependency_dict ):
+        """ Gets the dependencies of an array job for all nodes of a level, as a list.
+            A linear module that follows a linear array job over the same samples (in the same order)
+            depends on it N_TO_N: child job i starts as soon as child job i of the previous array is done.
+            Otherwise the array job depends on all jobs its samples depend on. If those are more than Batch allows
+            (MAX_DEPENDENCIES), child jobs of a previous array job are replaced by the whole array job.
+            RETURN: LIST of dependencies, or None if there are still too many - then the level cannot be one array job
         """
-        if module in pipeline_dict and 'submodule' in pipeline_dict[module]:
-            return pipeline_dict[module]['submodule']
-        else:
-            return ''
-        
-    def getModuleSampleId( dependency_dict, module ):
-        """ Gets sample IDs for the input module
-           [TO-DO] Make this more efficient. Currently looping through lists
-        """
-        samples_out = []
-        if module != '' and module in dependency_dict:
-            samples_out = list(dependency_dict[module].keys())
-        return samples_out
-    
-    def createInputJSON( module, sampleid, input_files, output_files, alt_input_files, alt_output_files, \
-                         module_args, dependent_ids, jobqueue, isdryrun, scratch_dir, submodule = '' ):
-        """ Given sample, I/O, module and job dependency information, create JSON to submit to run batch job
+        sids = [node.sample_id for node in level.nodes]
+        dep_groups = []
+        for prev_module in level.previous_modules:
+            if prev_module == '' or prev_module not in dependency_dict:
+                continue
+            prev_sids = getArraySampleIds( prev_module, dependency_dict )
+            if level.module_type == 'linear' and plan_module_types.get(prev_module) == 'linear' and prev_sids == sids:
+                array_job_id = dependency_dict[prev_module][sids[0]]['array_job_id']
+                n_to_n_ids = [{'jobId': array_job_id, 'type': 'N_TO_N'}] if array_job_id != '' else []
+                dep_groups.append((n_to_n_ids, n_to_n_ids))
+            else:
+                module_dep_ids = []
+                for node in level.nodes:
+                    prev_node = node._replace( depends_on = tuple(dep for dep in node.depends_on if dep[0] == prev_module) )
+                    module_dep_ids += [d for d in getDependentIDs( prev_node, dependency_dict ) if d not in module_dep_ids]
+                # with too many dependencies, depend on whole array jobs instead of their child jobs
+                array_job_ids = {job['job_id']: job['array_job_id'] for job in dependency_dict[prev_module].values() if job.get('array_job_id', '') != ''}
+                coarse_dep_ids = []
+                for d in module_dep_ids:
+                    if array_job_ids.get(d, d) not in coarse_dep_ids:
+                        coarse_dep_ids.append(array_job_ids.get(d, d))
+                dep_groups.append((module_dep_ids, coarse_dep_ids))
+        dep_ids = []
+        for module_dep_ids, _ in dep_groups:
+            dep_ids += [d for d in module_dep_ids if d not in dep_ids]
+        if len(dep_ids) > MAX_DEPENDENCIES:
+            dep_ids = []
+            for module_dep_ids, array_job_ids in dep_groups:
+                dep_ids += [d for d in array_job_ids if d not in dep_ids]
+        return dep_ids if len(dep_ids) <= MAX_DEPENDENCIES else None
+
+    def createInputJSON( node, dependent_ids ):
+        """ Given a plan node and its job dependencies, create JSON to submit to run batch job
         """
         input_json = {}
-        input_json['module'] = module
-        input_json['program_subname'] = submodule if submodule not in [[], None] else ''
-        input_json["sampleid"] = sampleid
-        input_json["input"] = ','.join(input_files) if type(input_files)==type([]) else input_files
-        input_json["output"] = ','.join(output_files) if type(output_files)==type([]) else output_files
+        input_json['module'] = node.module
+        input_json['program_subname'] = node.submodule
+        input_json["sampleid"] = node.sample_id
+        input_json["input"] = ','.join(node.input_files)
+        input_json["output"] = node.output
         input_json["scratchdir"] = scratch_dir
-        if alt_input_files != '' and alt_input_files != []:
-            input_json["alternate_inputs"] = alt_input_files
-        if alt_output_files != '' and alt_output_files != []:
-            input_json["alternate_outputs"] = alt_output_files
-        if module_args != '' and module_args != []:
-            input_json["pargs"] = module_args
+        if node.alternate_inputs != '':
+            input_json["alternate_inputs"] = node.alternate_inputs
+        if node.alternate_outputs != '':
+            input_json["alternate_outputs"] = node.alternate_outputs
+        if node.module_args != '':
+            input_json["pargs"] = node.module_args
         if dependent_ids != '' and dependent_ids != []:
             input_json["dependentid"] = dependent_ids
-        if jobqueue != '':
-            input_json["jobqueue"] = jobqueue
-        if isdryrun:
+        if jobQueue != '':
+            input_json["jobqueue"] = jobQueue
+        if isDryRun:
             input_json["dryrun"] = True
+        if useResultCache:
+            input_json["result_cache"] = module_utils.RESULT_CACHE_PATH
+        if not isDryRun:
+            input_json["fingerprint_file"] = pipeline_resume.getFingerprintFile( plan.base_output_dir, node, fingerprints[pipeline_resume.getNodeKey( node )] )
         return input_json
 
-    # read pipeline YAML
-    pipeline = args_json['pipeline'].split('.')[0]
-    genome = args_json['pipeline'].split('.')[1] if len(args_json['pipeline'].split('.')) > 1 else 'human'
-    pipeline_dict = yaml.safe_load(Path('{}.pipeline.yaml'.format(pipeline)).read_text())
+    def createNodeInputJSON( node ):
+        """ Creates the input JSON to run one plan node.
+            Only reads dependency_dict entries of previous modules, so nodes of the same module can be prepared in parallel.
+        """
+        return createInputJSON( node, getDependentIDs( node, dependency_dict ))
+
+    def restoreNodeResult( node ):
+        """ Copies the outputs of a plan node from the result cache, if it has a result cache hit.
+            Returns False without a lookup if a job the node depends on was submitted.
+        """
+        if any(dependency_dict[m][s]['job_id'] != '' for m, s in node.depends_on):
+            return False
+        module_template_json = module_utils.loadModuleTemplate( node.module, node.submodule, 'local' )
+        module_instance_json = module_utils.createModuleInstanceJSON( module_template_json, module_utils.createIOJSON( createInputJSON( node, [] )))
+        restored_files = module_utils.restoreResultCache( node.module, module_utils.getResultCacheKey( module_instance_json ), node.output )
+        if restored_files != None:
+            print('RESULT CACHE HIT {} {}: restored {} files'.format(node.module, node.sample_id, len(restored_files)))
+            pipeline_resume.recordNodeFingerprint( plan.base_output_dir, node, fingerprints[pipeline_resume.getNodeKey( node )], scratch_dir )
+        return restored_files != None
+
+    def submitNodeJob( node ):
+        """ Submits the batch job of one plan node.
+        """
+        # call runbatchjob()
+        job_output_json = run_batchjob( createNodeInputJSON( node ))
+        print('JOB OUTPUT JSON: '+str(job_output_json))
+        return job_output_json
+
+    def submitManifestJobs( level ):
+        """ Submits the batch jobs of all nodes of a level, with their IO JSONs in one IO manifest.
+        """
+        job_input_jsons = uploadIOManifest( list(executor.map( createNodeInputJSON, level.nodes )), scratch_dir )
+        job_output_jsons = list(executor.map( run_batchjob, job_input_jsons ))
+        for job_output_json in job_output_jsons:
+            print('JOB OUTPUT JSON: '+str(job_output_json))
+        return job_output_jsons
+
+    def submitArrayJob( level, dependent_ids ):
+        """ Submits one array job for all nodes of a level - child job k runs level.nodes[k].
+            dependent_ids are the dependencies of the array job - see getArrayDependentIDs().
+            Returns a list of job output JSONs, one per node, with the child job IDs (<array job ID>:<k>).
+        """
+        job_input_jsons = [createInputJSON( node, [] ) for node in level.nodes]
+        array_input_json = {k: v for k, v in job_input_jsons[0].items() if k not in ['sampleid', 'input', 'output', 'alternate_inputs', 'alternate_outputs', 'dependentid']}
+        array_input_json['array'] = job_input_jsons
+        if dependent_ids != []:
+            array_input_json['dependentid'] = dependent_ids
+        array_output_json = run_batchjob( array_input_json )
+        print('ARRAY JOB OUTPUT JSON: '+str(array_output_json))
+        job_output_jsons = []
+        for k in range(0, len(level.nodes)):
+            job_output_json = dict(array_output_json)
+            job_output_json['array_job_id'] = array_output_json['jobid']
+            job_output_json['array_index'] = k
+            job_output_json['jobid'] = '{}:{}'.format(array_output_json['jobid'], k) if array_output_json['jobid'] != '' else ''
+            job_output_jsons.append(job_output_json)
+        # stage timing is for the whole array - count it once
+        for job_output_json in job_output_jsons[1:]:
+            job_output_json['timing'] = {}
+        return job_output_jsons
 
-    # teamid, userid, runid
-    teamid = args_json['teamid']
-    userid = args_json['userid']
-    runid = args_json['runid'] if ('runid' in args_json and args_json['runid']!='') else '{}-{}'.format(userid, getDateAsString())
-    # initialize: get list of modules and module arguments the user wants to run, and initialize job dependencies
-    module_list = args_json['modules'].split(',')
-    module_args_list = parseStringList(args_json['moduleargs']) if ('moduleargs' in args_json and args_json['moduleargs'] not in ['', []]) else ['']*len(module_list)
-    alt_input_list = parseStringList(args_json['altinputs']) if ('altinputs' in args_json and args_json['altinputs'] not in ['', []]) else ['']*len(module_list)
-    alt_output_list = parseStringList(args_json['altoutputs']) if ('altoutputs' in args_json and args_json['altoutputs'] not in ['', []]) else ['']*len(module_list)
-    sampleids_list = args_json['sampleids'].split(',') if ('sampleids' in args_json and args_json['sampleids'] not in ['', []]) else []
     jobQueue = args_json['jobqueue'] if 'jobqueue' in args_json else ''
-    isDryRun = True if ('dryrun' in args_json and (args_json['dryrun'] == True or str(args_json['dryrun']).upper()[0]=='T')) else False
+    isDryRun = isTrue('dryrun')
     scratch_dir = args_json['scratchdir'] if 'scratchdir' in args_json and args_json['scratchdir'] != '' else '/home/'
-    
-    # initial input files REQUIRED - these will feed into first module. Has format {'sampleid': [files],...}
-    datafiles_list_by_group = file_utils.groupInputFilesBySample(str(args_json['input']).split(','), sampleids_list)
-    print('DATAFILES LIST BY GROUP: '+str(datafiles_list_by_group))
-    
-    # base_output dir
-    # base_output_dir = args_json['output'].rstrip('/')+'/' if ('output' in args_json and args_json['output'] not in ['',[]]) else 's3://{}/{}/{}/runs/{}/'.format(CLIENT_BASE_DIR, teamid, userid, runid)
-    base_output_dir = args_json['output'].rstrip('/')+'/' if ('output' in args_json and args_json['output'] not in ['',[]]) else 's3://{}/{}/runs/{}/'.format(CLIENT_BASE_DIR, teamid, runid)
-
-    print('BASE OUTPUT DIR '+str(base_output_dir))
-    print('PIPELINE DICT: '+str(pipeline_dict))
-    print('INITIAL INPUT FILES: '+str(datafiles_list_by_group))
-    print('MODULE_list: '+str(module_list))
-    print('module args list: '+str(module_args_list))
-    print('alt input list: '+str(alt_input_list))
-    print('alt output list: '+str(alt_output_list))
+    useManifest = isTrue('manifest')
+    useArrayJobs = isTrue('arrayjobs')
+    useResume = isTrue('resume')
+    useResultCache = isTrue('resultcache') and not isDryRun
+    if useResultCache and module_utils.RESULT_CACHE_PATH == '':
+        module_utils.setResultCachePath( module_utils.DEFAULT_RESULT_CACHE_PATH )
+    max_workers = int(args_json['maxworkers']) if 'maxworkers' in args_json and args_json['maxworkers'] not in ['', None] else SUBMIT_MAX_WORKERS
+    plan_module_types = {level.module: level.module_type for level in plan.levels}
     print('job queue: '+str(jobQueue))
 
-    # if this is a mock run, output parameters with a mock dependencies list, and return
-    if 'mock' in args_json and (args_json['mock'] == True or str(args_json['mock']).upper()[0] == 'T'):
-        print('MOCK RUN')
-        mock_return_dict = {'fastqc': {'rnaseq_mouse_test_tiny1': {'job_id': '86126ddd-7ccf-403c-a1fe-633b5b99adad'}, 'rnaseq_mouse_test_tiny2': {'job_id': '188bc937-fa0d-4b5d-af9c-9f80c6310104'}, 'rnaseq_mouse_test_tiny4': {'job_id': '36244988-bca9-4a0e-af23-240f4ea4b320'}, 'rnaseq_mouse_test_tiny5': {'job_id': '418e2b6c-ab55-41fb-8674-7b71e26a6433'}}, 'rnastar': {'rnaseq_mouse_test_tiny1': {'job_id': '5c7edea8-69d1-4c65-9d33-57e01b2e79d8'}, 'rnaseq_mouse_test_tiny2': {'job_id': '164496e7-9269-4921-ba88-ded8faa27531'}, 'rnaseq_mouse_test_tiny4': {'job_id': '8579109c-41c6-46fc-b6c2-a0df7f7e0db2'}, 'rnaseq_mouse_test_tiny5': {'job_id': '1ac19773-46aa-465d-9c1e-076b20de2ca4'}}, 'expressionqc': {'test-20220714-1722_combined': {'job_id': 'e9c61818-bdec-4dc0-809b-95559396b515'}}, 'deseq2': {'test-20220714-1722_combined': {'job_id': '6a0b6d7f-d346-4fb5-aeaf-049a3e9c56cd'}}, 'deqc': {'test-20220714-1722_combined': {'job_id': '652d8bc8-8794-4aca-a1a6-cb1fd291a4fe'}}, 'david_go': {'test-20220714-1722_combined': {'job_id': 'ff8c849f-fdd8-4965-bd99-62be112a02bb'}}, 'goqc': {'test-20220714-1722_combined': {'job_id': '3c8621bb-2676-4282-b94d-3a7c51d3ccfd'}}}
-        return mock_return_dict
-
     # initialize job IDs dictionary (for managing dependencies and for monitoring)
     dependency_dict = {}
-    # initial module
-    initial_module = module_list[0]
-    # list of sample ids
-    sids_all = list(datafiles_list_by_group.keys())
-    sids_previous_initial = sids_all # if sampleids_list not in [[],''] else sampleids_list
-    
-    # now step through and run any modules that appear in the module input list, for each sample
-    for i in range(0,len(module_list)):
-        print('ON MODULE....'+str(module_list[i]))
-        module = module_list[i]
-        submodule = getSubModule( module, pipeline_dict )
-        prev_modules = getPreviousModule( module, initial_module, module_list, pipeline_dict )  # returns a list of previous modules
-        moduleargs = module_args_list[i]
-        dependency_dict[module] = {}
-        sids = []
-        print('PRVEV MODULES...'+str(prev_modules))
-        if prev_modules != []:
-            for prev_module in prev_modules:
-                # if we merge multiple samples, then the sample ID changes to become a merged ID
-                if pipeline_dict[module]['module_type'] == 'merge' and \
-                   (prev_module in pipeline_dict and pipeline_dict[prev_module]['module_type'] == 'linear'):
-                    sids = file_utils.mergeLists( sids, [runid+'_combined'] )  # [sids_all[0]]  # analysis ID is just the first sample ID
-                elif prev_module != '':
-                    sids_previous = getModuleSampleId( dependency_dict, prev_module )
-                    sids = file_utils.mergeLists( sids, sids_previous ) # otherwise the SID is the same as the previous module
-                else:
-                    sids = sids_previous_initial
-        else:
-            sids = sids_previous_initial
-        print('SIDS... '+str(sids))
-        # step through each sample and run current module
-        for sid in sids:
-            print('ON SAMPLE....'+str(sid))
-            # alternate input and output files
-            alti = replaceInString(alt_input_list[i], {'<run_id>': runid, '<sample_id>': sid, '<team_id>': teamid, '<user_id>': userid}) if len(alt_input_list) > i else ''
-            alto = replaceInString(alt_output_list[i], {'<run_id>': runid, '<sample_id>': sid, '<team_id>': teamid, '<user_id>': userid}) if len(alt_output_list) > i else ''
-            # get module template file
-            module_template_file = module_utils.downloadModuleTemplate( module, scratch_dir, submodule, 'local' ) # os.path.join( os.getcwd(), module+'.template.json' ) # module_utils.downloadModuleTemplate( module, scratch_dir )
-            # input_files of this docker are the output files of the previous docker
-            # NEEDS TO HANDLE MULTIPLE PREV MODULES
-            input_files = getPreviousOutput( base_output_dir, module, prev_modules, sid, sids_all, pipeline_dict )
-            if input_files == []:
-                input_files = datafiles_list_by_group[sid]
-            print('CURR MODULE: '+str(module))
-            print('SUBMODULE: '+str(submodule))
-            print('PREV MODULES: '+str(prev_modules))
-            print('INPUT FILES: '+str(input_files))
-            print('ALT INPUT FILES: '+str(alti))
-            print('ALT OUTPUT FILES: '+str(alto))
-            
-            # set output directory for this module
-            module_output = getCurrentOutput( base_output_dir, module, pipeline_dict )
+    timing = {'total_seconds': 0.0, 'levels': [], 'stages': {}}
+    run_start = time.time()
 
-            # create JSON for inputs
-            if submodule in ['', [], None]:
-                job_input_json = createInputJSON( module, sid, input_files, module_output, \
-                                                  alti, alto, moduleargs, \
-                                                  getDependentIDs( module, prev_modules, sid, dependency_dict, pipeline_dict), \
-                                                  jobQueue, isDryRun, scratch_dir )
-            else:
-                job_input_json = createInputJSON( module, sid, input_files, module_output, \
-                                                  alti, alto, moduleargs, \
-                                                  getDependentIDs( module, prev_modules, sid, dependency_dict, pipeline_dict), \
-                                                  jobQueue, isDryRun, scratch_dir, submodule )                
-            print('JOB_INPUT_JSON: '+str(job_input_json))
+    # read each module template once up front - run_batchjob() then gets them from memory
+    module_utils.preloadModuleTemplates( [(level.module, level.submodule) for level in plan.levels], 'local' )
 
-            # call runbatchjob()
-            job_output_json = run_batchjob( job_input_json )
-            print('JOB OUTPUT JSON: '+str(job_output_json))
+    # find jobs that already completed in an earlier submission of this run
+    fingerprints = pipeline_resume.getPlanFingerprints( plan ) if (useResume or not isDryRun) else {}
+    run_fingerprints = pipeline_resume.loadRunFingerprints( plan.base_output_dir ) if useResume else set()
+    completed_nodes = pipeline_resume.findCompletedNodes( plan, fingerprints, run_fingerprints ) if useResume else set()
+
+    # now step through the plan and run each module, for each sample
+    with ThreadPoolExecutor( max_workers = max(1, max_workers) ) as executor:
+        for level in plan.levels:
+            print('ON MODULE....'+str(level.module))
+            level_start = time.time()
+            dependency_dict[level.module] = {}
+            for node in level.nodes:
+                if (node.module, node.sample_id) in completed_nodes:
+                    dependency_dict[level.module][node.sample_id] = {'job_id': '', 'skipped': True}
+            run_level = level._replace( nodes = tuple(node for node in level.nodes if (node.module, node.sample_id) not in completed_nodes) )
+            if useResultCache and run_level.nodes != ():
+                cache_hits = list(executor.map( restoreNodeResult, run_level.nodes ))
+                for node, cache_hit in zip(run_level.nodes, cache_hits):
+                    if cache_hit:
+                        dependency_dict[level.module][node.sample_id] = {'job_id': '', 'cached': True}
+                run_level = run_level._replace( nodes = tuple(node for node, cache_hit in zip(run_level.nodes, cache_hits) if not cache_hit) )
+            # an array job is not possible if it would depend on more jobs than Batch allows - its nodes are then submitted one by one
+            array_dependent_ids = getArrayDependentIDs( run_level, dependency_dict ) if useArrayJobs and MIN_ARRAY_SIZE <= len(run_level.nodes) <= MAX_ARRAY_SIZE else None
+            if run_level.nodes == ():
+                job_output_jsons = []
+            elif array_dependent_ids != None:
+                job_output_jsons = submitArrayJob( run_level, array_dependent_ids )
+            elif useManifest:
+                job_output_jsons = submitManifestJobs( run_level )
+            else:
+                # submit all nodes of this level concurrently - map() returns job outputs in the same order as the nodes
+                job_output_jsons = list(executor.map( submitNodeJob, run_level.nodes ))
 
-            # add this job to dependencies dictionary
-            if sid not in dependency_dict[module]:
-                dependency_dict[module][sid] = {}
-            dependency_dict[module][sid]['job_id'] = job_output_json['jobid']
-        # keep track of sids of previous DAG module
-        sids_previous = sids
-    return dependency_dict
+            # add these jobs to dependencies dictionary
+            for node, job_output_json in zip(run_level.nodes, job_output_jsons):
+                dependency_dict[level.module][node.sample_id] = {'job_id': job_output_json['jobid'], 'outputs': list(node.expected_outputs)}
+                if 'array_job_id' in job_output_json:
+                    dependency_dict[level.module][node.sample_id]['array_job_id'] = job_output_json['array_job_id']
+                    dependency_dict[level.module][node.sample_id]['array_index'] = job_output_json['array_index']
+                for stage, seconds in job_output_json.get('timing', {}).items():
+                    timing['stages'][stage] = timing['stages'].get(stage, 0.0) + seconds
+            cached_count = sum(1 for job in dependency_dict[level.module].values() if 'cached' in job)
+            timing['levels'].append({'module': level.module, 'jobs': len(run_level.nodes), 'skipped': len(level.nodes) - len(run_level.nodes) - cached_count,
+                                     'cached': cached_count, 'seconds': time.time() - level_start})
+            print('SUBMITTED {} JOBS FOR MODULE {} IN {:.2f} SECONDS ({} SKIPPED, {} CACHED)'.format(len(run_level.nodes), level.module, timing['levels'][-1]['seconds'],
+                                                                                                      timing['levels'][-1]['skipped'], cached_count))
+    timing['total_seconds'] = time.time() - run_start
+    # this run adds new folders under the base output dir - drop any cached listings of it, and re-check it in the file catalog.
+    # NOTE: dropped listings reach other processes (e.g., the dashboard) only with the 'sqlite' listing cache backend.
+    file_utils.invalidateListingCache( plan.base_output_dir )
+    catalog_utils.markCatalogStale( plan.base_output_dir )
+    return dependency_dict, timing
 
 
 if __name__ == '__main__':
@@ -361,12 +338,12 @@ if __name__ == '__main__':
         sys.exit(2)
     argparser = ArgumentParser()
     file_path_group = argparser.add_argument_group(title='Run batch pipeline arguments')
-    file_path_group.add_argument('--pipeline', '-p', help='<WHICH_PIPELINE_TO_RUN> - e.g., dnaseq_targeted,rnaseq', required=True)
-    file_path_group.add_argument('--teamid', help='team ID for batch runs', required=True)
-    file_path_group.add_argument('--userid', help='user ID for batch runs', required=True)
+    file_path_group.add_argument('--pipeline', '-p', help='<WHICH_PIPELINE_TO_RUN> - e.g., dnaseq_targeted,rnaseq', required=False, default='')
+    file_path_group.add_argument('--teamid', help='team ID for batch runs', required=False, default='')
+    file_path_group.add_argument('--userid', help='user ID for batch runs', required=False, default='')
     file_path_group.add_argument('--runid', help='run ID for batch runs', required=False, default='')
-    file_path_group.add_argument('--modules', '-m', help='<WHICH_MODULES_TO_RUN> - e.g., fastqc,bwamem_bam,mpileup', required=True)
-    file_path_group.add_argument('--input', '-i', help='full path of initial INPUT_FILE(S) list - e.g., s3://fastq/R1.fastq,s3://fastq/R2.fastq. Can also specify a directory and file type to get all files of a file type in a dir, e.g. s3://fastq/^fastq or s3://fastq/* for all files.', required=True)
+    file_path_group.add_argument('--modules', '-m', help='<WHICH_MODULES_TO_RUN> - e.g., fastqc,bwamem_bam,mpileup', required=False, default='')
+    file_path_group.add_argument('--input', '-i', help='full path of initial INPUT_FILE(S) list - e.g., s3://fastq/R1.fastq,s3://fastq/R2.fastq. Can also specify a directory and file type to get all files of a file type in a dir, e.g. s3://fastq/^fastq or s3://fastq/* for all files.', required=False, default='')
     file_path_group.add_argument('--output', '-o', help='full path of output directory - e.g., s3://bam/.', required=False, default='')
     file_path_group.add_argument('--moduleargs', '-ma', type=list, help='list of program args for each module, in quotes - e.g., "","-t S","",... - LIST SAME SIZE as --modules. Cannot contain file paths', required=False, default='')
     file_path_group.add_argument('--altinputs', '-alti', type=list, help='alternate input file(s) for each module, e.g., "","s3://fasta/hg38.fasta","",... LIST SAME SIZE AS --modules. ', required=False, default='')
@@ -376,7 +353,38 @@ if __name__ == '__main__':
     file_path_group.add_argument('--jobqueue', help='queue to submit batch job', required=False, default='')
     file_path_group.add_argument('--mock', help='mock run only', required=False, action='store_true')
     file_path_group.add_argument('--scratchdir', help='scratch directory for storing temp files', required=False, default='/home/')
+    file_path_group.add_argument('--arrayjobs', help='submit the samples of each module as one array job', required=False, action='store_true')
+    file_path_group.add_argument('--manifest', help='upload the IO JSONs of each module as one IO manifest', required=False, action='store_true')
+    file_path_group.add_argument('--maxworkers', help='maximum number of jobs submitted at the same time', required=False, default=SUBMIT_MAX_WORKERS)
+    file_path_group.add_argument('--timing', help='print submission timing per DAG level and per stage', required=False, action='store_true')
+    file_path_group.add_argument('--monitor', help='after submission, track job states until all jobs finish and write the run status table to the output directory', required=False, action='store_true')
+    file_path_group.add_argument('--planonly', help='only compile the pipeline plan - nothing is submitted', required=False, action='store_true')
+    file_path_group.add_argument('--planfile', help='save the pipeline plan to this JSON file', required=False, default='')
+    file_path_group.add_argument('--plan', help='submit a saved pipeline plan (JSON file)', required=False, default='')
+    file_path_group.add_argument('--resume', help='skip jobs whose outputs already exist from an earlier submission of this run', required=False, action='store_true')
+    file_path_group.add_argument('--executor', help='where to run jobs: batch (AWS Batch) or local (process pool on this machine) - default: HUBSEQ_BATCH_EXECUTOR, or batch', required=False, choices=BATCH_EXECUTORS, default=BATCH_EXECUTOR)
+    file_path_group.add_argument('--resultcache', help='copy outputs from the result cache instead of submitting jobs that already ran on the same inputs', required=False, action='store_true')
     runpipeline_args = argparser.parse_args()
-    p_out = run_pipeline( vars(runpipeline_args) )
+    if runpipeline_args.plan == '' and '' in [runpipeline_args.pipeline, runpipeline_args.teamid, runpipeline_args.userid, runpipeline_args.modules, runpipeline_args.input]:
+        argparser.error('--pipeline, --teamid, --userid, --modules and --input are required, unless a saved --plan is given')
+    setBatchExecutor( runpipeline_args.executor )
+    p_out = run_pipeline( vars(runpipeline_args), (runpipeline_args.timing or runpipeline_args.monitor) and not runpipeline_args.planonly )
+    if runpipeline_args.planonly:
+        print('PIPELINE PLAN: '+str(pipeline_plan.getPlanSummary( pipeline_plan.planFromJSON( p_out ))))
+        sys.exit(0)
+    if runpipeline_args.timing or runpipeline_args.monitor:
+        p_out, p_timing = p_out
+    if runpipeline_args.timing:
+        print('SUBMISSION TIMING: ')
+        print(p_timing)
     print('JOB IDS and DEPENDENCIES out: ')
     print(p_out)
+    if runpipeline_args.monitor and not runpipeline_args.dryrun and not runpipeline_args.mock:
+        job_monitor.monitorJobs( getBatchClient( file_utils.loadJSON(job_monitor.BATCH_SETTINGS_FILE).get('aws_region', '') ), p_out,
+                                 p_timing['base_output_dir'], update_catalog = True, scratch_dir = runpipeline_args.scratchdir )
+    # local jobs run in worker processes of this process - wait for them to finish, and report their timing
+    if runpipeline_args.executor == 'local' and not runpipeline_args.dryrun and not runpipeline_args.mock:
+        local_client = getBatchClient( '' )
+        local_client.shutdown()
+        print('LOCAL JOB TIMING: ')
+        print(local_client.getJobTimings())
@@ -8,27 +8,105 @@ import sys, os
 sys.path.append('global_utils/src/')
 import global_keys
 import file_utils
+import catalog_utils
+import aws_s3_async_utils
 
 DASHBOARD_CONFIG_DIR = './'
+# find sample files with the local file catalog (see catalog_utils) instead of listing run folders - opt-in.
+# The catalog is a sqlite file on this machine: runs submitted from other machines (run_pipeline marks only its own catalog stale)
+# show up only after up to catalog_utils.CATALOG_REFRESH_TTL seconds.
+USE_CATALOG = os.environ.get('HUBSEQ_USE_CATALOG', 'false').lower() in ['true', 't', '1', 'yes']
 
-def getSamples(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, extensions = [], extensions2exclude = []):
+def getSamples(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, extensions = [], extensions2exclude = [], use_catalog = USE_CATALOG, as_columns = False):
     """ Get all sample files and IDs of a particular file type, given the list of choices on the dashboard.
     Assumes the standard folder structure for pipeline runs.
 
     Example: dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, [], ['fastqc'], ['^HTML'])
 
     team_root_folder: STRING - 's3://' or '/'
+    use_catalog: query the local file catalog (refreshed incrementally) instead of listing run folders
+    as_columns: return DICT of data file columns (e.g., columns[global_keys.KEY_FILE_NAME]) instead of a LIST of data file JSONs
 
     Return LIST of filenames, LIST of sample IDs (ordered)
     """
+    if use_catalog:
+        return catalog_utils.queryCatalog(team_root_folder, teamid, userids, pipelineids, selected_runs if selected_runs not in [None, ''] else [],
+                                          selected_samples if selected_samples not in [None, ''] else [], moduleids, extensions, extensions2exclude, as_columns = as_columns)
     # print('GET SAMPLES PARAMS: {}'.format(str(dict(team_root_folder=team_root_folder, teamid=teamid, userids=userids, pipelineids=pipelineids, selected_runs=selected_runs, selected_samples=selected_samples, moduleids=moduleids, extensions=extensions, extension2exclude=extensions2exclude))))
+    # read all run folders and files with one listing per selected run, instead of one listing per folder
+    run_tree = file_utils.getRunTree(team_root_folder, teamid, userids, pipelineids, selected_runs if selected_runs not in [None, ''] else [])
     # get sample folders
-    data_file_folders = file_utils.getRunSampleOutputFolders(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids)
+    data_file_folders = file_utils.getRunSampleOutputFolders(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, run_tree)
     # get data files matching extension patterns in these sample folders
-    data_file_json_list = file_utils.getDataFiles(data_file_folders, extensions, extensions2exclude )
+    data_file_json_list = file_utils.getDataFiles(data_file_folders, extensions, extensions2exclude, run_tree, as_columns )
     return data_file_json_list
 
 
+async def getSamplesAsync(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, extensions = [], extensions2exclude = [], use_catalog = USE_CATALOG, as_columns = False):
+    """ Awaitable version of getSamples(), so that queries for several analyses can run concurrently.
+    """
+    return await aws_s3_async_utils.runAsync(getSamples, team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids,
+                                             extensions, extensions2exclude, use_catalog, as_columns)
+
+
+def mergeDataFileColumns( columns_list ):
+    """ Concatenates data file columns, e.g., returned by several getSamples() calls. Columns missing from some are filled with ''.
+
+    >>> mergeDataFileColumns( [{'file_name': ['a.txt'], 'sample_id': ['a']}, {'file_name': ['b.txt']}] )
+    {'file_name': ['a.txt', 'b.txt'], 'sample_id': ['a', '']}
+    """
+    keys = []
+    for columns in columns_list:
+        keys += [k for k in columns if k not in keys]
+    merged = {k: [] for k in keys}
+    for columns in columns_list:
+        n_files = max([len(v) for v in columns.values()]+[0])
+        for k in keys:
+            merged[k] += columns[k] if k in columns else ['']*n_files
+    return merged
+
+
+def getSamplesConcurrently(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, extensions = [], extensions2exclude = [], use_catalog = USE_CATALOG):
+    """ getSamples() as data file columns, for Dash callbacks. Without the file catalog, the files of each selected sample
+        are listed concurrently (see getSamplesAsync()). The catalog is a local database, so it is queried only once.
+    """
+    if use_catalog or selected_samples in [None, '', []]:
+        return getSamples(team_root_folder, teamid, userids, pipelineids, selected_runs, selected_samples, moduleids, extensions, extensions2exclude, use_catalog, True)
+    selected_samples = [selected_samples] if type(selected_samples) == type('') else selected_samples
+    return mergeDataFileColumns( aws_s3_async_utils.runSync( aws_s3_async_utils.gather( *[getSamplesAsync(team_root_folder, teamid, userids, pipelineids, selected_runs, [sample], moduleids,
+                                                                                                extensions, extensions2exclude, use_catalog, True) for sample in selected_samples] )))
+
+
+async def downloadSampleFilesAsync( data_files_remote, scratch_dir ):
+    """ Awaitable version of downloadSampleFiles().
+    Return LIST of local files (ordered as data_files_remote)
+    """
+    return await aws_s3_async_utils.runAsync(downloadSampleFiles, data_files_remote, scratch_dir)
+
+
+def downloadSampleFiles( data_files_remote, scratch_dir ):
+    """ Downloads sample data files to the dashboard scratch directory. S3 files are downloaded concurrently (see file_utils.downloadFiles()).
+    Return LIST of local files (ordered as data_files_remote)
+    """
+    return file_utils.downloadFiles(data_files_remote, scratch_dir, file_utils.inferFileSystem(data_files_remote), False, True)
+
+
+def downloadSampleFilesConcurrently( data_files_remote, scratch_dir ):
+    """ Downloads sample data files to the dashboard scratch directory, one file per call on the shared async thread pool
+        (see aws_s3_async_utils), so that all callbacks together stay within one cap on S3 calls.
+    Return LIST of local files (ordered as data_files_remote)
+    """
+    return aws_s3_async_utils.runSync( aws_s3_async_utils.gather( *[downloadSampleFilesAsync( f, scratch_dir ) for f in data_files_remote] ))
+
+
+def getRunStatus( team_root_folder, teamid, userid, pipelineid, runid ):
+    """ Gets the job status of a pipeline run, as written by the batch job monitor - instead of inferring completion from output folders.
+    Return DICT: {'counts': {<job state>: <number of jobs>}, 'done': BOOL, 'jobs': {<module>: {<sample_id>: {'job_id', 'status', ...}}}, ...}
+             or {} if the run is not monitored
+    """
+    return file_utils.loadRunStatus( os.path.join(team_root_folder, teamid, userid, pipelineid, runid) )
+
+
 def getDashboardConfigJSON( pipeline_id ):
     """ Given a pipeline ID, loads and returns a JSON containing info for loading a dashboard for this pipeline.
     Config file must be named 'dashboard_config.<PIPELINE_ID>.json'
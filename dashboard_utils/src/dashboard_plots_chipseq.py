@@ -81,13 +81,13 @@ def defineCallbacks_fastqcAnalysisDashboard(app):
         print('in CB_fastqc_analysis_dashboard callback: SELECTED ANALYSIS: {}'.format(str(selected_analysis)))
         if not dsu.selectionEmpty(selected_analysis) and not dsu.selectionEmpty(selected_samples) and dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["fastqc"] in selected_analysis:
             # get remote sample file paths and IDs for currently chosen samples
-            data_file_json_list = dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['fastqc'], ['^HTML'])
-            data_files_remote = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_NAME, '')
-            data_sample_ids = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_ID, '')
+            data_file_columns = dfu.getSamplesConcurrently(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['fastqc'], ['^HTML'])
+            data_files_remote = data_file_columns[global_keys.KEY_FILE_NAME]
+            data_sample_ids = data_file_columns[global_keys.KEY_FILE_ID]
             # ONLY update IF we have grabbed new sample data files
             if data_files_remote != dfu.getSessionDataFiles( session_dfs, pipelineid, sessionid, dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["fastqc"] ):
                 # downloads the actual data files from remote
-                data_files = file_utils.downloadFiles( data_files_remote, dsu.SCRATCH_DIR, file_utils.inferFileSystem(data_files_remote), False, True)
+                data_files = dfu.downloadSampleFilesConcurrently( data_files_remote, dsu.SCRATCH_DIR )
                 # create dashboard plots
                 graphs = []
                 graphs.append(html.P(''))
@@ -132,12 +132,12 @@ def defineCallbacks_alignmentAnalysisDashboard(app):
         if not dsu.selectionEmpty(selected_analysis) and not dsu.selectionEmpty(selected_samples) and dc.DASHBOARD_CONFIG_JSON["dashboard_ids"][WHICH_DB] in selected_analysis:
             # get sample data file paths and IDs
             # NOTE: docker is hardcoded - this need to change
-            data_file_json_list = dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['bowtie2'], ['^alignment_stats.csv'] )
-            data_files_remote = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_NAME, '')
-            data_sample_ids = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_ID, '')
+            data_file_columns = dfu.getSamplesConcurrently(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['bowtie2'], ['^alignment_stats.csv'])
+            data_files_remote = data_file_columns[global_keys.KEY_FILE_NAME]
+            data_sample_ids = data_file_columns[global_keys.KEY_FILE_ID]
             # ONLY update IF we have grabbed new data files
             if data_files_remote != dfu.getSessionDataFiles( session_dfs, pipelineid, sessionid, dc.DASHBOARD_CONFIG_JSON["dashboard_ids"][WHICH_DB] ):
-                data_files = file_utils.downloadFiles( data_files_remote, dsu.SCRATCH_DIR, file_utils.inferFileSystem(data_files_remote), False, True)
+                data_files = dfu.downloadSampleFilesConcurrently( data_files_remote, dsu.SCRATCH_DIR )
                 # create plot figures
                 alignstats_figure_list = plotAlignStats( data_files, data_sample_ids )
                 # create dashboard plots
@@ -230,13 +230,13 @@ def defineCallbacks_peakAnalysisDashboard(app):
         if not dsu.selectionEmpty(selected_analysis) and not dsu.selectionEmpty(selected_samples) and dc.DASHBOARD_CONFIG_JSON["dashboard_ids"][WHICH_DB] in selected_analysis:
             # get sample data file paths and IDs
             # NOTE: docker is hardcoded - this need to change
-            data_file_json_list = dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['macs2', 'homer'], ['^.broadPeak', '^.narrowPeak', '^.txt'] )
-            print('DATA FILE JSON LIST: '+str(data_file_json_list))
-            data_files_remote = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_NAME, '')
-            data_sample_ids = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_ID, '')
+            data_file_columns = dfu.getSamplesConcurrently(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['macs2', 'homer'], ['^.broadPeak', '^.narrowPeak', '^.txt'])
+            print('DATA FILE COLUMNS: '+str(data_file_columns))
+            data_files_remote = data_file_columns[global_keys.KEY_FILE_NAME]
+            data_sample_ids = data_file_columns[global_keys.KEY_FILE_ID]
             # ONLY update IF we have grabbed new data files
             if data_files_remote != dfu.getSessionDataFiles( session_dfs, pipelineid, sessionid, dc.DASHBOARD_CONFIG_JSON["dashboard_ids"][WHICH_DB] ):
-                data_files = file_utils.downloadFiles( data_files_remote, dsu.SCRATCH_DIR, file_utils.inferFileSystem(data_files_remote), False, True)
+                data_files = dfu.downloadSampleFilesConcurrently( data_files_remote, dsu.SCRATCH_DIR )
                 # create list of data frames that will be tables of peaks
                 peaks_df_list, peaks_df_type = getPeaksTables( data_files, data_sample_ids )
                 # create dashboard plots
@@ -79,14 +79,14 @@ def defineCallbacks_fastqcAnalysisDashboard(app):
         print('in CB_fastqc_analysis_dashboard callback: SELECTED ANALYSIS: {}'.format(str(selected_analysis)))
         if not dsu.selectionEmpty(selected_analysis) and not dsu.selectionEmpty(selected_samples) and dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["fastqc"] in selected_analysis:
             # get remote sample file paths and IDs for currently chosen samples
-            data_file_json_list = dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['fastqc'], ['^HTML'])
-            print('DATA FILE JSON LIST: '+str(data_file_json_list))
-            data_files_remote = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_NAME, '')
-            data_sample_ids = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_ID, '')
+            data_file_columns = dfu.getSamplesConcurrently(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['fastqc'], ['^HTML'])
+            print('DATA FILE COLUMNS: '+str(data_file_columns))
+            data_files_remote = data_file_columns[global_keys.KEY_FILE_NAME]
+            data_sample_ids = data_file_columns[global_keys.KEY_FILE_ID]
             # ONLY update IF we have grabbed new sample data files
             if data_files_remote != dfu.getSessionDataFiles( session_dfs, pipelineid, sessionid, dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["fastqc"] ):
                 # downloads the actual data files from remote
-                data_files = file_utils.downloadFiles( data_files_remote, dsu.SCRATCH_DIR, file_utils.inferFileSystem(data_files_remote), False, True)
+                data_files = dfu.downloadSampleFilesConcurrently( data_files_remote, dsu.SCRATCH_DIR )
                 # create dashboard plots
                 graphs = []
                 graphs.append(html.P(''))
@@ -128,12 +128,12 @@ def defineCallbacks_alignmentPanelAnalysisDashboard(app):
         print('in CB_alignment_panel_analysis_dashboard callback')
         if not dsu.selectionEmpty(selected_analysis) and not dsu.selectionEmpty(selected_samples) and dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["alignment"] in selected_analysis:
             # get sample data file paths and IDs
-            data_file_json_list = dfu.getSamples(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['bwamem_bam'], ['^alignment_stats.csv'] )
-            data_files_remote = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_NAME, '')
-            data_sample_ids = file_utils.getFromDictList(data_file_json_list, global_keys.KEY_FILE_ID, '')
+            data_file_columns = dfu.getSamplesConcurrently(dsu.ROOT_FOLDER, teamid, [userid], [pipelineid], selected_runs, selected_samples, ['bwamem_bam'], ['^alignment_stats.csv'])
+            data_files_remote = data_file_columns[global_keys.KEY_FILE_NAME]
+            data_sample_ids = data_file_columns[global_keys.KEY_FILE_ID]
             # ONLY update IF we have grabbed new data files
             if data_files_remote != dfu.getSessionDataFiles( session_dfs, pipelineid, sessionid, dc.DASHBOARD_CONFIG_JSON["dashboard_ids"]["alignment"] ):
-                data_files = file_utils.downloadFiles( data_files_remote, dsu.SCRATCH_DIR, file_utils.inferFileSystem(data_files_remote), False, True)
+                data_files = dfu.downloadSampleFilesConcurrently( data_files_remote, dsu.SCRATCH_DIR )
                 # hsmetrics_file_names, data_sample_ids = dfu.getSamples(userid, pipelineid, selected_runs, selected_sample, ['alignmentqc'], ['^hsmetrics.json'], 'JSON')
                 # create plot figures
                 alignstats_figure_list = plotAlignStats( data_files, data_sample_ids )
@@ -0,0 +1,170 @@
+#
+# aws_s3_async_utils
+#
+# asyncio versions of the aws_s3_utils functions used by the dashboards: listing, get, download, upload, JSON get/put and tagging.
+#
+# Each call runs the boto3 call on a shared, bounded thread pool (boto3 clients are thread-safe), so a Dash callback can
+# start the listing and fetching for all selected samples at once and await them together:
+#
+#   json_list = runSync( gather( *[getJSON( f ) for f in json_files] ))
+#
+# runSync() is the sync shim for callers that are not coroutines (e.g., regular Dash callbacks).
+#
+import os, json, asyncio, functools, threading
+from concurrent.futures import ThreadPoolExecutor
+import aws_s3_utils
+
+S3_ASYNC_MAX_WORKERS = int(os.environ.get('HUBSEQ_S3_ASYNC_MAX_WORKERS', 32))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _getExecutor():
+    # one pool for the whole process, so that concurrent callbacks together never exceed S3_ASYNC_MAX_WORKERS S3 calls
+    global _executor
+    with _executor_lock:
+        if _executor == None:
+            _executor = ThreadPoolExecutor( max_workers = S3_ASYNC_MAX_WORKERS )
+    return _executor
+
+
+async def runAsync( function, *args, **kwargs ):
+    """ Runs a blocking function on the shared thread pool and awaits the result.
+    """
+    return await asyncio.get_running_loop().run_in_executor( _getExecutor(), functools.partial(function, *args, **kwargs) )
+
+
+def runSync( coroutine ):
+    """ Runs a coroutine to completion from synchronous code and returns its result.
+    If this thread already runs an event loop, the coroutine runs on a new loop in a helper thread.
+
+    >>> runSync( gather( asyncio.sleep(0, 'a'), asyncio.sleep(0, 'b') ))
+    ['a', 'b']
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run( coroutine )
+    with ThreadPoolExecutor( max_workers = 1 ) as helper:
+        return helper.submit( asyncio.run, coroutine ).result()
+
+
+async def gather( *coroutines ):
+    """ Awaits several coroutines concurrently. Results are returned in the same order as the coroutines.
+    """
+    return list(await asyncio.gather( *coroutines ))
+
+
+#####################################################
+# LISTING
+#####################################################
+
+async def listSubFilesAndFolders( s3_path, patterns2include = [], patterns2exclude = [], folders2include = [], folders2exclude = [] ):
+    """ See aws_s3_utils.listSubFilesAndFolders()
+    """
+    return await runAsync( aws_s3_utils.listSubFilesAndFolders, s3_path, patterns2include, patterns2exclude, folders2include, folders2exclude )
+
+
+async def listSubFiles( s3_path, patterns2include = [], patterns2exclude = [] ):
+    """ See aws_s3_utils.listSubFiles()
+    """
+    return (await listSubFilesAndFolders( s3_path, patterns2include, patterns2exclude ))[0]
+
+
+async def listSubFolders( s3_path, folders2include = [], folders2exclude = [] ):
+    """ See aws_s3_utils.listSubFolders()
+    """
+    return (await listSubFilesAndFolders( s3_path, [], [], folders2include, folders2exclude ))[1]
+
+
+async def listMatchingKeys( s3_path, patterns2include = [], patterns2exclude = [], recursive = True ):
+    """ LIST of S3 paths of all matching files under an S3 folder - see aws_s3_utils.iterMatchingKeys_S3()
+    """
+    return await runAsync( lambda: list(aws_s3_utils.iterMatchingKeys_S3( s3_path, patterns2include, patterns2exclude, recursive )) )
+
+
+#####################################################
+# GET / DOWNLOAD / UPLOAD
+#####################################################
+
+async def getObject( s3path ):
+    """ Reads a whole S3 object into memory. RETURN: BYTES
+    """
+    return await runAsync( aws_s3_utils.getObjectRange_S3, s3path, 0, None )
+
+
+async def getObjectRange( s3path, start = 0, length = None ):
+    """ See aws_s3_utils.getObjectRange_S3()
+    """
+    return await runAsync( aws_s3_utils.getObjectRange_S3, s3path, start, length )
+
+
+async def downloadFile( s3path, dir_to_download ):
+    """ See aws_s3_utils.downloadFile_S3()
+    """
+    return await runAsync( aws_s3_utils.downloadFile_S3, s3path, dir_to_download )
+
+
+async def downloadFiles( s3paths, dir_to_download ):
+    """ Downloads S3 files concurrently. Returned local file paths are in the same order as s3paths.
+    If STRING is provided, then just one file.
+    """
+    if type(s3paths) == type(''):
+        return await downloadFile( s3paths, dir_to_download )
+    return await gather( *[downloadFile( s3path, dir_to_download ) for s3path in s3paths] )
+
+
+async def uploadFile( localfile, s3path ):
+    """ See aws_s3_utils.uploadFile_S3()
+    """
+    return await runAsync( aws_s3_utils.uploadFile_S3, localfile, s3path )
+
+
+#####################################################
+# JSON
+#####################################################
+
+async def getJSON( s3path ):
+    """ Gets the content of a JSON file in S3.
+    """
+    return json.loads( (await getObject( s3path )).decode('utf-8') )
+
+
+async def getJSONs( s3paths ):
+    """ Gets the content of several JSON files in S3 concurrently (ordered as s3paths).
+    s3paths: LIST, or string of comma-delimited S3 paths (as for aws_s3_utils.get_json_object())
+    """
+    if type(s3paths) == type(''):
+        s3paths = s3paths.split(',')
+    return await gather( *[getJSON( s3path ) for s3path in s3paths] )
+
+
+def _putJSON( s3path, json_object ):
+    bucket = s3path.split('/')[2]
+    key = '/'.join(s3path.split('/')[3:])
+    aws_s3_utils.s3_client.put_object( Bucket = bucket, Key = key, Body = json.dumps(json_object).encode('utf-8'),
+                                       ServerSideEncryption = 'AES256', ContentType = 'application/json' )
+    return s3path
+
+
+async def putJSON( s3path, json_object ):
+    """ Securely writes a JSON object to an S3 file. RETURN: S3 path
+    """
+    return await runAsync( _putJSON, s3path, json_object )
+
+
+#####################################################
+# TAGGING
+#####################################################
+
+async def getTags( s3path ):
+    """ Tags of one S3 object - see aws_s3_utils.get_metadata()
+    """
+    return (await runAsync( aws_s3_utils.get_metadata, s3path ))[0]
+
+
+async def setTags( s3path, tags_dict, overwrite = 'True' ):
+    """ Sets tags of one S3 object - see aws_s3_utils.set_metadata()
+    """
+    return (await runAsync( aws_s3_utils.set_metadata, s3path, tags_dict, overwrite ))[0]
@@ -1,8 +1,37 @@
-import os, boto3, subprocess, uuid, json, datetime
+import os, boto3, json, datetime, time, threading, fnmatch, hashlib, functools
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotoConnectionError
 from dateutil.tz import *
 
 s3 = boto3.resource('s3')
-s3_client = boto3.client('s3')
+s3_client = boto3.client('s3')  # boto3 clients (unlike resources) are thread-safe, so transfer threads share this one
+
+# parallel file transfers - see downloadFiles_S3() and uploadFiles_S3()
+S3_TRANSFER_MAX_WORKERS = int(os.environ.get('HUBSEQ_S3_TRANSFER_MAX_WORKERS', 8))
+S3_TRANSFER_RETRIES = 3
+S3_TRANSFER_BACKOFF = 1.0  # seconds before the first retry - doubles after each failure
+# only throttling, server-side (5xx), connection and timeout errors are retried - anything else (missing object, access denied, full disk) fails at once
+S3_RETRYABLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'SlowDown', 'RequestTimeout', 'RequestTimeTooSkewed',
+                            'InternalError', 'ServiceUnavailable', 'RequestLimitExceeded', 'BandwidthLimitExceeded']
+
+# multipart settings for single-file transfers - select one with setTransferProfile()
+MB = 1024*1024
+TRANSFER_PROFILES = {'default': {'multipart_threshold': 8*MB, 'multipart_chunksize': 8*MB, 'max_concurrency': 10, 'use_threads': True},
+                     'large': {'multipart_threshold': 64*MB, 'multipart_chunksize': 64*MB, 'max_concurrency': 32, 'use_threads': True},
+                     'small': {'multipart_threshold': 32*MB, 'multipart_chunksize': 8*MB, 'max_concurrency': 4, 'use_threads': True},
+                     'serial': {'multipart_threshold': 8*MB, 'multipart_chunksize': 8*MB, 'max_concurrency': 1, 'use_threads': False}}
+TRANSFER_PROFILE_KEYS = ['multipart_threshold', 'multipart_chunksize', 'max_concurrency', 'use_threads']
+S3_STREAM_CHUNK_SIZE = 1*MB
+# server-side copies - objects larger than a single CopyObject allows are copied in parts (UploadPartCopy), in parallel
+S3_COPY_MAX_SIZE = 5*1024*MB
+S3_COPY_PART_SIZE = int(os.environ.get('HUBSEQ_S3_COPY_PART_SIZE', 512*MB))
+# object headers that CopyObject keeps, and that a multipart copy must set itself
+S3_COPY_HEADERS = ['ContentType', 'ContentEncoding', 'ContentDisposition', 'ContentLanguage', 'CacheControl', 'Expires', 'Metadata']
+
+_transfer_profile = dict(TRANSFER_PROFILES['default'])
+_transfer_config = None
 
 def _findMatches(f, patterns, matchAll = False):
     """ Wrapper for _findMatch to search for multiple patterns. If matchAll is True, must match all patterns.
@@ -24,26 +53,7 @@ def _findMatches(f, patterns, matchAll = False):
     >>> _findMatches('myfile.txt', ['^.txt', 'super'], True)
     False
     """
-    matches = []
-    if type(patterns) == str:
-        patterns = [patterns] if patterns != '' else []
-
-    # if patterns is empty, we return True by default
-    if patterns == []:
-        return True
-
-    for p in patterns:
-        matches.append(_findMatch(f, p))
-    if matchAll == False:
-        if True in matches:
-            return True
-        else:
-            return False
-    elif matchAll == True:
-        if False in matches:
-            return False
-        else:
-            return True
+    return compilePatterns(patterns).matches(f, matchAll)
 
 
 def _findMatch(f, p):
@@ -70,32 +80,252 @@ def _findMatch(f, p):
     >>> _findMatch('myfile.txt', '')
     True
     """
-    # print('FINDMATCH: file {}, pattern {}'.format(str(f), str(p)))
-    _isMatch = False
-    f = str(f).lower()
+    return _matchPattern(str(f).lower(), _compilePattern(p))
+
+
+def _compilePattern(p):
+    """ Parses one _findMatch() pattern into (match type, search string).
+    Match types: 'all', 'suffix' ('^.txt'), 'prefix' ('myfile^'), 'extension' ('^fastq^') and 'contains' ('bam').
+
+    >>> _compilePattern('^.TXT')
+    ('suffix', '.txt')
+    >>> _compilePattern('myf^')
+    ('prefix', 'myf')
+    >>> _compilePattern('^R1^')
+    ('extension', 'r1')
+    >>> _compilePattern("['']")
+    ('all', '')
+    """
     p = str(p).lower()
     # if empty string
     if p == '[]' or p == "['']" or p == '':
-        _isMatch = True
+        return ('all', '')
     # suffix - file extension at end of filename
     elif p[0]=='^' and p[-1]!='^':
-        if f.endswith(p[1:]):
-            _isMatch = True
+        return ('suffix', p[1:])
     # prefix - file extension at beginning of filename
     elif p[-1]=='^' and p[0]!='^':
-        if f.startswith(p[0:-1]):
-            _isMatch = True
+        return ('prefix', p[0:-1])
     # search pattern somewhere in file extension, separated from base file name by one of [_,-,.]
     elif p.rfind('^') > p.find('^'):
-        i = p.find('^')
-        j = p.rfind('^')
-        if (f[f.find('_'):].find(p[i+1:j]) >= 0) or (f[f.find('.'):].find(p[i+1:j]) >= 0) or (f[f.find('-'):].find(p[i+1:j]) >= 0):
-            _isMatch = True
+        return ('extension', p[p.find('^')+1:p.rfind('^')])
     # search pattern anywhere in file name
     else:
-        if f.find(p) >= 0:
-            _isMatch = True
-    return _isMatch
+        return ('contains', p)
+
+
+def _matchPattern(f, compiled_pattern):
+    """ Matches a lower-case file name against a pattern from _compilePattern().
+    """
+    match_type, s = compiled_pattern
+    if match_type == 'all':
+        return True
+    elif match_type == 'suffix':
+        return f.endswith(s)
+    elif match_type == 'prefix':
+        return f.startswith(s)
+    elif match_type == 'extension':
+        # the file extension starts at the first '_', '.' or '-'. If there is none, only the last character is searched.
+        seps = [i for i in (f.find('_'), f.find('.'), f.find('-')) if i >= 0]
+        return s in (f[min(seps):] if seps != [] else f[-1:])
+    else:
+        return s in f
+
+
+class PatternMatcher:
+    """ Compiled set of _findMatches() patterns. Build it once, then match it against any number of file names.
+
+    >>> m = PatternMatcher(['^.fastq.gz', '^.fastq'], ['^I1^'])
+    >>> m.match('my-R1.fastq.gz'), m.match('my-I1.fastq.gz'), m.match('my.bam')
+    (True, False, False)
+    >>> list(m.filter(['a-R1.fastq', 'a-I1.fastq', 'a.bam']))
+    ['a-R1.fastq']
+    """
+    def __init__(self, patterns2include = [], patterns2exclude = []):
+        self.include = compilePatterns(patterns2include)
+        self.exclude = compilePatterns(patterns2exclude)
+
+    def match(self, f):
+        """ Does file name f match any include pattern (or there are none), and no exclude pattern?
+        """
+        f = str(f).lower()
+        return self.include.matches(f, _lower = False) and not (self.exclude.patterns != () and self.exclude.matches(f, _lower = False))
+
+    def filter(self, names, key = None):
+        """ Generator over the items of names (any iterable - e.g., a paginated S3 listing) that match.
+            key: function that returns the file name to match for an item, e.g. lambda o: o['Key']
+        """
+        for name in names:
+            if self.match(name if key == None else key(name)):
+                yield name
+
+
+class _CompiledPatterns:
+    """ Compiled list of patterns - see compilePatterns().
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(_compilePattern(p) for p in patterns)
+
+    def matches(self, f, matchAll = False, _lower = True):
+        # if patterns is empty, we return True by default
+        if self.patterns == ():
+            return True
+        if _lower:
+            f = str(f).lower()
+        if matchAll == True:
+            return all(_matchPattern(f, p) for p in self.patterns)
+        return any(_matchPattern(f, p) for p in self.patterns)
+
+
+def compilePatterns( patterns ):
+    """ Compiles a _findMatches() pattern or list of patterns. Compiled patterns are cached, so repeated calls with the
+    same patterns (e.g., once per listed file) do not parse them again.
+    patterns: e.g. '^.txt', ['^bam', 'myfile'], STR or LIST
+    RETURN: compiled patterns, with a matches(f, matchAll = False) method
+
+    >>> compilePatterns(['^.txt', 'super']).matches('myfile.txt')
+    True
+    """
+    if type(patterns) == str:
+        patterns = (patterns,) if patterns != '' else ()
+    return _compilePatternsCached(tuple(str(p) for p in patterns))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compilePatternsCached( patterns ):
+    return _CompiledPatterns(patterns)
+
+
+def getTransferProfile( profile = None ):
+    """ Returns multipart transfer settings for a profile.
+    profile: name of a profile in TRANSFER_PROFILES, or a dict of settings. A dict may name a base profile
+             under 'profile' and override any of TRANSFER_PROFILE_KEYS. None returns the active profile.
+    RETURN: settings, DICT
+
+    >>> getTransferProfile('serial')['use_threads']
+    False
+    >>> getTransferProfile({'profile': 'large', 'max_concurrency': 8})['max_concurrency']
+    8
+    >>> getTransferProfile({'multipart_chunksize': '16'})['multipart_chunksize']
+    16
+    """
+    if profile in [None, '', {}]:
+        return dict(_transfer_profile)
+    elif type(profile) == type(''):
+        if profile not in TRANSFER_PROFILES:
+            raise ValueError('Unknown transfer profile: {}. Valid profiles are {}'.format(profile, str(list(TRANSFER_PROFILES.keys()))))
+        return dict(TRANSFER_PROFILES[profile])
+    settings = getTransferProfile(profile['profile'] if 'profile' in profile else 'default')
+    for k in TRANSFER_PROFILE_KEYS:
+        if k in profile:
+            settings[k] = str(profile[k]).lower() in ['true', 't', '1', 'yes'] if k == 'use_threads' else int(profile[k])
+    return settings
+
+
+def setTransferProfile( profile = 'default' ):
+    """ Sets the multipart transfer settings used by all single-file downloads and uploads in this process.
+    profile: profile name or dict of settings - see getTransferProfile()
+    RETURN: active settings, DICT
+    """
+    global _transfer_profile, _transfer_config
+    _transfer_profile = getTransferProfile(profile if profile not in [None, ''] else 'default')
+    _transfer_config = None
+    return dict(_transfer_profile)
+
+
+def getTransferConfig( profile = None ):
+    """ Returns a boto3 TransferConfig for a profile (None = active profile).
+    """
+    global _transfer_config
+    if profile in [None, '', {}]:
+        if _transfer_config == None:
+            _transfer_config = TransferConfig(**_transfer_profile)
+        return _transfer_config
+    return TransferConfig(**getTransferProfile(profile))
+
+
+def _isRetryableError( e ):
+    """ True if a failed transfer may succeed when tried again - see S3_RETRYABLE_ERROR_CODES.
+
+    >>> _isRetryableError( ClientError({'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'PutObject') )
+    True
+    >>> _isRetryableError( ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, 'GetObject') )
+    False
+    >>> _isRetryableError( FileNotFoundError('/data/my.bam') )
+    False
+    """
+    if isinstance(e, ClientError):
+        error_code = e.response.get('Error', {}).get('Code', '')
+        status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return error_code in S3_RETRYABLE_ERROR_CODES or int(status_code) >= 500
+    elif isinstance(e, S3UploadFailedError):
+        # upload_file() wraps the ClientError into its message
+        return any('({})'.format(error_code) in str(e) for error_code in S3_RETRYABLE_ERROR_CODES)
+    # builtin ConnectionError and TimeoutError are the retryable kinds of OSError
+    return isinstance(e, (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError))
+
+
+def _retryTransfer( transfer_function, transfer_args, retries = S3_TRANSFER_RETRIES, backoff = S3_TRANSFER_BACKOFF ):
+    """ Calls transfer_function(*transfer_args), retrying up to retries more times on a retryable failure (see _isRetryableError()).
+    The wait between attempts starts at backoff seconds and doubles after each failure.
+    """
+    for attempt in range(retries+1):
+        try:
+            return transfer_function(*transfer_args)
+        except Exception as e:
+            if attempt >= retries or not _isRetryableError( e ):
+                raise
+            print('Transfer failed ({}) - retrying in {} seconds'.format(str(e), str(backoff * 2**attempt)))
+            time.sleep(backoff * 2**attempt)
+
+
+def _transferFiles_S3( transfer_function, transfer_args_list, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES, progress_callback = None ):
+    """ Runs transfer_function(*args) for each args in transfer_args_list on a bounded thread pool.
+    Each transfer is retried with backoff. transfer_function must return the number of bytes transferred.
+    progress_callback, if given, is called after each finished file with a dict:
+        {'files_done', 'files_total', 'bytes_done', 'seconds', 'bytes_per_second'}
+    RETURN: number of bytes transferred for each args, in the same order as transfer_args_list, LIST
+    """
+    progress = {'files_done': 0, 'files_total': len(transfer_args_list), 'bytes_done': 0, 'seconds': 0.0, 'bytes_per_second': 0.0}
+    progress_lock = threading.Lock()
+    start_time = time.time()
+
+    def _transfer( transfer_args ):
+        nbytes = _retryTransfer( transfer_function, transfer_args, retries )
+        with progress_lock:
+            progress['files_done'] += 1
+            progress['bytes_done'] += nbytes
+            progress['seconds'] = time.time() - start_time
+            progress['bytes_per_second'] = progress['bytes_done'] / progress['seconds'] if progress['seconds'] > 0 else 0.0
+            if progress_callback != None:
+                progress_callback( dict(progress) )
+        return nbytes
+
+    if max_workers <= 1 or len(transfer_args_list) <= 1:
+        return [_transfer( transfer_args ) for transfer_args in transfer_args_list]
+    with ThreadPoolExecutor( max_workers = min(max_workers, len(transfer_args_list)) ) as executor:
+        # map() returns results in submission order, whatever order the transfers finish in
+        return list(executor.map( _transfer, transfer_args_list ))
+
+
+def _downloadObject_S3( bucket, key, local_filename ):
+    """ Downloads one S3 object. Returns number of bytes downloaded.
+    """
+    s3_client.download_file(bucket, key, local_filename, Config=getTransferConfig())
+    return os.path.getsize(local_filename)
+
+
+def _getDownloadArgs_S3( s3path, dir_to_download ):
+    """ Returns (bucket, key, local_filename) for downloading s3path into dir_to_download.
+    >>> _getDownloadArgs_S3('s3://hubpublicinternal/test/aws_s3_utils/test-R1.fastq.gz', './testout/')
+    ('hubpublicinternal', 'test/aws_s3_utils/test-R1.fastq.gz', './testout/test-R1.fastq.gz')
+    """
+    bucket = s3path.split('/')[2]
+    key = '/'.join(s3path.split('/')[3:])
+
+    object_filename = key.split('/')[-1]
+    local_filename = os.path.join(dir_to_download, object_filename)
+    return (bucket, key, local_filename)
 
 
 def downloadFile_S3(s3path, dir_to_download):
@@ -116,23 +346,23 @@ def downloadFile_S3(s3path, dir_to_download):
         s3path = s3path[0]
 
     print('Downloading from S3 - {} to {}'.format(s3path, dir_to_download))
-    bucket = s3path.split('/')[2]
-    key = '/'.join(s3path.split('/')[3:])
-
-    object_filename = key.split('/')[-1]
-    local_filename = os.path.join(dir_to_download, object_filename)
+    download_args = _getDownloadArgs_S3(s3path, dir_to_download)
+    _retryTransfer(_downloadObject_S3, download_args)
 
-    s3.Object(bucket,key).download_file(local_filename)
+    return download_args[2]
 
-    return local_filename
-
-def downloadFiles_S3(s3paths, dir_to_download):
+def downloadFiles_S3(s3paths, dir_to_download, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES, progress_callback = None):
     """ Downloads a list of file objects from S3 to local files.
         If STRING is provided, then just one file.
         Returns full file path of downloaded local files.
+        Files are downloaded in parallel by up to max_workers threads, and each file is retried on failure.
+        Returned file paths are always in the same order as s3paths.
 
     s3paths: list of S3 file paths, ['s3://hubseq/myfile1.bam', 's3://hubseq/myfile2.bam'], STR
     dir_to_download: local directory to download to, /local/dir, STR
+    max_workers: maximum number of concurrent downloads (1 = serial), INT
+    retries: number of retries per file, INT
+    progress_callback: function called with a progress dict after each downloaded file - see _transferFiles_S3()
     RETURN: full file path of downloaded local files, ['/local/dir/myfile1.bam', '/local/dir/myfile2.bam'], STR
 
     >>> downloadFiles_S3(['s3://hubpublicinternal/test/aws_s3_utils/test-R1.fastq.gz', 's3://hubpublicinternal/test/aws_s3_utils/test-R2.fastq.gz'], './testout/')
@@ -142,8 +372,18 @@ def downloadFiles_S3(s3paths, dir_to_download):
     """
     if type(s3paths) == type([]):
         local_filenames = []
+        download_args_list = []
         for s3path in s3paths:
-            local_filenames.append(downloadFile_S3(s3path, dir_to_download))
+            if s3path in ['', []]:
+                local_filenames.append('')
+                continue
+            elif type(s3path) == type([]):
+                s3path = s3path[0]
+            print('Downloading from S3 - {} to {}'.format(s3path, dir_to_download))
+            download_args = _getDownloadArgs_S3(s3path, dir_to_download)
+            download_args_list.append(download_args)
+            local_filenames.append(download_args[2])
+        _transferFiles_S3(_downloadObject_S3, download_args_list, max_workers, retries, progress_callback)
     elif type(s3paths) == type(''):
         local_filenames = downloadFile_S3(s3paths, dir_to_download)
     else:
@@ -151,15 +391,145 @@ def downloadFiles_S3(s3paths, dir_to_download):
     return local_filenames
 
 
-def downloadFolder_S3(s3path, localdir):
+def _toPatternList( patterns ):
+    """ Glob patterns may be given as a single STR or a LIST.
+    >>> _toPatternList('*.log')
+    ['*.log']
+    >>> _toPatternList(['*.log', ''])
+    ['*.log']
+    """
+    if type(patterns) == type(''):
+        patterns = [patterns]
+    return [p for p in patterns if p not in ['', None]]
+
+
+def _isSyncedFile( relpath, files2exclude = [], files2include = [] ):
+    """ Applies aws s3 --exclude/--include glob semantics to a path relative to the synced folder:
+        a file is skipped if it matches any files2exclude pattern, unless it also matches a files2include pattern.
+        As in the aws CLI, '*' also matches '/'.
+    >>> _isSyncedFile('fastqc/my_fastqc.html', ['*.zip'])
+    True
+    >>> _isSyncedFile('my-R1.fastq.gz', ['*'], ['*-R1.fastq.gz'])
+    True
+    >>> _isSyncedFile('my-R2.fastq.gz', ['*'], ['*-R1.fastq.gz'])
+    False
+    """
+    for p in files2include:
+        if fnmatch.fnmatchcase(relpath, p):
+            return True
+    for p in files2exclude:
+        if fnmatch.fnmatchcase(relpath, p):
+            return False
+    return True
+
+
+def _listLocalFolderTree( localdir ):
+    """ Returns {relative file path: (size, mtime, full path)} for all files in a local folder and its sub-folders.
+    """
+    local_files = {}
+    for root, dirs, files in os.walk(localdir):
+        for f in files:
+            fullpath = os.path.join(root, f)
+            s = os.stat(fullpath)
+            local_files[os.path.relpath(fullpath, localdir).replace(os.sep, '/')] = (s.st_size, s.st_mtime, fullpath)
+    return local_files
+
+
+def _listS3FolderTree( s3path ):
+    """ Returns {relative file path: (size, mtime, ETag, key)} for all objects under an S3 folder.
+    """
+    bucket, prefix = _getS3PathPrefix( s3path )
+    s3_files = {}
+    for file_info in iterObjects_S3( s3path, '' ):
+        if file_info['Key'].endswith('/'):
+            continue  # folder placeholder objects
+        s3_files[file_info['Key'][len(prefix):]] = (file_info['Size'], file_info['LastModified'].timestamp(), file_info['ETag'].strip('"'), file_info['Key'])
+    return s3_files
+
+
+def _localMD5( localfile ):
+    md5 = hashlib.md5()
+    with open(localfile, 'rb') as f:
+        for chunk in iter(lambda: f.read(S3_STREAM_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _isUnchanged( local_info, s3_info, direction, compare_etag = False ):
+    """ Decides whether a file is already in sync. Sizes must match. If compare_etag is True and the S3 ETag is a plain MD5
+        (i.e., not a multipart upload), the local MD5 must match it. Otherwise the destination must not be older than the source.
+    """
+    local_size, local_mtime, localfile = local_info
+    s3_size, s3_mtime, s3_etag = s3_info[0:3]
+    if local_size != s3_size:
+        return False
+    elif compare_etag and '-' not in s3_etag:
+        return _localMD5( localfile ) == s3_etag
+    elif direction == 'download':
+        return local_mtime >= s3_mtime - 1
+    else:
+        return s3_mtime >= local_mtime - 1
+
+
+def _downloadSyncedObject_S3( bucket, key, local_filename, s3_mtime ):
+    """ Downloads one object and sets the local modification time to the S3 LastModified time, so that the next sync skips it.
+    """
+    os.makedirs(os.path.dirname(local_filename) or '.', exist_ok=True)
+    nbytes = _downloadObject_S3( bucket, key, local_filename )
+    os.utime(local_filename, (s3_mtime, s3_mtime))
+    return nbytes
+
+
+def syncFolder_S3( source, destination, files2exclude = [], files2include = [], compare_etag = False, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES, progress_callback = None ):
+    """ Copies a folder (and sub-folders) from S3 to a local directory, or from a local directory to S3,
+        transferring only files that are missing or changed at the destination. Changed files are transferred in parallel.
+        Nothing is deleted at the destination.
+
+    source: S3 folder path or local directory, STR
+    destination: local directory or S3 folder path, STR - exactly one of source and destination must be on S3
+    files2exclude: glob pattern(s) of relative file paths to skip, as in aws s3 cp --exclude, STR or LIST
+    files2include: glob pattern(s) that override files2exclude, as in aws s3 cp --include, STR or LIST
+    compare_etag: also compare file contents (local MD5 vs. S3 ETag) instead of modification times, BOOL
+    max_workers, retries, progress_callback: see downloadFiles_S3()
+    RETURN: sync statistics, DICT
+        {'files_total', 'files_transferred', 'files_skipped', 'bytes_transferred', 'seconds'}
+    """
+    start_time = time.time()
+    files2exclude = _toPatternList( files2exclude )
+    files2include = _toPatternList( files2include )
+    if 's3:/' in str(source):
+        direction = 'download'
+        s3_files = _listS3FolderTree( source )
+        local_files = _listLocalFolderTree( destination ) if os.path.isdir( destination ) else {}
+        bucket, prefix = _getS3PathPrefix( source )
+        sync_files = [f for f in s3_files if _isSyncedFile(f, files2exclude, files2include)]
+        transfer_args_list = [(bucket, s3_files[f][3], os.path.join(destination, f), s3_files[f][1]) for f in sync_files \
+                              if f not in local_files or not _isUnchanged(local_files[f], s3_files[f], direction, compare_etag)]
+        transfer_function = _downloadSyncedObject_S3
+    else:
+        direction = 'upload'
+        local_files = _listLocalFolderTree( source )
+        s3_files = _listS3FolderTree( destination )
+        bucket, prefix = _getS3PathPrefix( destination )
+        sync_files = [f for f in local_files if _isSyncedFile(f, files2exclude, files2include)]
+        transfer_args_list = [(local_files[f][2], bucket, prefix+f) for f in sync_files \
+                              if f not in s3_files or not _isUnchanged(local_files[f], s3_files[f], direction, compare_etag)]
+        transfer_function = _uploadObject_S3
+
+    nbytes = _transferFiles_S3( transfer_function, transfer_args_list, max_workers, retries, progress_callback )
+    return {'files_total': len(sync_files), 'files_transferred': len(transfer_args_list), \
+            'files_skipped': len(sync_files) - len(transfer_args_list), 'bytes_transferred': sum(nbytes), \
+            'seconds': time.time() - start_time}
+
+
+def downloadFolder_S3(s3path, localdir, files2exclude = ''):
     """ Downloads a folder (and sub-folders) from S3 to a local directory.
+        Files that are already downloaded and unchanged are skipped - see syncFolder_S3().
         Returns local directory name.
     >>> downloadFolder_S3('s3://hubpublicinternal/test/aws_s3_utils/', './testout/')
     './testout/'
     """
-    cmd = ['aws','s3','cp','--recursive',s3path.rstrip('/')+'/',localdir]
-    subprocess.check_call(cmd)
-
+    syncFolder_S3( s3path.rstrip('/')+'/', localdir, files2exclude )
     return localdir
 
 
@@ -173,26 +543,25 @@ def downloadFiles_Pattern_S3(s3_path, directory_to_download, pattern):
     >>> downloadFiles_Pattern_S3('s3://hubpublicinternal/test/aws_s3_utils/', './testout/', '*-R1.fastq.gz')
     './testout/'
     """
-    pattern_with_quotes = '"'+pattern+'"'
-    cmd = 'aws s3 cp --recursive %s %s --exclude "*" --include %s' \
-        % (s3_path, directory_to_download, pattern_with_quotes)
+    syncFolder_S3( s3_path, directory_to_download, '*', pattern )
+    return directory_to_download
 
-    # output of S3 copy to temporary file
-    # fout = open('dfilestmptmp.tmp','w')
-    subprocess.check_call(cmd.split(' ')) #, stdout=fout)
-    # fout.close()
 
-    # get a list of all downloaded files
-    # dfiles = []
-    # with open('dfilestmptmp.tmp','r') as f:
-    #    for r in f:
-    #        dfiles.append(str(r.rstrip(' \t\n').split(' ')[-1]))
+def _uploadObject_S3( localfile, bucket, key ):
+    """ Securely uploads one local file to an S3 object. Returns number of bytes uploaded.
+    """
+    s3_client.upload_file(localfile, bucket, key, ExtraArgs=dict(ServerSideEncryption='AES256'), Config=getTransferConfig())
+    return os.path.getsize(localfile)
 
-    # remove temporary file
-    # rm_command = ['rm','dfilestmptmp.tmp']
-    # subprocess.check_call(rm_command)
-    return directory_to_download
-#    return dfiles
+
+def _getUploadArgs_S3( localfile, s3path ):
+    """ Returns (localfile, bucket, key) for uploading localfile to S3 folder s3path.
+    >>> _getUploadArgs_S3('test/test-upload-R1.fastq.gz', 's3://hubpublicinternal/test/aws_s3_utils/')
+    ('test/test-upload-R1.fastq.gz', 'hubpublicinternal', 'test/aws_s3_utils/test-upload-R1.fastq.gz')
+    """
+    bucket = s3path.split('/')[2]
+    key = os.path.join('/'.join((s3path.rstrip('/')+'/').split('/')[3:-1]),localfile.split('/')[-1])
+    return (localfile, bucket, key)
 
 
 def uploadFile_S3(localfile, s3path):
@@ -209,26 +578,30 @@ def uploadFile_S3(localfile, s3path):
         localfile = localfile[0]
 
     print('Uploading to s3 - {} to {}'.format(str(localfile), str(s3path)))
-
-    bucket = s3path.split('/')[2]
-    key = os.path.join('/'.join((s3path.rstrip('/')+'/').split('/')[3:-1]),localfile.split('/')[-1])
-
-    response = s3.Object(bucket,key).upload_file(localfile, ExtraArgs=dict(ServerSideEncryption='AES256'))
+    _retryTransfer(_uploadObject_S3, _getUploadArgs_S3(localfile, s3path))
     return s3path
 
 
-def uploadFiles_S3(localfiles, s3path):
+def uploadFiles_S3(localfiles, s3path, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES, progress_callback = None):
     """ Securely uploads a list of files from local to s3.
         Full path of localfiles should be specified in the input.
+        Files are uploaded in parallel by up to max_workers threads, and each file is retried on failure.
+        See downloadFiles_S3() for max_workers, retries and progress_callback.
     >>> uploadFiles_S3(['test/test-upload-R1.fastq.gz', 'test/test-upload-R2.fastq.gz'], 's3://hubpublicinternal/test/aws_s3_utils/')
     Uploading to s3 - test/test-upload-R1.fastq.gz to s3://hubpublicinternal/test/aws_s3_utils/
     Uploading to s3 - test/test-upload-R2.fastq.gz to s3://hubpublicinternal/test/aws_s3_utils/
     's3://hubpublicinternal/test/aws_s3_utils/'
     """
     if type(localfiles) == type([]):
-        local_filenames = []
+        upload_args_list = []
         for localfile in localfiles:
-            uploadFile_S3(localfile, s3path)
+            if localfile in ['', []]:
+                continue
+            elif type(localfile) == type([]):
+                localfile = localfile[0]
+            print('Uploading to s3 - {} to {}'.format(str(localfile), str(s3path)))
+            upload_args_list.append(_getUploadArgs_S3(localfile, s3path))
+        _transferFiles_S3(_uploadObject_S3, upload_args_list, max_workers, retries, progress_callback)
     elif type(localfiles) == type(''):
         uploadFile_S3(localfiles, s3path)
     return s3path
@@ -237,18 +610,195 @@ def uploadFiles_S3(localfiles, s3path):
 def uploadFolder_S3(localdir, s3path, files2exclude = ''):
     """ Uploads all files in a folder (and sub-folders) from S3 to a local directory.
         Automatically use server-side encryption.
+        Files that are already uploaded and unchanged are skipped - see syncFolder_S3().
         Returns upload response.
     >>> uploadFolder_S3('./test/', 's3://hubpublicinternal/test/aws_s3_utils/')
     's3://hubpublicinternal/test/aws_s3_utils/'
     """
-    cmd = ['aws','s3','cp','--recursive','--sse','AES256',localdir.rstrip('/')+'/',s3path.rstrip('/')+'/']
-    if files2exclude != '':
-        for f in files2exclude:
-            cmd += ['--exclude', f]
-    response = subprocess.check_call(cmd)
+    syncFolder_S3( localdir.rstrip('/')+'/', s3path.rstrip('/')+'/', files2exclude )
     return s3path
 
 
+def _getCopyParts( size, part_size = S3_COPY_PART_SIZE ):
+    """ Byte ranges (first byte, last byte) of the parts of a multipart copy.
+
+    >>> _getCopyParts( 10, 4 )
+    [(0, 3), (4, 7), (8, 9)]
+    """
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def _copyPart_S3( copy_source, dest_bucket, dest_key, upload_id, part_number, first_byte, last_byte ):
+    response = s3_client.upload_part_copy(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, PartNumber=part_number,
+                                          CopySource=copy_source, CopySourceRange='bytes={}-{}'.format(first_byte, last_byte))
+    return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+
+def _copyObject_S3( source_bucket, source_key, dest_bucket, dest_key, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES ):
+    """ Server-side copy of one S3 object. Objects over 5GB are copied in parts, by up to max_workers threads.
+    Each S3 request (and each part) is retried on its own - so callers must not retry the whole copy again.
+    Returns number of bytes copied.
+    """
+    copy_source = {'Bucket': source_bucket, 'Key': source_key}
+    source_info = _retryTransfer( lambda: s3_client.head_object(Bucket=source_bucket, Key=source_key), (), retries )
+    size = source_info['ContentLength']
+    if size <= S3_COPY_MAX_SIZE:
+        _retryTransfer( lambda: s3_client.copy_object(Bucket=dest_bucket, Key=dest_key, CopySource=copy_source, ServerSideEncryption='AES256'), (), retries )
+        return size
+    create_args = {h: source_info[h] for h in S3_COPY_HEADERS if h in source_info}
+    upload_id = s3_client.create_multipart_upload(Bucket=dest_bucket, Key=dest_key, ServerSideEncryption='AES256', **create_args)['UploadId']
+    try:
+        part_args_list = [(copy_source, dest_bucket, dest_key, upload_id, i+1, first_byte, last_byte)
+                          for i, (first_byte, last_byte) in enumerate(_getCopyParts( size ))]
+        with ThreadPoolExecutor( max_workers = max(1, min(max_workers, len(part_args_list))) ) as executor:
+            parts = list(executor.map( lambda part_args: _retryTransfer( _copyPart_S3, part_args, retries ), part_args_list ))
+        s3_client.complete_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except Exception:
+        # do not leave the parts copied so far behind (they are billed until the upload is aborted)
+        s3_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+        raise
+    return size
+
+
+def _getCopyArgs_S3( source_s3path, dest_s3path ):
+    """ Returns (source bucket, source key, dest bucket, dest key) for copying an S3 object to an S3 file path or folder (ending in '/').
+    >>> _getCopyArgs_S3('s3://hubseq/run1/my.bam', 's3://hubseq/run2/')
+    ('hubseq', 'run1/my.bam', 'hubseq', 'run2/my.bam')
+    """
+    source_bucket = source_s3path.split('/')[2]
+    source_key = '/'.join(source_s3path.split('/')[3:])
+    if dest_s3path.endswith('/'):
+        dest_s3path = dest_s3path + source_s3path.split('/')[-1]
+    return (source_bucket, source_key, dest_s3path.split('/')[2], '/'.join(dest_s3path.split('/')[3:]))
+
+
+def copyObject_S3( source_s3path, dest_s3path, max_workers = S3_TRANSFER_MAX_WORKERS ):
+    """ Server-side copy of one S3 object to another S3 path - no data passes through this machine.
+        Automatically use server-side encryption.
+        Objects over 5GB are copied as a multipart upload (UploadPartCopy), with up to max_workers parts copied at a time.
+
+    dest_s3path: S3 file path, or S3 folder (ending in '/') to copy into
+    RETURN: S3 path of copied object
+    """
+    copy_args = _getCopyArgs_S3( source_s3path, dest_s3path )
+    _copyObject_S3( *(copy_args + (max_workers,)) )
+    return 's3://{}/{}'.format(copy_args[2], copy_args[3])
+
+
+def copyObjects_S3( source_s3paths, dest_s3path, max_workers = S3_TRANSFER_MAX_WORKERS, retries = S3_TRANSFER_RETRIES, progress_callback = None ):
+    """ Server-side copy of S3 objects into an S3 folder - see copyObject_S3().
+        Files are copied in parallel by up to max_workers threads, and each file is retried on failure.
+        See downloadFiles_S3() for max_workers, retries and progress_callback.
+    RETURN: S3 paths of copied objects, in the same order as source_s3paths
+    """
+    if type(source_s3paths) == type(''):
+        return copyObject_S3( source_s3paths, dest_s3path, max_workers )
+    dest_folder = dest_s3path.rstrip('/')+'/'
+    copy_args_list = []
+    for source_s3path in source_s3paths:
+        print('Copying in s3 - {} to {}'.format(str(source_s3path), str(dest_folder)))
+        copy_args_list.append(_getCopyArgs_S3( source_s3path, dest_folder ) + (max_workers, retries))
+    # _copyObject_S3() retries each of its S3 requests itself - do not retry whole copies on top of that
+    _transferFiles_S3( _copyObject_S3, copy_args_list, max_workers, 0, progress_callback )
+    return ['s3://{}/{}'.format(copy_args[2], copy_args[3]) for copy_args in copy_args_list]
+
+
+def _getS3PathPrefix( s3_path ):
+    """ Splits an S3 folder path into its bucket and key prefix. The prefix always ends in '/', unless it is the bucket root.
+    s3_path: S3 folder path, 's3://hubseq/myfolder', STR or LIST
+    RETURN: (bucket, prefix) TUPLE
+
+    >>> _getS3PathPrefix('s3://hubpublicinternal/test/aws_s3_utils')
+    ('hubpublicinternal', 'test/aws_s3_utils/')
+    >>> _getS3PathPrefix(['s3://hubpublicinternal/'])
+    ('hubpublicinternal', '')
+    """
+    if type(s3_path) == type([]) and s3_path != []:
+        s3_path = s3_path[0]
+    elif type(s3_path) == type([]) and s3_path == []:
+        s3_path = ''
+    s3_path = s3_path.lstrip(' \t').rstrip('/')+'/'
+    bucket = s3_path.split('/')[2] if len(s3_path.split('/')) > 2 else ''
+    prefix = '/'.join(s3_path.split('/')[3:])
+    return (bucket, prefix)
+
+
+def iterObjects_S3( s3_path, delimiter = '/' ):
+    """ Generator over all objects (and sub-folder prefixes, if a delimiter is given) under an S3 folder path.
+    Uses list_objects_v2 paginators, so listings with more than 1000 keys are not truncated.
+
+    s3_path: S3 folder path, 's3://hubseq/myfolder/', STR
+    delimiter: '/' lists immediate files and sub-folders only. '' lists all nested objects recursively.
+    YIELDS: object info DICT as returned by S3 - {'Key': ..., 'Size': ..., 'ETag': ..., 'LastModified': ...}
+            or sub-folder prefix DICT - {'Prefix': 'myfolder/subfolder/'}
+    """
+    bucket, prefix = _getS3PathPrefix( s3_path )
+    paginator = s3_client.get_paginator('list_objects_v2')
+    list_args = dict(Bucket=bucket, Prefix=prefix)
+    if delimiter != '':
+        list_args['Delimiter'] = delimiter
+    for page in paginator.paginate(**list_args):
+        for common_prefix in page.get('CommonPrefixes', []):
+            yield common_prefix
+        for file_info in page.get('Contents', []):
+            yield file_info
+
+
+def listSubFilesAndFolders(s3_path, patterns2include = [], patterns2exclude = [], folders2include = [], folders2exclude = []):
+    """ Lists the immediate files and sub-folders under an S3 folder path, from a single paginated listing.
+
+    s3_path: s3 folder path
+    patterns2include: LIST of file patterns to search for. See _findMatches()
+    patterns2exclude: LIST of file patterns to exclude. See _findMatches()
+    folders2include: LIST, if specified, only include these folders
+    folders2exclude: LIST of folders to exclude
+    RETURN: (LIST of found files, LIST of found sub-folders)
+
+    >>> listSubFilesAndFolders('s3://hubpublicinternal/test/aws_s3_utils/', 'test', 'R1')
+    (['test-R2.fastq.gz', 'test-upload-R2.fastq.gz', 'test-upload.create_fastq.log', 'test.create_fastq.log'], [])
+    """
+    if type(patterns2include) == str:
+        patterns2include = [patterns2include]
+    if type(patterns2exclude) == str:
+        patterns2exclude = [patterns2exclude]
+
+    bucket, prefix = _getS3PathPrefix( s3_path )
+    matcher = PatternMatcher(patterns2include, patterns2exclude)
+    dfiles, dfolders = [], []
+    try:
+        for entry in iterObjects_S3( s3_path, '/' ):
+            if 'Prefix' in entry:
+                folder = entry['Prefix'][len(prefix):].rstrip('/')
+                if (folder not in folders2exclude) and (folders2include == [] or folder in folders2include):
+                    dfolders.append(folder)
+            else:
+                rp = entry['Key'][len(prefix):]
+                # '.' indicates its a file
+                if '.' in rp and matcher.match(rp):
+                    dfiles.append(rp)
+    except ClientError as e:
+        print('CLIENT ERROR in aws_s3_utils.listSubFilesAndFolders() or FILES NOT FOUND: '+str(e))
+        return ([], [])
+    return (dfiles, dfolders)
+
+
+def iterMatchingKeys_S3(s3_path, patterns2include = [], patterns2exclude = [], recursive = True):
+    """ Generator over S3 paths of all files under an S3 folder whose file names match the given patterns.
+        Keys are matched page by page as S3 returns them, so memory use stays bounded even for a full-bucket listing.
+
+    s3_path: s3 folder path, e.g. 's3://hubseq/' for a whole bucket
+    patterns2include: file patterns to search for. See _findMatches()
+    patterns2exclude: file patterns to exclude. See _findMatches()
+    recursive: also search sub-folders, BOOL
+    YIELDS: S3 file path, STR
+    """
+    bucket = _getS3PathPrefix( s3_path )[0]
+    matcher = PatternMatcher(patterns2include, patterns2exclude)
+    objects = (o for o in iterObjects_S3( s3_path, '' if recursive else '/' ) if 'Key' in o)
+    for file_info in matcher.filter( objects, key = lambda o: o['Key'].split('/')[-1] ):
+        yield 's3://'+bucket+'/'+file_info['Key']
+
+
 def listSubFiles(s3_path, patterns2include, patterns2exclude):
     """
     Lists files from S3 that match a specific pattern
@@ -268,42 +818,7 @@ def listSubFiles(s3_path, patterns2include, patterns2exclude):
     >>> listSubFiles('s3://hubpublicinternal/test/aws_s3_utils/', 'test', ['^R1^','^R2^'])
     ['test-upload.create_fastq.log', 'test.create_fastq.log']
     """
-    if type(patterns2include) == str:
-        patterns2include = [patterns2include]
-    if type(patterns2exclude) == str:
-        patterns2exclude = [patterns2exclude]
-
-    if type(s3_path) == type([]) and s3_path != []:
-        s3_path = s3_path[0]
-    elif type(s3_path) == type([]) and s3_path == []:
-        s3_path = ''
-    
-    cmd = 'aws s3 ls %s' % (s3_path.rstrip('/')+'/')
-    dfiles = []
-    uid = str(uuid.uuid4())[0:6]  # prevents race conditions on tmp file
-    # output of S3 copy to temporary file
-    try:
-        # I think calledprocesserror will be called if file not found
-        with open(uid+'_dfilestmptmp.tmp','w') as fout:
-            subprocess.check_call(cmd.split(' '), stdout=fout)
-        # get a list of all downloaded files
-        with open(uid+'_dfilestmptmp.tmp','r') as f:
-            for r in f:
-                rp = r.split(' ')[-1].lstrip(' \t').rstrip(' \t\n')
-                # '.' indicates its a file
-                if '.' in rp and _findMatches(rp, patterns2include) and not (patterns2exclude != [] and _findMatches(rp, patterns2exclude)):
-                    dfiles.append(rp)
-
-        # remove temporary file
-        rm_command = ['rm',uid+'_dfilestmptmp.tmp']
-        subprocess.check_call(rm_command)
-    except subprocess.CalledProcessError:
-        print('CALLED PROCESS ERROR in aws_s3_utils.listSubFiles() or FILES NOT FOUND')
-        if os.path.exists(uid+'_dfilestmptmp.tmp'):
-            rm_command = ['rm',uid+'_dfilestmptmp.tmp']
-            subprocess.check_call(rm_command)
-        return []
-    return dfiles
+    return listSubFilesAndFolders(s3_path, patterns2include, patterns2exclude)[0]
 
 
 def listSubFolders(s3_path, folders2include = [], folders2exclude = [], options = ''):
@@ -311,39 +826,89 @@ def listSubFolders(s3_path, folders2include = [], folders2exclude = [], options
     :param s3_path: s3 folder path
     :param folders2include: LIST, if specified, only include these folders
     :param folders2exclude: LIST of folders to exclude
-    :param options: options to include with ls call
+    :param options: DEPRECATED - options for the old 'aws s3 ls' call. Ignored.
     :return: found subfolders
     >>> listSubFolders('s3://hubpublicinternal/test/', ['aws_s3_utils'])
     ['aws_s3_utils']
     """
-    if type(s3_path) == type([]) and s3_path != []:
-        s3_path = s3_path[0]
-    elif type(s3_path) == type([]) and s3_path == []:
-        s3_path = ''
-    if options != '':
-        cmd = 'aws s3 ls {} {}'.format(options, (s3_path.rstrip('/')+'/'))
-    else:
-        cmd = 'aws s3 ls {}'.format(s3_path.rstrip('/')+'/')
-    dfolders = []
-    uid = str(uuid.uuid4())[0:6]  # prevents race conditions on tmp file
+    return listSubFilesAndFolders(s3_path, [], [], folders2include, folders2exclude)[1]
+
+def _getRangeHeader( start = 0, length = None ):
+    """ HTTP Range header for length bytes from start (length None = to end of object).
+    >>> _getRangeHeader(0, 100)
+    'bytes=0-99'
+    >>> _getRangeHeader(100)
+    'bytes=100-'
+    """
+    return 'bytes={}-{}'.format(str(start), str(start+length-1) if length != None else '')
+
+
+def getObjectRange_S3( s3path, start = 0, length = None ):
+    """ Reads a byte range of an S3 object without downloading the whole object - e.g., a BAM or FASTQ header.
+    s3path: S3 file path, s3://hubseq/myfile.bam, STR
+    start: first byte to read, INT
+    length: number of bytes to read (None = to end of object), INT
+    RETURN: bytes read - empty if start is past the end of the object, BYTES
+    """
+    if length != None and length <= 0:
+        return b''
+    bucket = s3path.split('/')[2]
+    key = '/'.join(s3path.split('/')[3:])
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=_getRangeHeader(start, length))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidRange':
+            return b''
+        raise
+    return response['Body'].read()
+
+
+def getObjectIfChanged_S3( s3path, etag = '' ):
+    """ Reads a whole S3 object, unless its ETag still equals etag (conditional GET - nothing is transferred if unchanged).
+    s3path: S3 file path, STR
+    etag: ETag of a previously read copy, or '' to always read, STR
+    RETURN: (BYTES, or None if unchanged, current ETag)
+    """
+    bucket = s3path.split('/')[2]
+    key = '/'.join(s3path.split('/')[3:])
+    get_args = {'IfNoneMatch': '"{}"'.format(etag)} if etag not in ['', None] else {}
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, **get_args)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['304', 'NotModified']:
+            return (None, etag)
+        raise
+    return (response['Body'].read(), response['ETag'].strip('"'))
+
+
+def streamObject_S3( s3path, chunk_size = S3_STREAM_CHUNK_SIZE, start = 0, length = None ):
+    """ Generator that streams an S3 object (or a byte range of it) in chunks of up to chunk_size bytes, using a single ranged GET.
+    s3path: S3 file path, s3://hubseq/myfile.bam, STR
+    chunk_size: bytes per yielded chunk, INT
+    start, length: byte range to stream - see getObjectRange_S3()
+    RETURN: iterator of BYTES chunks
+
+    e.g., first 4 bytes of a BAM file: b''.join(streamObject_S3('s3://hubseq/my.bam', 4, 0, 4))
+    """
+    if length != None and length <= 0:
+        return
+    bucket = s3path.split('/')[2]
+    key = '/'.join(s3path.split('/')[3:])
     try:
-        fout = open(uid+'_dfolderstmptmp.tmp','w')
-        subprocess.check_call(cmd.split(' '), stdout=fout)
-        fout.close()
-        with open(uid+'_dfolderstmptmp.tmp','r') as f:
-            for r in f:
-                rp = r.lstrip(' \t').rstrip(' \t\n')
-                if rp.startswith('PRE'):  # tags a folder - hopefully this doesn't change on AWS side with aws s3 ls
-                    folder = rp.split(' ')[1].rstrip('/')
-                    if (folder not in folders2exclude) and (folders2include == [] or folder in folders2include):
-                        dfolders.append(folder)
-
-        # remove temporary file
-        rm_command = ['rm',uid+'_dfolderstmptmp.tmp']
-        subprocess.check_call(rm_command)
-        return dfolders
-    except subprocess.CalledProcessError:
-        return []
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=_getRangeHeader(start, length))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidRange':
+            return
+        raise
+    body = response['Body']
+    try:
+        chunk = body.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = body.read(chunk_size)
+    finally:
+        body.close()
+
 
 def get_json_object( s3paths ):
     """ Gets content of JSON files in S3, specified by S3 paths.
@@ -461,7 +1026,18 @@ def list_objects( s3path, searchpattern = '' ):
     key = str('/'.join(s3path.split('/')[3:])).rstrip('/') + '/'
     region = 'us-west-2'
     # s3_endpoint = '{}.s3.{}.amazonaws.com/{}'.format(bucket,region,key)
-    response = s3_client.list_objects_v2( Bucket=bucket, Prefix=key, Delimiter='/', StartAfter=key )
+    # page through the full listing - a single list_objects_v2 call stops at 1000 keys
+    response = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate( Bucket=bucket, Prefix=key, Delimiter='/', StartAfter=key ):
+        if response == {}:
+            response = page
+        else:
+            response.setdefault('Contents', []).extend( page.get('Contents', []) )
+            response.setdefault('CommonPrefixes', []).extend( page.get('CommonPrefixes', []) )
+            response['KeyCount'] = response.get('KeyCount', 0) + page.get('KeyCount', 0)
+    response['IsTruncated'] = False
+    response.pop('NextContinuationToken', None)
     ## narrow down file list if we are searching for a specific file pattern
     if searchpattern != '' and "Contents" in response:
         return _filter_list_objects_response( response, searchpattern )
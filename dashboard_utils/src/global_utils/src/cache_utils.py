@@ -0,0 +1,289 @@
+#
+# cache_utils
+#
+# Cache for remote folder listings (e.g., S3), shared by file_utils and all dashboards.
+#
+# Each cached entry is the full, unfiltered listing of one folder. Entries expire after a TTL
+# and are evicted least-recently-used when the cache holds too many entries or bytes.
+# A writer (e.g., run_pipeline) can invalidate a folder explicitly - this drops cached listings
+# of that folder, of everything under it, and of every folder above it. Invalidation only reaches the caches
+# of other processes with the 'sqlite' backend (on the same machine) - 'memory' caches of other processes
+# (e.g., dashboard workers) see new files only once their cached listings expire (TTL).
+#
+# Backends:
+#   'memory' - per-process LRU cache (default)
+#   'sqlite' - on-disk cache that can be shared by several Dash worker processes on one machine
+#   'none'   - no caching
+#
+# Defaults can be set with environment variables:
+#   HUBSEQ_LISTING_CACHE_BACKEND, HUBSEQ_LISTING_CACHE_TTL, HUBSEQ_LISTING_CACHE_MAX_ENTRIES,
+#   HUBSEQ_LISTING_CACHE_MAX_BYTES, HUBSEQ_LISTING_CACHE_DB
+#
+import os, time, json, sqlite3, tempfile, threading
+from collections import OrderedDict
+
+LISTING_CACHE_BACKEND = os.environ.get('HUBSEQ_LISTING_CACHE_BACKEND', 'memory')
+LISTING_CACHE_TTL = float(os.environ.get('HUBSEQ_LISTING_CACHE_TTL', 60))   # seconds
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get('HUBSEQ_LISTING_CACHE_MAX_ENTRIES', 5000))
+LISTING_CACHE_MAX_BYTES = int(os.environ.get('HUBSEQ_LISTING_CACHE_MAX_BYTES', 64*1024*1024))
+LISTING_CACHE_DB = os.environ.get('HUBSEQ_LISTING_CACHE_DB', os.path.join(tempfile.gettempdir(), 'hubseq_listing_cache.sqlite'))
+# sqlite backend: access times and counters of cache hits are written in batches, after this many hits or seconds
+LISTING_CACHE_FLUSH_HITS = 100
+LISTING_CACHE_FLUSH_SECONDS = 5.0
+
+STAT_NAMES = ['hits', 'misses', 'expired', 'evictions', 'invalidations']
+
+
+def _normalizePath( path ):
+    """ Folder paths are cached with a single trailing '/'.
+    >>> _normalizePath( 's3://hubseq/test' )
+    's3://hubseq/test/'
+    """
+    return str(path).lstrip(' \t').rstrip('/')+'/'
+
+
+class MemoryListingCache:
+    """ Per-process LRU listing cache.
+    """
+    def __init__(self, ttl = LISTING_CACHE_TTL, max_entries = LISTING_CACHE_MAX_ENTRIES, max_bytes = LISTING_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (path, value, nbytes, created)
+        self.nbytes = 0
+        self.counters = dict.fromkeys(STAT_NAMES, 0)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns cached value for key, or None if not cached or expired.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.counters['misses'] += 1
+                return None
+            path, value, nbytes, created = self.entries[key]
+            if time.time() - created > self.ttl:
+                self._remove(key)
+                self.counters['expired'] += 1
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return value
+
+    def put(self, key, path, value):
+        nbytes = len(json.dumps(value))
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (path, value, nbytes, time.time())
+            self.nbytes += nbytes
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+
+    def invalidate(self, path):
+        """ Removes entries for path, for all folders under path and for all folders above path.
+        """
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if e[0].startswith(path) or path.startswith(e[0])]:
+                self._remove(key)
+                self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            s = dict(self.counters)
+            s['entries'] = len(self.entries)
+            s['bytes'] = self.nbytes
+            return s
+
+    def _remove(self, key):
+        self.nbytes -= self.entries[key][2]
+        del self.entries[key]
+
+
+class SqliteListingCache:
+    """ On-disk LRU listing cache, backed by a sqlite file that several processes can share.
+    Hit/miss counters are also kept in the sqlite file, so they count across all processes.
+    A cache hit is a read only - its access time (for LRU eviction) and hit counter are kept in memory and
+    written in one batch after LISTING_CACHE_FLUSH_HITS hits or LISTING_CACHE_FLUSH_SECONDS, and before any eviction.
+    """
+    def __init__(self, db_file = LISTING_CACHE_DB, ttl = LISTING_CACHE_TTL, max_entries = LISTING_CACHE_MAX_ENTRIES, max_bytes = LISTING_CACHE_MAX_BYTES):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        # access times and hit count not yet written to the sqlite file - see _flush()
+        self.pending_access = {}
+        self.pending_hits = 0
+        self.last_flush = time.time()
+        self.pending_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS listings (key TEXT PRIMARY KEY, path TEXT, value TEXT, nbytes INTEGER, created REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS listings_accessed ON listings (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.executemany('INSERT OR IGNORE INTO counters VALUES (?, 0)', [(n,) for n in STAT_NAMES])
+
+    def _connect(self):
+        # sqlite connections cannot be shared between threads - Dash callbacks run in several threads.
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = sqlite3.connect(self.db_file, timeout=30)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+        return self.local.conn
+
+    def _count(self, conn, name, n = 1):
+        conn.execute('UPDATE counters SET value = value + ? WHERE name = ?', (n, name))
+
+    def _flush(self, conn, force = False):
+        """ Writes pending access times and hit count of cache hits, if there are enough of them (or if forced).
+        """
+        with self.pending_lock:
+            if self.pending_hits == 0 or (not force and self.pending_hits < LISTING_CACHE_FLUSH_HITS and time.time() - self.last_flush < LISTING_CACHE_FLUSH_SECONDS):
+                return
+            pending_access, pending_hits = self.pending_access, self.pending_hits
+            self.pending_access, self.pending_hits, self.last_flush = {}, 0, time.time()
+        conn.executemany('UPDATE listings SET accessed = MAX(accessed, ?) WHERE key = ?', [(t, k) for k, t in pending_access.items()])
+        self._count(conn, 'hits', pending_hits)
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, created FROM listings WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row != None and now - row[1] <= self.ttl:
+            with self.pending_lock:
+                self.pending_access[key] = now
+                self.pending_hits += 1
+            with conn:
+                self._flush(conn)
+            return json.loads(row[0])
+        with conn:
+            if row == None:
+                self._count(conn, 'misses')
+                return None
+            conn.execute('DELETE FROM listings WHERE key = ?', (key,))
+            self._count(conn, 'expired')
+            self._count(conn, 'misses')
+            return None
+
+    def put(self, key, path, value):
+        value_str = json.dumps(value)
+        if len(value_str) > self.max_bytes:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?)', (key, path, value_str, len(value_str), now, now))
+            n_entries, n_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM listings').fetchone()
+            if n_entries > self.max_entries or n_bytes > self.max_bytes:
+                # write pending access times first, so that recently read entries are not evicted
+                self._flush(conn, True)
+                # evict least recently used entries until we are under both limits
+                n_evicted = 0
+                for old_key, old_nbytes in conn.execute('SELECT key, nbytes FROM listings ORDER BY accessed ASC').fetchall():
+                    if n_entries <= self.max_entries and n_bytes <= self.max_bytes:
+                        break
+                    conn.execute('DELETE FROM listings WHERE key = ?', (old_key,))
+                    n_entries -= 1
+                    n_bytes -= old_nbytes
+                    n_evicted += 1
+                self._count(conn, 'evictions', n_evicted)
+
+    def invalidate(self, path):
+        with self._connect() as conn:
+            cur = conn.execute('DELETE FROM listings WHERE substr(path, 1, ?) = ? OR substr(?, 1, length(path)) = path', (len(path), path, path))
+            self._count(conn, 'invalidations', cur.rowcount)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM listings')
+
+    def stats(self):
+        conn = self._connect()
+        with conn:
+            self._flush(conn, True)
+        s = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        s['entries'], s['bytes'] = conn.execute('SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM listings').fetchone()
+        return s
+
+
+_listing_cache = None
+# True once the listing cache was configured - the 'none' backend is configured too, as _listing_cache = None
+_listing_cache_configured = False
+_listing_cache_lock = threading.Lock()
+
+def configureListingCache( backend = LISTING_CACHE_BACKEND, ttl = LISTING_CACHE_TTL, max_entries = LISTING_CACHE_MAX_ENTRIES, max_bytes = LISTING_CACHE_MAX_BYTES, db_file = LISTING_CACHE_DB ):
+    """ (Re)configures the listing cache used by this process.
+    backend: 'memory', 'sqlite' or 'none'
+    ttl: seconds before a cached listing expires
+    max_entries, max_bytes: LRU eviction limits
+    db_file: sqlite file for the 'sqlite' backend. Processes that use the same file share the cache.
+    """
+    global _listing_cache, _listing_cache_configured
+    with _listing_cache_lock:
+        _listing_cache_configured = True
+        if backend == 'sqlite':
+            _listing_cache = SqliteListingCache(db_file, ttl, max_entries, max_bytes)
+        elif backend == 'memory':
+            _listing_cache = MemoryListingCache(ttl, max_entries, max_bytes)
+        else:
+            _listing_cache = None
+    return _listing_cache
+
+
+def getListingCache():
+    """ Returns the listing cache of this process - configured from the environment defaults on first use -
+        or None if caching is turned off.
+
+    >>> configureListingCache( 'none' ) == None and getListingCache() == None
+    True
+    """
+    if not _listing_cache_configured:
+        configureListingCache()
+    return _listing_cache
+
+
+def getCachedListing( path, list_function, listing_type = 'folder' ):
+    """ Returns the listing of a folder path from the cache. On a miss, calls list_function(path) and caches the result.
+    path: folder path - e.g., 's3://hubseq/test/'
+    list_function: function that lists the folder. The returned value must be JSON-serializable.
+    listing_type: kind of listing (e.g., 'folder' or 'tree') - different kinds are cached separately.
+    """
+    cache = getListingCache()
+    if cache == None:
+        return list_function( path )
+    path = _normalizePath( path )
+    key = listing_type+'|'+path
+    listing = cache.get( key )
+    if listing == None:
+        listing = list_function( path )
+        cache.put( key, path, listing )
+    return listing
+
+
+def invalidateListingCache( path = '' ):
+    """ Drops cached listings of path, of all folders under path and of all folders above path.
+    An empty path clears the whole cache.
+    Only the 'sqlite' backend is shared between processes - with the 'memory' backend, this only drops
+    the listings cached by the calling process, and other processes keep theirs until they expire.
+    """
+    cache = getListingCache()
+    if cache != None:
+        if path in ['', None]:
+            cache.clear()
+        else:
+            cache.invalidate( _normalizePath( path ) )
+    return path
+
+
+def getListingCacheStats():
+    """ Returns hit/miss/eviction counters and current size of the listing cache.
+    """
+    cache = getListingCache()
+    return cache.stats() if cache != None else {}
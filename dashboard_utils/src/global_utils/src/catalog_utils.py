@@ -0,0 +1,251 @@
+#
+# catalog_utils
+#
+# Local sqlite catalog of pipeline output files, so that data dashboards can find sample files without
+# walking /teamid/userid/pipelineid/runid/sampleid/moduleid/ folders on every callback.
+#
+# Tables:
+#   files     - one row per file: team, user, pipeline, run, sample, module, file name, file type, size, last modified
+#   runs      - signature of each run folder when it was last cataloged: number of files, total size, latest LastModified
+#   pipelines - when each pipeline folder was last checked for changes
+#
+# Refresh:
+#   S3 has no folder timestamps, so a pipeline folder is checked with one recursive listing (or one listing per selected run).
+#   Only runs whose signature changed are re-cataloged. A pipeline folder is checked at most once every
+#   CATALOG_REFRESH_TTL seconds, unless it was marked stale with markCatalogStale() (e.g., by run_pipeline).
+#   markCatalogStale() only reaches the catalog file on the same machine - a catalog on another machine (e.g., a dashboard host)
+#   finds new files of a run only at its next refresh, up to CATALOG_REFRESH_TTL seconds later.
+#
+# Defaults can be set with environment variables:
+#   HUBSEQ_CATALOG_DB, HUBSEQ_CATALOG_REFRESH_TTL
+#
+import os, time, sqlite3, tempfile, threading
+import global_keys
+import aws_s3_utils
+import file_utils
+
+CATALOG_DB = os.environ.get('HUBSEQ_CATALOG_DB', os.path.join(tempfile.gettempdir(), 'hubseq_catalog.sqlite'))
+CATALOG_REFRESH_TTL = float(os.environ.get('HUBSEQ_CATALOG_REFRESH_TTL', 60))   # seconds
+
+# path levels below the root folder - /teamid/userid/pipelineid/runid/sampleid/moduleid/<FILE>
+CATALOG_LEVELS = ['team', 'user', 'pipeline', 'run', 'sample', 'module']
+
+_local = threading.local()
+
+
+def _connect( db_file = None ):
+    """ One sqlite connection per thread and catalog file - Dash callbacks run in several threads.
+    """
+    db_file = db_file if db_file != None else CATALOG_DB
+    conns = getattr(_local, 'conns', None)
+    if conns == None:
+        conns = _local.conns = {}
+    if db_file not in conns:
+        conn = sqlite3.connect(db_file, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files (root TEXT, team TEXT, user TEXT, pipeline TEXT, run TEXT, sample TEXT, module TEXT, '
+                         'file_name TEXT, file_type TEXT, size INTEGER, last_modified REAL, '
+                         'PRIMARY KEY (root, team, user, pipeline, run, sample, module, file_name))')
+            conn.execute('CREATE TABLE IF NOT EXISTS runs (root TEXT, team TEXT, user TEXT, pipeline TEXT, run TEXT, '
+                         'n_files INTEGER, total_size INTEGER, last_modified REAL, cataloged REAL, '
+                         'PRIMARY KEY (root, team, user, pipeline, run))')
+            conn.execute('CREATE TABLE IF NOT EXISTS pipelines (root TEXT, team TEXT, user TEXT, pipeline TEXT, checked REAL, '
+                         'PRIMARY KEY (root, team, user, pipeline))')
+        conns[db_file] = conn
+    return conns[db_file]
+
+
+def _normalizeRoot( root_folder ):
+    """ Root folders are cataloged as 's3://' or '/'.
+    >>> _normalizeRoot( 's3:/' )
+    's3://'
+    """
+    return 's3://' if str(root_folder).lstrip(' \t').startswith('s3:') else '/'
+
+
+def _listRunFiles( pipeline_folder, runid = '' ):
+    """ Lists all files under a pipeline folder (or under one run folder of it), grouped by run.
+    RETURN: {runid: [(sampleid, moduleid, file_name, size, last_modified), ...]}
+            file_name is the path below the module folder. Files above the module level have empty sample/module IDs.
+    """
+    folder = os.path.join(pipeline_folder, runid).rstrip('/')+'/'
+    rel_prefix = runid.strip('/')+'/' if runid != '' else ''
+    listing = []
+    if folder.startswith('s3://'):
+        bucket, prefix = aws_s3_utils._getS3PathPrefix( folder )
+        try:
+            for file_info in aws_s3_utils.iterObjects_S3( folder, '' ):
+                if not file_info['Key'].endswith('/'):
+                    listing.append((rel_prefix+file_info['Key'][len(prefix):], file_info['Size'], file_info['LastModified'].timestamp()))
+        except aws_s3_utils.ClientError as e:
+            print('CLIENT ERROR in catalog_utils._listRunFiles() for {}: {}'.format(folder, str(e)))
+    else:
+        for dirpath, dirnames, filenames in os.walk( folder ):
+            for f in filenames:
+                s = os.stat(os.path.join(dirpath, f))
+                listing.append((rel_prefix+os.path.relpath(os.path.join(dirpath, f), folder), s.st_size, s.st_mtime))
+
+    runs = {}
+    for rel_path, size, last_modified in listing:
+        parts = rel_path.split('/')
+        if len(parts) < 2:
+            continue  # files directly in the pipeline folder are not part of a run
+        elif len(parts) >= 4:
+            runs.setdefault(parts[0], []).append((parts[1], parts[2], '/'.join(parts[3:]), size, last_modified))
+        else:
+            runs.setdefault(parts[0], []).append(('', '', '/'.join(parts[1:]), size, last_modified))
+    return runs
+
+
+def _runSignature( run_files ):
+    """ (number of files, total size, latest modification time) of a run - changes whenever a file is added, removed or rewritten.
+    >>> _runSignature( [('s1', 'fastqc', 's1.html', 10, 5.0), ('s1', 'fastqc', 's1.zip', 20, 7.0)] )
+    (2, 30, 7.0)
+    """
+    return (len(run_files), sum(f[3] for f in run_files), max([f[4] for f in run_files]) if run_files != [] else 0.0)
+
+
+def refreshCatalog( root_folder, teamid, userids_in = [], pipelineids_in = [], runids_in = [], force = False, db_file = None ):
+    """ Brings the catalog up to date for a set of users and pipelines (and optionally runs).
+    Only runs whose signature (number of files, total size, latest LastModified) changed are re-cataloged,
+    and runs that were deleted are dropped. Pipelines checked less than CATALOG_REFRESH_TTL seconds ago are skipped,
+    unless force is True or they were marked stale.
+
+    root_folder: STRING - root folder for all team folders. Usually 's3://' (for S3) or '/' (for root local)
+    userids_in, pipelineids_in, runids_in: LISTs of folders to include at each level (empty list = all)
+    RETURN: {'pipelines_checked': INT, 'runs_cataloged': INT, 'runs_deleted': INT}
+    """
+    root = _normalizeRoot( root_folder )
+    conn = _connect( db_file )
+    stats = {'pipelines_checked': 0, 'runs_cataloged': 0, 'runs_deleted': 0}
+    now = time.time()
+    for userid in file_utils.getSubFolders( os.path.join(root, teamid), userids_in ):
+        for pipeid in file_utils.getSubFolders( os.path.join(root, teamid, userid), pipelineids_in ):
+            pipeline_key = (root, teamid, userid, pipeid)
+            # selected runs are checked with one listing each, and do not count as a check of the whole pipeline
+            if runids_in in [[], None, '']:
+                row = conn.execute('SELECT checked FROM pipelines WHERE root=? AND team=? AND user=? AND pipeline=?', pipeline_key).fetchone()
+                if not force and row != None and now - row[0] < CATALOG_REFRESH_TTL:
+                    continue
+                runs = _listRunFiles( os.path.join(root, teamid, userid, pipeid) )
+                runs_checked = None
+            else:
+                runs_checked = [runids_in] if type(runids_in) == str else runids_in
+                if not force and all(_isRunFresh( conn, pipeline_key, rid, now ) for rid in runs_checked):
+                    continue
+                runs = {}
+                for rid in runs_checked:
+                    runs.update( _listRunFiles( os.path.join(root, teamid, userid, pipeid), rid ))
+            stats['pipelines_checked'] += 1
+            with conn:
+                cataloged = dict((r[0], tuple(r[1:])) for r in conn.execute('SELECT run, n_files, total_size, last_modified FROM runs '
+                                                                           'WHERE root=? AND team=? AND user=? AND pipeline=?', pipeline_key))
+                for rid, run_files in runs.items():
+                    if cataloged.get(rid) == _runSignature( run_files ):
+                        conn.execute('UPDATE runs SET cataloged=? WHERE root=? AND team=? AND user=? AND pipeline=? AND run=?', (now,)+pipeline_key+(rid,))
+                        continue
+                    _catalogRun( conn, pipeline_key, rid, run_files, now )
+                    stats['runs_cataloged'] += 1
+                for rid in cataloged:
+                    if rid not in runs and (runs_checked == None or rid in runs_checked):
+                        _deleteRun( conn, pipeline_key, rid )
+                        stats['runs_deleted'] += 1
+                if runs_checked == None:
+                    conn.execute('INSERT OR REPLACE INTO pipelines VALUES (?, ?, ?, ?, ?)', pipeline_key+(now,))
+    return stats
+
+
+def _isRunFresh( conn, pipeline_key, runid, now ):
+    row = conn.execute('SELECT cataloged FROM runs WHERE root=? AND team=? AND user=? AND pipeline=? AND run=?', pipeline_key+(runid,)).fetchone()
+    return row != None and now - row[0] < CATALOG_REFRESH_TTL
+
+
+def _catalogRun( conn, pipeline_key, runid, run_files, now ):
+    """ Replaces all catalog rows of one run.
+    """
+    _deleteRun( conn, pipeline_key, runid )
+    conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [pipeline_key+(runid, sid, mid, fname, file_utils.inferFileType(fname), size, lm) for sid, mid, fname, size, lm in run_files])
+    conn.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', pipeline_key+(runid,)+_runSignature( run_files )+(now,))
+
+
+def _deleteRun( conn, pipeline_key, runid ):
+    conn.execute('DELETE FROM files WHERE root=? AND team=? AND user=? AND pipeline=? AND run=?', pipeline_key+(runid,))
+    conn.execute('DELETE FROM runs WHERE root=? AND team=? AND user=? AND pipeline=? AND run=?', pipeline_key+(runid,))
+
+
+def catalogAddFiles( file_paths, db_file = None ):
+    """ Adds files to the catalog without listing any folders - e.g., output files of a finished job.
+    The run is also marked stale, so that the next refresh re-checks its signature.
+
+    file_paths: LIST of full file paths - /teamid/userid/pipelineid/runid/sampleid/moduleid/<FILE>, local or S3
+    RETURN: number of files added, INT
+    """
+    if type(file_paths) == str:
+        file_paths = [file_paths]
+    conn = _connect( db_file )
+    rows = []
+    for file_path in file_paths:
+        root = _normalizeRoot( file_path )
+        parts = file_path[len('s3://'):].split('/') if root == 's3://' else file_path.lstrip('/').split('/')
+        if len(parts) < 7 or parts[-1] == '':
+            continue
+        rows.append((root,)+tuple(parts[0:6])+('/'.join(parts[6:]), file_utils.inferFileType(parts[-1]), None, time.time()))
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        for run_key in set(r[0:5] for r in rows):
+            conn.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, -1, 0, 0, 0)', run_key)
+            conn.execute('UPDATE runs SET n_files = -1 WHERE root=? AND team=? AND user=? AND pipeline=? AND run=?', run_key)
+    return len(rows)
+
+
+def markCatalogStale( folder, db_file = None ):
+    """ Forces the next refresh to re-check all pipelines and runs at or under folder (or containing it).
+    folder: e.g., 's3://team/user/pipeline/run/', or '' for everything
+    """
+    conn = _connect( db_file )
+    root = _normalizeRoot( folder )
+    parts = [p for p in (folder[len('s3://'):] if root == 's3://' else folder).split('/') if p != ''] if folder not in ['', None] else []
+    where = ' AND '.join(['root=?']+[c+'=?' for c in CATALOG_LEVELS[0:min(len(parts), 3)]])
+    with conn:
+        conn.execute('UPDATE pipelines SET checked = 0 WHERE '+where, [root]+parts[0:3])
+        where = ' AND '.join(['root=?']+[c+'=?' for c in CATALOG_LEVELS[0:min(len(parts), 4)]])
+        conn.execute('UPDATE runs SET cataloged = 0 WHERE '+where, [root]+parts[0:4])
+    return folder
+
+
+def queryCatalog( root_folder, teamid, userids_in = [], pipelineids_in = [], runids_in = [], sampleids_in = [], moduleids_in = [],
+                  extensions2include = [], extensions2exclude = [], refresh = True, as_columns = False, db_file = None ):
+    """ Gets data file JSONs for all files in sample/module output folders that match the selected IDs and file patterns.
+    Returns the same data file JSONs as file_utils.getDataFiles( file_utils.getRunSampleOutputFolders( ... ) ).
+
+    root_folder: STRING - root folder for all team folders. Usually 's3://' (for S3) or '/' (for root local)
+    userids_in ... moduleids_in: LISTs of IDs to include at each level (empty list = all)
+    extensions2include, extensions2exclude: file patterns - see aws_s3_utils._findMatches()
+    refresh: bring the catalog up to date first (see refreshCatalog()), BOOL
+    as_columns: return data file columns instead of data file JSONs - see file_utils.createDataFileJSONs()
+    RETURN: LIST of data file JSONs (or DICT of columns)
+    """
+    if refresh:
+        refreshCatalog( root_folder, teamid, userids_in, pipelineids_in, runids_in, db_file = db_file )
+    root = _normalizeRoot( root_folder )
+    # fingerprint markers of resumed runs (file_utils.RUN_FINGERPRINTS_FOLDER) are in the run folder, but are not a sample
+    where, params = ['root=?', 'team=?', "sample != ''", 'sample != ?', "module != ''", "instr(file_name, '/') = 0"], [root, teamid, file_utils.RUN_FINGERPRINTS_FOLDER]
+    for column, ids in zip(CATALOG_LEVELS[1:], [userids_in, pipelineids_in, runids_in, sampleids_in, moduleids_in]):
+        if type(ids) == str:
+            ids = [ids] if ids != '' else []
+        if ids not in [[], None]:
+            where.append('{} IN ({})'.format(column, ','.join(['?']*len(ids))))
+            params += list(ids)
+    matcher = aws_s3_utils.PatternMatcher( extensions2include, extensions2exclude )
+    columns = {k: [] for k in file_utils.DATA_FILE_KEYS}
+    for row in _connect( db_file ).execute('SELECT user, pipeline, run, sample, module, file_name, file_type FROM files WHERE '+' AND '.join(where)+
+                                           ' ORDER BY user, pipeline, run, sample, module, file_name', params):
+        userid, pipeid, runid, sampleid, moduleid, file_name, file_type = row
+        if '.' in file_name and matcher.match(file_name):
+            # IDs come from the catalog columns, so file paths are not parsed again
+            for k, v in zip(file_utils.DATA_FILE_KEYS, [os.path.join(root, teamid, userid, pipeid, runid, sampleid, moduleid, file_name), file_type,
+                                                       teamid, userid, pipeid, runid, sampleid, moduleid, global_keys.DATA_FILE_JSON_VERSION]):
+                columns[k].append(v)
+    return columns if as_columns else file_utils.dataFileColumnsToJSONs( columns )
@@ -62,9 +62,12 @@
 # ['group_module_version_id'] = <STRING FORMAT: yyyymmdd> - version of module that was run on this file. Note - if this is a custom notebook, then this is the timestamp the notebook was last saved.
 # ['json_version_id'] = <STRING FORMAT: yyyymmdd>
 
-import os, sys, json, subprocess, boto3
+import os, re, sys, json, gzip, hashlib, functools, subprocess, boto3
 import global_keys
 import aws_s3_utils
+import cache_utils
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 PIPELINE_file_utils_JSON_VERSION = '20211219'
 GROUP_JSON_VERSION = '20211219'
@@ -72,6 +75,28 @@ GROUP_JSON_VERSION = '20211219'
 VALID_FILETYPES = ['FASTQ', 'BAM', 'SAM', 'BED', 'TXT', 'CSV', 'JSON', 'GZ', 'FASTQ.GZ', 'WIG', 'HTML', 'TAB']
 COMBO_FILETYPES = ['FASTQ.GZ']
 
+# key for the list of files within a folder node of a run tree - '/' can never be a folder name
+RUN_TREE_FILES = '/'
+# job states of a run, written into the run folder by the batch job monitor
+RUN_STATUS_FILE = '.run_status.json'
+# input fingerprints of the completed jobs of a run (for resumed runs): each job writes an empty marker file
+# <run folder>/.fingerprints/<module>/<sample_id>.<fingerprint> once its outputs are uploaded
+RUN_FINGERPRINTS_FOLDER = '.fingerprints'
+# sequencing file name suffixes that follow the sample ID, in order of precedence (case-insensitive) - e.g., <sample_id>_S1_L001_R1_001.fastq.gz
+# Illumina _S<n>_<suffix> comes first: the highest sample number wins, then the first suffix in ILLUMINA_SAMPLE_SUFFIXES.
+# Otherwise one pattern per suffix, each capturing the file name up to the last occurrence of that suffix.
+ILLUMINA_SAMPLE_SUFFIXES = ['L001', 'L002', 'L003', 'L004', 'R1', 'R2', 'I1', 'I2']
+ILLUMINA_SAMPLE_PATTERN = re.compile(r'(?=_S(0|[1-9]\d*)_({}))'.format('|'.join(ILLUMINA_SAMPLE_SUFFIXES)), re.IGNORECASE)
+SAMPLE_ID_PATTERNS = tuple(re.compile(r'^(.*)'+suffix, re.IGNORECASE | re.DOTALL) for suffix in \
+                           ['_L001', '_L002', '_L003', '_L004'] + [sep+s for sep in ['_', r'\.', '-'] for s in ['R1', 'R2', 'I1', 'I2']])
+# number of file names whose sample IDs are memoized
+SAMPLE_ID_CACHE_SIZE = int(os.environ.get('HUBSEQ_SAMPLE_ID_CACHE_SIZE', 65536))
+
+# a file path parsed once into its parts - see parsePath(). Path helpers (inferFileType(), getFileOnly(), ...) accept these
+# records in place of path strings. file_system: 's3' or 'local'; bucket: S3 bucket ('' for local paths); key: S3 key (local path
+# for local files); folder, file_name, file_type, sample_id: as returned by getFileFolder(), getFileOnly(), inferFileType() and inferSampleID()
+PathRecord = namedtuple('PathRecord', ['path', 'file_system', 'bucket', 'key', 'folder', 'file_name', 'file_type', 'sample_id'])
+
 #####################################################
 # MISCELLANEOUS FILE helper FUNCTIONS
 #####################################################
@@ -136,6 +161,49 @@ def loadJSON( fname ):
     return myjson
 
 
+def writeJSONManifest( json_list, fout_name ):
+    """ Writes a list of JSONs to one gzipped JSON-lines manifest file.
+        Each line is compressed as its own gzip member, so one entry can be read back with a ranged read (see readJSONManifestEntry()),
+        while the whole file is still a valid .jsonl.gz file.
+        RETURN: LIST of entry references '<offset>:<length>', in the same order as json_list
+
+    >>> writeJSONManifest( [{'a': 1}, {'b': 2}], '/tmp/test.manifest.jsonl.gz' )[0]
+    '0:29'
+    >>> readJSONManifestEntry( '/tmp/test.manifest.jsonl.gz#' + writeJSONManifest( [{'a': 1}, {'b': 2}], '/tmp/test.manifest.jsonl.gz' )[1] )
+    {'b': 2}
+    """
+    entries = []
+    offset = 0
+    with open(fout_name, 'wb') as fout:
+        for myjson in json_list:
+            # mtime=0 so the same JSONs always give the same bytes
+            entry = gzip.compress((json.dumps(myjson)+'\n').encode('utf-8'), mtime=0)
+            fout.write(entry)
+            entries.append('{}:{}'.format(offset, len(entry)))
+            offset += len(entry)
+    return entries
+
+
+def isJSONManifestEntry( file_path ):
+    """ True if a file path refers to one entry of a JSON manifest: <manifest path>#<offset>:<length>
+
+    >>> isJSONManifestEntry( 's3://hubseq-data/modules/fastqc/io/fastqc.1234.io.jsonl.gz#0:29' )
+    True
+    >>> isJSONManifestEntry( 's3://hubseq-data/modules/fastqc/io/fastqc.1234.io.json' )
+    False
+    """
+    return '#' in str(file_path) and ':' in str(file_path).split('#')[-1]
+
+
+def readJSONManifestEntry( file_path ):
+    """ Reads one entry of a local or S3 JSON manifest with a ranged read.
+        file_path: <manifest path>#<offset>:<length>
+    """
+    manifest_path, entry = str(file_path).rsplit('#', 1)
+    offset, length = entry.split(':')
+    return json.loads( gzip.decompress( readFileRange( manifest_path, int(offset), int(length) )).decode('utf-8') )
+
+
 def copyLocalFiles( local_files, dest_folder, linkonly = False ):
     """ Copies local file(s) to a destination folder.
     If linkonly is True, only set up a symbolic link.
@@ -170,6 +238,48 @@ def copyLocalFiles( local_files, dest_folder, linkonly = False ):
         return getFullPath(dest_folder, getFileOnly(local_files), returnAsString)
 
 
+def _isAllS3( files ):
+    """ True if all files of a file path or LIST of file paths are on S3.
+
+    >>> _isAllS3( ['s3://a/b.bam', 's3://a/c.bam'] )
+    True
+    >>> _isAllS3( ['s3://a/b.bam', '/local/c.bam'] )
+    False
+    """
+    files = [files] if type(files) == type('') else files
+    return files != [] and all(type(f) == type('') and 's3:/' in f for f in files)
+
+
+def copyFiles( files, dest_folder ):
+    """ Copies remote file(s) to a destination folder on the same file system, without downloading them:
+        S3 objects are copied server-side (multipart for objects over 5GB), local files with cp.
+        A destination that is a file name (rather than a folder) is allowed for a single file.
+    RETURN: full path(s) of copied file(s) - STRING if files is a STRING
+    """
+    if _isAllS3( files ) and 's3:/' in str(dest_folder):
+        if type(files) == type(''):
+            is_dest_file = '.' in dest_folder.split('/')[-1]
+            return aws_s3_utils.copyObject_S3( files, dest_folder if is_dest_file else dest_folder.rstrip('/')+'/' )
+        return aws_s3_utils.copyObjects_S3( files, dest_folder )
+    elif not _isAllS3( files ) and 's3:/' not in str(dest_folder):
+        return copyLocalFiles( files, dest_folder )
+    else:
+        print('WARNING: cannot copy {} to {} - files are on different file systems.'.format(str(files), str(dest_folder)))
+        return ''
+
+
+def copyFile( source_file, dest_file ):
+    """ Copies one file to another full path on the same file system - see copyFiles().
+    RETURN: full path of copied file, or '' if the file systems differ
+    """
+    if _isAllS3( source_file ) and 's3:/' in str(dest_file):
+        # copyFiles() guesses from its name whether the destination is a folder - here it is always a file
+        return aws_s3_utils.copyObject_S3( source_file, dest_file )
+    elif not _isAllS3( source_file ) and 's3:/' not in str(dest_file):
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    return dest_file if copyFiles( source_file, dest_file ) != '' else ''
+
+
 def copyLocalFolder( local_folder, dest_folder ):
     """ Copies contents of local folder to a destination folder
     """
@@ -216,6 +326,9 @@ def downloadFiles( files, dest_folder, file_system = 'local', mock = False, link
     dest_fullpath = getFullPath(dest_folder, getFileOnly(files))
     if mock == True:
         return dest_fullpath
+    elif 's3:/' in str(dest_folder) and _isAllS3( files ):
+        # both sides on S3 - copy server-side instead of downloading
+        return copyFiles( files, dest_folder )
     elif file_system.lower() == 's3' or 's3:/' in str(files):
         return aws_s3_utils.downloadFiles_S3(files, dest_folder)
     elif file_system.lower() == 'local':
@@ -299,6 +412,10 @@ def uploadFiles(localfiles, remote_path, file_system = 'local', mock = False):
     """
     if type(localfiles) == type(''):
         return uploadFile(localfiles, remote_path, file_system, mock)
+    elif type(localfiles) == type([]) and mock != True and 's3:/' in str(remote_path) and _isAllS3( localfiles ):
+        # both sides on S3 - copy server-side, all files in parallel
+        print('Uploading file(s) {} to {}.'.format(str(localfiles), str(remote_path)))
+        return copyFiles( localfiles, remote_path )
     elif type(localfiles) == type([]):
         uploaded_files = []
         for localfile in localfiles:
@@ -331,6 +448,9 @@ def uploadFile(localfile, remote_path, file_system = 'local', mock = False):
     print('Uploading file {} to {}.'.format(str(localfile), str(remote_path)))
     if mock == True:
         return remote_path
+    elif 's3:/' in str(remote_path) and _isAllS3( localfile ):
+        # both sides on S3 - copy server-side instead of uploading
+        return copyFiles( localfile, remote_path )
     elif file_system.lower() == 's3' or ('s3:/' in str(remote_path)):
         remote_uploaded_path = aws_s3_utils.uploadFiles_S3( localfile, remote_path )
         # return full remote path
@@ -373,7 +493,12 @@ def inferFileType( _fn ):
     'fastq'
     >>> inferFileType( ['a/folder', 'blah2.fastq'] )
     ''
+    >>> inferFileType( parsePath( 's3://fastq/blah.fastq.gz' ) )
+    'fastq.gz'
     """
+    if type(_fn) == PathRecord:
+        return _fn.file_type
+    _fn = _getPaths( _fn )
     if type(_fn) == type('') and '.' in _fn.split('/')[-1]:
         return _fn.split('.')[-1] if len(list(filter(lambda combo: _fn.upper().endswith(combo), COMBO_FILETYPES))) == 0 else _fn.split('.')[-2]+'.'+_fn.split('.')[-1]
     elif type(_fn) == type([]) and _fn != [] and '.' in _fn[0].split('/')[-1]:
@@ -385,6 +510,7 @@ def inferFileType( _fn ):
 def getFileSystem( file_fullpath ):
     """ Gets the file system s3:// or / or gs://
     """
+    file_fullpath = _getPaths( file_fullpath )
     fs = '/'
     if type(file_fullpath) == type([]) and file_fullpath != []:
         if file_fullpath[0].startswith('s3:'):
@@ -411,6 +537,9 @@ def getFileOnly( file_fullpath ):
     >>> getFileOnly( '/this/is/a/path/' )
     ''
     """
+    if type(file_fullpath) == PathRecord:
+        return file_fullpath.file_name
+    file_fullpath = _getPaths( file_fullpath )
     if type(file_fullpath) == type([]):
         files_only = []
         for f in file_fullpath:
@@ -433,6 +562,9 @@ def getFileFolder( file_fullpath ):
     >>> getFileFolder( ['/this/is/a/path/to.txt'] )
     '/this/is/a/path/'
     """
+    if type(file_fullpath) == PathRecord:
+        return file_fullpath.folder
+    file_fullpath = _getPaths( file_fullpath )
     if type(file_fullpath) == type([]) and file_fullpath != []:
         # get directory of first file
         if '.' in file_fullpath[0].split('/')[-1]:
@@ -462,6 +594,9 @@ def inferFileSystem( filepath ):
     >>> inferFileSystem( ['s3://hubpublicinternal/', 's3://test/'] )
     's3'
     """
+    if type(filepath) == PathRecord:
+        return filepath.file_system
+    filepath = _getPaths( filepath )
     fs = 'local'  # default is local
     if type(filepath) == list or type(filepath) == tuple:
         for f in filepath:
@@ -481,6 +616,55 @@ def inferFileSystem( filepath ):
     return fs
 
 
+def parsePath( file_path ):
+    """ Parses a local or S3 path once into a PathRecord, so that its parts need not be re-derived by each path helper.
+
+    >>> parsePath( 's3://fastq/run1/test_S1_L001_R1_001.fastq.gz' )
+    PathRecord(path='s3://fastq/run1/test_S1_L001_R1_001.fastq.gz', file_system='s3', bucket='fastq', key='run1/test_S1_L001_R1_001.fastq.gz', folder='s3://fastq/run1/', file_name='test_S1_L001_R1_001.fastq.gz', file_type='fastq.gz', sample_id='test')
+    >>> parsePath( '/data/run1/' ).file_name
+    ''
+    """
+    if type(file_path) == PathRecord:
+        return file_path
+    if file_path.startswith('s3://'):
+        bucket, key = file_path.split('/')[2], '/'.join(file_path.split('/')[3:])
+    else:
+        bucket, key = '', file_path
+    base_name = file_path.split('/')[-1]
+    if '.' in base_name:
+        file_name = base_name
+        folder = file_path[0:file_path.rfind('/')]+'/'
+        file_type = base_name.split('.')[-1] if not any(file_path.upper().endswith(combo) for combo in COMBO_FILETYPES) \
+                    else file_path.split('.')[-2]+'.'+file_path.split('.')[-1]
+    else:
+        file_name, folder, file_type = '', file_path.rstrip('/')+'/', ''
+    return PathRecord(file_path, inferFileSystem( file_path ), bucket, key, folder, file_name, file_type, inferSampleID( file_path ))
+
+
+def parsePaths( file_paths ):
+    """ Parses a list of local or S3 paths into PathRecords - see parsePath(). Each distinct path is parsed once.
+    RETURN: LIST of PathRecords, in the same order as file_paths
+
+    >>> [r.file_type for r in parsePaths( ['s3://bam/a.bam', 's3://bam/a.bam', '/fastq/a_R1.fastq.gz'] )]
+    ['bam', 'bam', 'fastq.gz']
+    """
+    records = {}
+    for file_path in file_paths:
+        if file_path not in records:
+            records[file_path] = parsePath( file_path )
+    return [records[file_path] for file_path in file_paths]
+
+
+def _getPaths( file_paths ):
+    """ Private function - converts PathRecords (or a list that contains PathRecords) back into path strings. Other input is returned as is.
+    """
+    if type(file_paths) == PathRecord:
+        return file_paths.path
+    elif type(file_paths) == type([]) and any(type(f) == PathRecord for f in file_paths):
+        return [f.path if type(f) == PathRecord else f for f in file_paths]
+    return file_paths
+
+
 def getFullPath(root_folder, files, convert2string = False):
     """ Given a root_folder and a file STRING or LIST of files, return the full paths to these file(s).
     Need some error checking here (e.g., root_folder cannot be blank)
@@ -505,6 +689,7 @@ def getFullPath(root_folder, files, convert2string = False):
         # just return files if root folder is empty
         elif root_folder == [] or root_folder == '':
             return files
+        files = _getPaths( files )
         # if files argument is a single filename string -> create single element list
         if type(files) == type(''):
             files = [files]
@@ -543,19 +728,134 @@ def _listSubFilesLocal( root_folder, patterns2include = [], patterns2exclude = [
     """
     try:
         rfiles = []
+        matcher = aws_s3_utils.PatternMatcher(patterns2include, patterns2exclude)
         subfiles = os.listdir(root_folder)
         for subfile in subfiles:
             if (getFiles == True and not os.path.isdir(subfile)) or (getFolders == True and os.path.isdir(subfile)):
-                if ((patterns2include != [] and aws_s3_utils._findMatches(subfile, patterns2include)) or \
-                    (patterns2include == [])) and \
-                   ((patterns2exclude != [] and not aws_s3_utils._findMatches(subfile, patterns2exclude)) or \
-                    (patterns2exclude == [])):
+                if matcher.match(subfile):
                     rfiles.append(subfile)
         return rfiles
     except FileNotFoundError:
         return []
 
 
+def _listS3Folder( root_folder ):
+    """ Private function that gets the full (unfiltered) listing of an S3 folder, through the listing cache.
+        getSubFiles() and getSubFolders() share the same cached listing.
+        RETURN: {'files': LIST of file names, 'folders': LIST of sub-folder names}
+    """
+    def _list( s3_folder ):
+        found_files, found_folders = aws_s3_utils.listSubFilesAndFolders( s3_folder )
+        return {'files': found_files, 'folders': found_folders}
+    return cache_utils.getCachedListing( root_folder, _list )
+
+
+def invalidateListingCache( folder = '' ):
+    """ Drops cached listings of a folder (and of its sub-folders and parent folders), e.g. after writing new files to it.
+        An empty folder clears all cached listings.
+    """
+    return cache_utils.invalidateListingCache( folder )
+
+
+def setTransferProfile( profile = 'default' ):
+    """ Sets multipart transfer settings (threshold, chunk size, concurrency, threads) for S3 file downloads and uploads.
+        profile: profile name (e.g., 'default', 'large') or dict of settings - see aws_s3_utils.getTransferProfile()
+    """
+    return aws_s3_utils.setTransferProfile( profile )
+
+
+def touchFile( file_path, scratch_dir = '/tmp' ):
+    """ Creates an empty local or S3 file (e.g., a marker file). Local parent folders are created as needed.
+    RETURN: path of file
+    """
+    if 's3:/' in str(file_path):
+        # uploads go to a folder, under the local file name
+        local_file = os.path.join(scratch_dir, file_path.split('/')[-1])
+        open(local_file, 'w').close()
+        uploaded_file = uploadFile( local_file, file_path[0:file_path.rfind('/')+1] )
+        os.remove(local_file)
+        return uploaded_file
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    open(file_path, 'w').close()
+    return file_path
+
+
+def readFileRange( file_path, start = 0, length = None ):
+    """ Reads length bytes from start of a local or S3 file (length None = to end of file), without downloading the whole file.
+        e.g., to read a FASTQ or BAM header.
+
+    >>> readFileRange( '/etc/hostname', 0, 0 )
+    b''
+    """
+    if type(file_path) == type([]):
+        file_path = file_path[0]
+    if 's3:/' in str(file_path):
+        return aws_s3_utils.getObjectRange_S3( file_path, start, length )
+    elif length != None and length <= 0:
+        return b''
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read() if length == None else f.read(length)
+
+
+def readFileIfChanged( file_path, etag = '' ):
+    """ Reads a local or S3 file, unless it is unchanged since it was read with the given etag.
+        For local files, the modification time and size serve as the ETag.
+        RETURN: (BYTES, or None if unchanged, current etag)
+    """
+    if 's3:/' in str(file_path):
+        return aws_s3_utils.getObjectIfChanged_S3( file_path, etag )
+    local_etag = '{}-{}'.format(str(os.path.getmtime(file_path)), str(os.path.getsize(file_path)))
+    if local_etag == etag:
+        return (None, etag)
+    with open(file_path, 'rb') as f:
+        return (f.read(), local_etag)
+
+
+def listFileETags( root_folder, recursive = False ):
+    """ Lists all files in a local or S3 folder with one listing, along with their ETags.
+        For local files, the modification time and size serve as the ETag (as for readFileIfChanged()).
+        Folders that do not exist have no files.
+
+    recursive: also list files in sub-folders
+    RETURN: {<full file path>: <etag>}
+    """
+    root_folder = root_folder.rstrip('/')+'/'
+    file_etags = {}
+    if 's3:/' in root_folder:
+        bucket = root_folder.split('/')[2]
+        for file_info in aws_s3_utils.iterObjects_S3( root_folder, '' if recursive else '/' ):
+            if 'Key' in file_info and not file_info['Key'].endswith('/'):
+                file_etags['s3://{}/{}'.format(bucket, file_info['Key'])] = file_info['ETag'].strip('"')
+    elif os.path.isdir(root_folder):
+        for dir_path, dir_names, file_names in os.walk(root_folder):
+            for file_name in file_names:
+                f = os.path.join(dir_path, file_name)
+                file_etags[f] = '{}-{}'.format(str(os.path.getmtime(f)), str(os.path.getsize(f)))
+            if not recursive:
+                break
+    return file_etags
+
+
+def getFileETags( files ):
+    """ Gets the ETags of local or S3 files (see listFileETags()), with one listing per parent folder.
+        A folder (path ending in '/') gets one ETag for all files under it.
+    RETURN: {<file or folder>: <etag>} - '' for files that were not found
+    """
+    folder_listings = {}
+    file_etags = {}
+    for f in files:
+        if f.endswith('/'):
+            folder_etags = listFileETags( f, True )
+            file_etags[f] = hashlib.sha1(json.dumps(folder_etags, sort_keys=True).encode('utf-8')).hexdigest() if folder_etags != {} else ''
+        else:
+            parent_folder = f[:f.rfind('/')+1]
+            if parent_folder not in folder_listings:
+                folder_listings[parent_folder] = listFileETags( parent_folder )
+            file_etags[f] = folder_listings[parent_folder].get(f, '')
+    return file_etags
+
+
 def listSubFiles( root_folder, patterns2include = [], patterns2exclude = [], includeFullPath = False ):
     return getSubFiles( root_folder, patterns2include, patterns2exclude, includeFullPath )
 
@@ -598,7 +898,7 @@ def getSubFiles( root_folder, patterns2include = [], patterns2exclude = [], incl
 
     if root_folder.lstrip(' \t').startswith('s3://'):
         # print('FILES FOUND ON S3: {}'.format(str(aws_s3_utils.listSubFiles( root_folder, patterns2include, patterns2exclude ))))
-        found_files = aws_s3_utils.listSubFiles( root_folder, patterns2include, patterns2exclude )
+        found_files = list(aws_s3_utils.PatternMatcher(patterns2include, patterns2exclude).filter( _listS3Folder( root_folder )['files'] ))
         return getFullPath( root_folder, found_files ) if includeFullPath else found_files
     elif root_folder.lstrip(' \t').startswith('/') or root_folder.lstrip(' \t').startswith('~/') or root_folder.lstrip(' \t').startswith('./'):
         found_files = _listSubFilesLocal( root_folder, patterns2include, patterns2exclude )
@@ -637,7 +937,8 @@ def getSubFolders( root_folder, sub_folders = [], folders2exclude = [], includeF
     # on S3
     root_folder = root_folder.rstrip('/')+'/'
     if root_folder.lstrip(' \t').startswith('s3://'):
-        returned_subfolders = aws_s3_utils.listSubFolders( root_folder, sub_folders, folders2exclude )
+        returned_subfolders = [d for d in _listS3Folder( root_folder )['folders'] \
+                               if (d not in folders2exclude) and (sub_folders == [] or d in sub_folders)]
         return getFullPath(root_folder, returned_subfolders) if includeFullPath else returned_subfolders
     # local
     elif root_folder.lstrip(' \t').startswith('/') or root_folder.lstrip(' \t').startswith('~/') or root_folder.lstrip(' \t').startswith('./'):
@@ -677,40 +978,63 @@ def getSubFilesAll( root_folder, patterns2include = [], patterns2exclude = [], i
         return []
 
 
+@functools.lru_cache(maxsize=SAMPLE_ID_CACHE_SIZE)
 def getSampleIDfromFASTQ( f ):
-    text2search = ['_L001','_L002','_L003','_L004','_R1','_R2','_I1','_I2','.R1','.R2','.I1','.I2','-R1','-R2','-I1','-I2']
-    for i in range(0,100):  # [bug] if more than 100 samples on a run, then this will bug out
-        text2search = ['_S{}_R1'.format(str(i)),'_S{}_R2'.format(str(i)), '_S{}_I1'.format(str(i)), '_S{}_I2'.format(str(i))] + text2search
-        text2search = ['_S{}_L001'.format(str(i)),'_S{}_L002'.format(str(i)), '_S{}_L003'.format(str(i)), '_S{}_L004'.format(str(i))] + text2search        
-    for t in text2search:
-        if f.upper().rfind(t) > -1:
-            return f[0:f.upper().rfind(t)]
+    """ Gets the sample ID from a sequencing file name, e.g. an Illumina <sample_id>_S<n>_L00<x>_R<y>_001.fastq.gz file.
+        The file name is cut at the first matching Illumina suffix (see ILLUMINA_SAMPLE_PATTERN), else at the last occurrence
+        of the first matching suffix in SAMPLE_ID_PATTERNS, or else at its first '.'.
+        Results are memoized per file name.
+
+    >>> getSampleIDfromFASTQ( 'test_S123_L002_R1_001.fastq.gz' )
+    'test'
+    >>> getSampleIDfromFASTQ( 'test_L001_R2.fastq.gz' )
+    'test'
+    >>> getSampleIDfromFASTQ( 'test.fastq.gz' )
+    'test'
+    >>> getSampleIDfromFASTQ( 'x_R1_R2b.fastq.gz' )
+    'x'
+    >>> getSampleIDfromFASTQ( 'x_R1_S_I1.fastq.gz' )
+    'x'
+    >>> getSampleIDfromFASTQ( 'x_L002_S1_R1_001.fastq.gz' )
+    'x_L002'
+    >>> getSampleIDfromFASTQ( 'x_S1_L001_S2_R1.fastq.gz' )
+    'x_S1_L001'
+    """
+    # (sample number, precedence of suffix, position) of each Illumina suffix - the largest one wins
+    illumina_matches = [(int(m.group(1)), -ILLUMINA_SAMPLE_SUFFIXES.index(m.group(2).upper()), m.start()) for m in ILLUMINA_SAMPLE_PATTERN.finditer(f)]
+    if illumina_matches != []:
+        return f[0:max(illumina_matches)[2]]
+    for pattern in SAMPLE_ID_PATTERNS:
+        m = pattern.match(f)
+        if m != None:
+            return m.group(1)
     return f.split('.')[0]
 
 
 def isSequencingFile( f ):
     """ Determines if a file is a sequencing file by the extension
     """
+    f = _getPaths( f )
     return isFastqFile(f) or isFastaFile(f) or isAlignFile(f) or isBedFile(f)
 
 def isFastqFile( f ):
-    f = f.lower()
+    f = _getPaths( f ).lower()
     return f.endswith('.fastq') or f.endswith('.fastq.gz') or f.endswith('.fq') \
            or f.endswith('.fq.gz') or f.endswith('.fq.bz2') or f.endswith('.fastq.bz2') \
            or f.endswith('.fqz')
 
 def isFastaFile( f ):
-    f = f.lower()
+    f = _getPaths( f ).lower()
     return f.endswith('.fasta') or f.endswith('.fasta.gz') or f.endswith('.fa') \
         or f.endswith('.fa.gz') or f.endswith('.fa.bz2') or f.endswith('.fasta.bz2') \
         or f.endswith('.fqz')
 
 def isAlignFile( f ):
-    f = f.lower()
+    f = _getPaths( f ).lower()
     return f.endswith('.sam') or f.endswith('.bam') or f.endswith('.cram')
 
 def isBedFile( f ):
-    f = f.lower()
+    f = _getPaths( f ).lower()
     return f.endswith('.bed') or f.endswith('.bed.gz') or f.endswith('.bed.bz2') \
         or f.endswith('.bigbed') or f.endswith('.bigbed.gz') or f.endswith('.bigbed.bz2') \
         or f.endswith('.bedgraph') or f.endswith('.bedgraph.gz') or f.endswith('.bedgraph.bz2') \
@@ -728,9 +1052,14 @@ def inferSampleID( file_name ):
     'test'
     >>> inferSampleID( 'test_L001_S1_R1.fastq.gz')
     'test'
+    >>> inferSampleID( ['s3://fastq/test_S1_L001_R1_001.fastq.gz', 's3://fastq/test_S1_L001_R2_001.fastq.gz'] )
+    'test'
     """
+    if type(file_name) == PathRecord:
+        return file_name.sample_id
+    file_name = _getPaths( file_name )
     # if a list is passed in, we get the first file
-    if type(file_name) == type([]) and file_name != [] and file_name[0] == type(''):
+    if type(file_name) == type([]) and file_name != [] and type(file_name[0]) == type(''):
         file_name = file_name[0].split('/')[-1]
     elif type(file_name) == type('') and file_name != '':
         file_name = file_name.split('/')[-1]
@@ -746,6 +1075,22 @@ def inferSampleID( file_name ):
     return sampleid
 
 
+def inferSampleIDs( file_names ):
+    """ Infers the sample IDs of many files in one call - see inferSampleID(). Each distinct file name is parsed once.
+    RETURN: LIST of sample IDs, in the same order as file_names
+
+    >>> inferSampleIDs( ['s3://fastq/A_S1_L001_R1_001.fastq.gz', 's3://fastq/A_S1_L001_R2_001.fastq.gz', 's3://fastq/B_S2_L001_R1_001.fastq.gz'] )
+    ['A', 'A', 'B']
+    """
+    sampleids = {}
+    for file_name in file_names:
+        if type(file_name) == PathRecord:
+            sampleids[file_name] = file_name.sample_id
+        elif file_name not in sampleids:
+            sampleids[file_name] = inferSampleID( file_name )
+    return [sampleids[file_name] for file_name in file_names]
+
+
 def mergeLists( L1, L2 ):
     """ Merge two lists
     """
@@ -778,6 +1123,35 @@ def getRunJSON( userid, pipelineid, rid):
     return os.path('/', userid, pipelineid, rid, '.run.json')
 
 
+def getRunStatusFile( run_folder ):
+    """ Gets the path of the run status JSON written by the batch job monitor (batch/src/job_monitor.py).
+
+    >>> getRunStatusFile( 's3://hubseq-data/myteam/myuser/rnaseq/run1' )
+    's3://hubseq-data/myteam/myuser/rnaseq/run1/.run_status.json'
+    """
+    return run_folder.rstrip('/')+'/'+RUN_STATUS_FILE
+
+
+def loadRunStatus( run_folder ):
+    """ Loads the run status JSON of a run - job states by module and sample, and counts by state.
+    return: run status JSON, or {} if the run is not monitored
+    """
+    try:
+        return json.loads( readFileRange( getRunStatusFile( run_folder ) ).decode('utf-8') )
+    except Exception as e:
+        print('NO RUN STATUS for {}: {}'.format(run_folder, str(e)))
+        return {}
+
+
+def getRunFingerprintsFolder( run_folder ):
+    """ Gets the folder of the fingerprint markers of completed jobs of a run (see batch/src/pipeline_resume.py).
+
+    >>> getRunFingerprintsFolder( 's3://hubseq-data/myteam/myuser/rnaseq/run1' )
+    's3://hubseq-data/myteam/myuser/rnaseq/run1/.fingerprints/'
+    """
+    return run_folder.rstrip('/')+'/'+RUN_FINGERPRINTS_FOLDER+'/'
+
+
 def getPipelineJSON( userid, pipelineid):
     """ Gets pipeline JSON (.pipeline.json) that contains information on all runs for this pipeline.
 
@@ -821,16 +1195,17 @@ def getPipelineJSON_RunIds( pipeline_json ):
     return pj['run_ids']
 
 
-def getRunFileIds( root_folder, teamid, userid, pipelineid, runids):
-    return getRunSampleIds( root_folder, teamid, userid, pipelineid, runids)
+def getRunFileIds( root_folder, teamid, userid, pipelineid, runids, run_tree = None):
+    return getRunSampleIds( root_folder, teamid, userid, pipelineid, runids, run_tree)
 
-def getRunSampleIds( root_folder, teamid, userid, pipelineid, runids):
+def getRunSampleIds( root_folder, teamid, userid, pipelineid, runids, run_tree = None):
     """ Get all existing sample IDs for a given set of runs from a pipeline.
     
     teamid: STRING
     userid: STRING
     pipelineid: STRING
     runids: LIST of run IDs
+    run_tree: run tree from getRunTree(). If given, sample IDs are read from the tree instead of listing folders.
     return: LIST of sample IDs, LIST of associated run IDs (ordered)
 
     FUTURE: check for existence of folders (in case user deletes).
@@ -839,38 +1214,110 @@ def getRunSampleIds( root_folder, teamid, userid, pipelineid, runids):
     fileids = []
     runids_ordered = []
     for runid in runids:
-        _run_fileids = getSubFolders( os.path.join(root_folder, teamid, userid, pipelineid, runid), [], ['fastq', 'other'] )
+        if run_tree != None:
+            _run_fileids = _getRunTreeSubFolders( _getRunTreeNode( run_tree, [teamid, userid, pipelineid, runid] ), [], ['fastq', 'other', RUN_FINGERPRINTS_FOLDER] )
+        else:
+            _run_fileids = getSubFolders( os.path.join(root_folder, teamid, userid, pipelineid, runid), [], ['fastq', 'other', RUN_FINGERPRINTS_FOLDER] )
         for fid in _run_fileids:
             runids_ordered.append(runid)
         fileids += _run_fileids
     return (fileids, runids_ordered)
 
 
-def getDataFiles( data_folders, extensions2include = [], extensions2exclude = [] ):
+def getDataFiles( data_folders, extensions2include = [], extensions2exclude = [], run_tree = None, as_columns = False ):
     """ Gets data files in the selected data folders that match extensions2include and DO NOT match extensions2exclude.
 
     data_folders: LIST of data folders to search. Can be local or on S3.
     extensions2include: LIST of extension patterns to search for. If empty, then get all files.
     extensions2exclude: LIST of extension patterns to exclude. If empty, then do not exclude any files.
-    return: LIST of data files, LIST of sample IDs (file IDs) for those data files
+    run_tree: run tree from getRunTree(). If given, files are read from the tree instead of listing each data folder.
+    as_columns: return data file columns instead of a list of data file JSONs - see createDataFileJSONs()
+    return: LIST of data file JSONs (or DICT of columns)
 
     >>> getDataFiles([])
     []
 
     """
     print('IN GETDATAFILES(). DATA_FOLDERS: {}, EXTNSIONS2INCLUDE: {}, EXTENSIONS2EXCLUDE: {}'.format(str(data_folders), str(extensions2include), str(extensions2exclude)))
-    data_files_json_list = []
-    # sample_ids = []
+    data_file_names = []
     if type(data_folders) == str:
         data_folders = [data_folders]
 
     for data_folder in data_folders:
-        data_files_new = getSubFiles( data_folder, extensions2include, extensions2exclude )
-        # data_files = data_files + data_files_new
-        for i in range(0,len(data_files_new)):
-            data_files_json_list.append(createDataFileJSON( os.path.join(data_folder, data_files_new[i]) ))
-            # sample_ids.append( getFileIdFromLocation(data_folder) )
-    return data_files_json_list
+        if run_tree != None:
+            data_files_new = _getRunTreeFiles( _getRunTreeNode( run_tree, _getRunTreePathIds(data_folder) ), extensions2include, extensions2exclude )
+        else:
+            data_files_new = getSubFiles( data_folder, extensions2include, extensions2exclude )
+        data_file_names += [os.path.join(data_folder, f) for f in data_files_new]
+    return createDataFileJSONs( data_file_names, as_columns )
+
+
+# data file JSON keys that are parsed from a file path, and the location of each in the path (see getSubPath())
+DATA_FILE_PATH_KEYS = [(global_keys.KEY_TEAM_ID, 1), (global_keys.KEY_USER_ID, 2), (global_keys.KEY_PIPELINE_ID, 3),
+                       (global_keys.KEY_RUN_ID, 4), (global_keys.KEY_FILE_ID, 5), (global_keys.KEY_MODULE_ID, 6)]
+DATA_FILE_KEYS = [global_keys.KEY_FILE_NAME, global_keys.KEY_FILE_TYPE] + [k for k, loc in DATA_FILE_PATH_KEYS] + [global_keys.KEY_FILE_JSON_VERSION_ID]
+
+
+def parseDataFilePaths( file_names ):
+    """ Parses data file paths into data file columns, splitting each path only once.
+    Data files must be in the defined hierarchy for NGS Pipelines:
+    /team_id/user_id/pipeline_id/run_id/sample_id/module_id/data_file_name.ext
+
+    file_names: LIST of full file paths
+    return: DICT of columns - {KEY: LIST of values, ordered as file_names} for each key in DATA_FILE_KEYS.
+            e.g., pandas.DataFrame( parseDataFilePaths( file_names ) ) gives one row per file.
+
+    >>> parseDataFilePaths( ['s3://team/user/pipe/run1/sample1/fastqc/sample1.fastq.gz'] )['sample_id']
+    ['sample1']
+    >>> parseDataFilePaths( ['/team/user/pipe/run1/sample1/fastqc/sample1.html'] )['file_type']
+    ['html']
+    """
+    columns = {k: [] for k in DATA_FILE_KEYS}
+    for file_name in _getPaths( list(file_names) ):
+        # same path levels as getSubPath()
+        if file_name.startswith('s3://'):
+            parts = file_name[4:].split('/')
+        elif file_name.startswith('/') or file_name.startswith('~/'):
+            parts = file_name.split('/')
+        else:
+            parts = [''] + file_name.split('/')
+        columns[global_keys.KEY_FILE_NAME].append(file_name)
+        columns[global_keys.KEY_FILE_TYPE].append(inferFileType(parts[-1]))
+        for k, loc in DATA_FILE_PATH_KEYS:
+            columns[k].append(parts[loc] if len(parts) > loc else '')
+        columns[global_keys.KEY_FILE_JSON_VERSION_ID].append(global_keys.DATA_FILE_JSON_VERSION)
+    return columns
+
+
+def dataFileColumnsToJSONs( columns ):
+    """ Converts data file columns into a list of data file JSONs.
+    >>> dataFileColumnsToJSONs( {'file_name': ['a.txt', 'b.txt'], 'file_type': ['txt', 'txt']} )
+    [{'file_name': 'a.txt', 'file_type': 'txt'}, {'file_name': 'b.txt', 'file_type': 'txt'}]
+    """
+    keys = list(columns.keys())
+    return [dict(zip(keys, values)) for values in zip(*[columns[k] for k in keys])]
+
+
+def dataFileJSONsToColumns( data_file_json_list ):
+    """ Converts a list of data file JSONs into data file columns. Missing keys are filled with ''.
+    >>> dataFileJSONsToColumns( [{'file_name': 'a.txt'}] )['file_type']
+    ['']
+    """
+    return {k: getFromDictList( data_file_json_list, k, '' ) for k in DATA_FILE_KEYS}
+
+
+def createDataFileJSONs( file_names, as_columns = False ):
+    """ Creates data file JSONs (see createDataFileJSON()) for many files at once.
+
+    file_names: LIST of full file paths
+    as_columns: return DICT of columns instead of a LIST of data file JSONs - see parseDataFilePaths()
+    return: LIST of data file JSONs, or DICT of columns
+
+    >>> createDataFileJSONs( [] )
+    []
+    """
+    columns = parseDataFilePaths( file_names )
+    return columns if as_columns else dataFileColumnsToJSONs( columns )
 
 
 def createDataFileJSON( _filename ):
@@ -894,16 +1341,7 @@ def createDataFileJSON( _filename ):
 
     return: JSON with the key-value pairs defined for data files
     """
-    print('THE FILENAMEEEEE: '+str(_filename))
-    return {global_keys.KEY_FILE_NAME: _filename,
-            global_keys.KEY_FILE_TYPE: inferFileType(_filename),
-            global_keys.KEY_TEAM_ID: getTeamIdFromLocation(_filename),
-            global_keys.KEY_USER_ID: getUserIdFromLocation(_filename),
-            global_keys.KEY_PIPELINE_ID: getPipelineIdFromLocation(_filename),
-            global_keys.KEY_RUN_ID: getRunIdFromLocation(_filename),
-            global_keys.KEY_FILE_ID: getFileIdFromLocation(_filename),
-            global_keys.KEY_MODULE_ID: getModuleIdFromLocation(_filename),
-            global_keys.KEY_FILE_JSON_VERSION_ID: global_keys.DATA_FILE_JSON_VERSION}
+    return createDataFileJSONs( [_filename] )[0]
 
 
 def createSampleFilePath( root_folder, teamid, userid, pipelineid, runid, sampleid, moduleid ):
@@ -917,51 +1355,175 @@ def createSampleFilePath( root_folder, teamid, userid, pipelineid, runid, sample
     return fpath.rstrip('/')+'/'
 
 
-def getRunSampleOutputFolders( root_folder, teamid, userids_in = [], pipelineids_in = [], runids_in = [], sampleids_in = [], moduleids_in = []):
+def getRunTree( root_folder, teamid, userids_in = [], pipelineids_in = [], runids_in = [] ):
+    """ Builds an in-memory tree of all run/sample/module folders and files for a set of users and pipelines.
+    Each pipeline folder (or each selected run folder, if runids_in is given) is read with a single recursive listing,
+    instead of one listing per folder. The tree can then be passed as run_tree to getRunSampleOutputFolders(),
+    getRunIds(), getRunSampleIds() and getDataFiles() so that they do not list any folders again.
+
+    root_folder: STRING - root folder for all team folders. Usually 's3://' (for S3) or '/' (for root local)
+    userids_in, pipelineids_in, runids_in: LISTs of folders to include at each level (empty list = all)
+    return: DICT run tree - {teamid: {userid: {pipelineid: {runid: {sampleid: {moduleid: {'/': [FILES]}}}}}}}
+            Files within any folder are listed under the RUN_TREE_FILES ('/') key.
+    """
+    run_tree = {teamid: {}}
+    userids = getSubFolders( os.path.join(root_folder, teamid), userids_in )
+    for userid in userids:
+        run_tree[teamid][userid] = {}
+        pipelineids = getSubFolders( os.path.join(root_folder, teamid, userid), pipelineids_in )
+        for pipeid in pipelineids:
+            pipeline_node = {}
+            if runids_in == []:
+                _scanFolderTree( os.path.join(root_folder, teamid, userid, pipeid), pipeline_node )
+            else:
+                for rid in runids_in:
+                    _scanFolderTree( os.path.join(root_folder, teamid, userid, pipeid, rid), pipeline_node.setdefault(rid, {}) )
+                    # runs that do not exist are not part of the tree
+                    if pipeline_node[rid] == {}:
+                        del pipeline_node[rid]
+            run_tree[teamid][userid][pipeid] = pipeline_node
+    return run_tree
+
+
+def _scanFolderTree( root_folder, tree_node ):
+    """ Private function that adds all nested folders and files under root_folder to a run tree node.
+    S3 folders are read with a single delimiter-less paginated listing.
+    """
+    root_folder = root_folder.lstrip(' \t').rstrip('/')+'/'
+    if root_folder.startswith('s3://'):
+        def _listRecursive( s3_folder ):
+            bucket, prefix = aws_s3_utils._getS3PathPrefix( s3_folder )
+            try:
+                return [file_info['Key'][len(prefix):] for file_info in aws_s3_utils.iterObjects_S3( s3_folder, '' )]
+            except aws_s3_utils.ClientError as e:
+                print('CLIENT ERROR in file_utils._scanFolderTree() for {}: {}'.format(s3_folder, str(e)))
+                return []
+        for rel_path in cache_utils.getCachedListing( root_folder, _listRecursive, 'tree' ):
+            _addToRunTree( tree_node, rel_path )
+    elif root_folder.startswith('/') or root_folder.startswith('~/') or root_folder.startswith('./'):
+        for dirpath, dirnames, filenames in os.walk( root_folder ):
+            rel_dir = os.path.relpath( dirpath, root_folder )
+            rel_dir = '' if rel_dir == '.' else rel_dir.rstrip('/')+'/'
+            for d in dirnames:
+                _addToRunTree( tree_node, rel_dir+d+'/' )
+            for f in filenames:
+                _addToRunTree( tree_node, rel_dir+f )
+    return tree_node
+
+
+def _addToRunTree( tree_node, rel_path ):
+    """ Private function that adds a relative file path to a run tree node. Paths ending in '/' only add folders.
+    >>> _addToRunTree( {}, 'run1/sample1/fastqc/sample1.html' )
+    {'run1': {'sample1': {'fastqc': {'/': ['sample1.html']}}}}
+    """
+    node = tree_node
+    parts = rel_path.split('/')
+    for folder in parts[:-1]:
+        if folder != '':
+            node = node.setdefault(folder, {})
+    if parts[-1] != '':
+        node.setdefault(RUN_TREE_FILES, []).append(parts[-1])
+    return tree_node
+
+
+def _getRunTreeNode( run_tree, path_ids ):
+    """ Private function that gets the run tree node for a list of nested folder IDs - e.g., [teamid, userid, pipelineid, runid].
+    Returns an empty node if the folder is not in the tree.
+    """
+    node = run_tree
+    for path_id in path_ids:
+        if path_id in ['', None]:
+            break
+        if path_id not in node or path_id == RUN_TREE_FILES:
+            return {}
+        node = node[path_id]
+    return node
+
+
+def _getRunTreePathIds( file_folder ):
+    """ Private function that gets the team/user/pipeline/run/sample/module IDs of a folder, for looking up a run tree node.
+    >>> _getRunTreePathIds( 's3://team/user/pipe/run1/sample1/fastqc/' )
+    ['team', 'user', 'pipe', 'run1', 'sample1', 'fastqc']
+    """
+    return [getSubPath(file_folder, loc) for loc in range(1,7)]
+
+
+def _getRunTreeSubFolders( tree_node, sub_folders = [], folders2exclude = [] ):
+    """ Private function - run tree equivalent of getSubFolders().
+    """
+    if type(sub_folders) == str:
+        sub_folders = [sub_folders]
+    if type(folders2exclude) == str:
+        folders2exclude = [folders2exclude]
+    return [k for k in tree_node if k != RUN_TREE_FILES and k not in folders2exclude and (sub_folders == [] or k in sub_folders)]
+
+
+def _getRunTreeFiles( tree_node, patterns2include = [], patterns2exclude = [] ):
+    """ Private function - run tree equivalent of getSubFiles().
+    """
+    if type(patterns2include) == str:
+        patterns2include = [patterns2include]
+    if type(patterns2exclude) == str:
+        patterns2exclude = [patterns2exclude]
+    matcher = aws_s3_utils.PatternMatcher(patterns2include, patterns2exclude)
+    return [f for f in tree_node.get(RUN_TREE_FILES, []) if '.' in f and matcher.match(f)]
+
+
+def getRunSampleOutputFolders( root_folder, teamid, userids_in = [], pipelineids_in = [], runids_in = [], sampleids_in = [], moduleids_in = [], run_tree = None):
     """ Get all sample output folders for a given set of users, pipelines, runs, modules, or samples.
     Note that this is flexible in getting ALL folders or a subset of folders within a team root directory.
     This function assumes the hierarchy for sample folders as:
     /teamid/userid/pipelineid/runid/moduleid/sampleid/<SAMPLE-DATA-FILES>
 
     root_folder: STRING - root folder for all team folders. Usually 's3://' (for S3) or '/' (for root local)
+    run_tree: run tree from getRunTree(). If given, the filters are applied to the tree in memory instead of listing each folder.
 
     >>> getRunSampleOutputFolders( 's3://', 'hubpublicinternal', ['test'], ['file_utils'], ['run_test1'], ['sample_test1'], ['bowtie2', 'mpileup'])
     ['s3://hubpublicinternal/test/file_utils/run_test1/sample_test1/bowtie2', 's3://hubpublicinternal/test/file_utils/run_test1/sample_test1/mpileup']
     >>> getRunSampleOutputFolders( 's3://', 'hubpublicinternal', ['test'], ['file_utils'], ['run_test1'], ['sample_test2'], ['bowtie2', 'mpileup'])
     ['s3://hubpublicinternal/test/file_utils/run_test1/sample_test2/mpileup']
     """
+    def _subFolders( path_ids, folders2include, folders2exclude = [] ):
+        if run_tree != None:
+            return _getRunTreeSubFolders( _getRunTreeNode( run_tree, [teamid]+path_ids ), folders2include, folders2exclude )
+        else:
+            return getSubFolders( os.path.join(root_folder, teamid, *path_ids), folders2include, folders2exclude )
+
     # There are many nested for-loops to allow flexibility, but number of folders should be small enough, should be ok.
     output_folders = []
     # if userids is empty list, then this gets all userids
-    userids = getSubFolders( os.path.join(root_folder, teamid), userids_in)
+    userids = _subFolders( [], userids_in )
     for userid in userids:
         # if pipelineids is empty list, then this gets all pipeline ids
-        pipelineids = getSubFolders( os.path.join(root_folder, teamid, userid), pipelineids_in )
+        pipelineids = _subFolders( [userid], pipelineids_in )
         for pipeid in pipelineids:
             # if runids is empty list, then this gets all run ids
-            runids = getSubFolders( os.path.join(root_folder, teamid, userid, pipeid), runids_in )
+            runids = _subFolders( [userid, pipeid], runids_in )
             for rid in runids:
-                # if sampleids is empty list, then this gets all sample ids
-                sampleids = getSubFolders( os.path.join(root_folder, teamid, userid, pipeid, rid), sampleids_in )
+                # if sampleids is empty list, then this gets all sample ids (the run's fingerprint markers are not a sample)
+                sampleids = _subFolders( [userid, pipeid, rid], sampleids_in, [RUN_FINGERPRINTS_FOLDER] )
                 for sid in sampleids:
                     # if moduleids is empty list, then this gets all module ids
-                    moduleids = getSubFolders( os.path.join(root_folder, teamid, userid, pipeid, rid, sid), moduleids_in )
+                    moduleids = _subFolders( [userid, pipeid, rid, sid], moduleids_in )
                     for moduleid in moduleids:
                         output_folders.append( str(os.path.join(root_folder, teamid, userid, pipeid, rid, sid, moduleid)).rstrip('/')+'/' )
     print('OUTPUT FOLDERS: {}'.format(output_folders))
     return output_folders
 
 
-def getRunIds( root_folder, teamid, userid, pipelineid):
+def getRunIds( root_folder, teamid, userid, pipelineid, run_tree = None):
     """ Get all existing run IDs for a given set of runs for a pipeline.
 
     teamid: STRING
     userid: STRING
     pipelineid: STRING
+    run_tree: run tree from getRunTree(). If given, run IDs are read from the tree instead of listing the pipeline folder.
     return: LIST of run IDs
 
     FUTURE: check for existence of runs (in case user deletes) and excluded folders.
     """
+    if run_tree != None:
+        return _getRunTreeSubFolders( _getRunTreeNode( run_tree, [teamid, userid, pipelineid] ))
     runids = getSubFolders( os.path.join(root_folder, teamid, userid, pipelineid) )
     return runids
 
@@ -969,6 +1531,67 @@ def getRunIds( root_folder, teamid, userid, pipelineid):
     # return getPipelineJSON_RunIds( pipeline_json )
 
 
+def _parseInputPattern( input_file ):
+    """ Private function - splits a directory input (see groupInputFilesBySample()) into its folder and file pattern.
+        RETURN: (folder, LIST of patterns to include), or (None, []) for an individual input file
+
+    >>> _parseInputPattern( 's3://fastq/run1/^fastq.gz' )
+    ('s3://fastq/run1/', ['^fastq.gz'])
+    >>> _parseInputPattern( 's3://fastq/run1/**' )
+    ('s3://fastq/run1/', [])
+    >>> _parseInputPattern( 's3://fastq/run1/S1_R1.fastq.gz' )
+    (None, [])
+    """
+    if '*' in input_file:
+        return (input_file.rstrip('*').rstrip('/')+'/', [])
+    elif '^' in input_file:
+        return (input_file[0:input_file.rfind('/')+1], [input_file[input_file.rfind('/')+1:]])
+    return (None, [])
+
+
+def _listInputFolders( folders ):
+    """ Private function - lists each distinct input folder once, and lists S3 folders concurrently.
+        RETURN: {<folder>: LIST of file names in folder}
+    """
+    folders = sorted(set(folders))
+    def _list( folder ):
+        return _listS3Folder( folder )['files'] if folder.lstrip(' \t').startswith('s3://') else _listSubFilesLocal( folder )
+    if len(folders) > 1:
+        with ThreadPoolExecutor( max_workers = min(len(folders), aws_s3_utils.S3_TRANSFER_MAX_WORKERS) ) as executor:
+            return dict(zip(folders, executor.map(_list, folders)))
+    return {folder: _list( folder ) for folder in folders}
+
+
+def iterInputFilesBySample( input_files_list, samplelist = [] ):
+    """ Generator version of groupInputFilesBySample(): yields (sample ID, input file) pairs, in input order.
+        All directory inputs are listed up front, with one listing per distinct folder, so that large input lists
+        (e.g., thousands of FASTQs from one sequencing run) are enumerated in a single pass.
+        Files found in directory inputs are yielded with their full paths.
+        A '**' input yields (sample ID, enclosing folder) once, with the sample ID of the last file found in the folder.
+
+    >>> list(iterInputFilesBySample( ['s3://fastq/S1_R1.fastq.gz', 's3://fastq/S1_R2.fastq.gz', 's3://fastq/S2_R1.fastq.gz'] ))
+    [('S1', 's3://fastq/S1_R1.fastq.gz'), ('S1', 's3://fastq/S1_R2.fastq.gz'), ('S2', 's3://fastq/S2_R1.fastq.gz')]
+    """
+    folder_files = _listInputFolders( [_parseInputPattern( f )[0] for f in input_files_list if _parseInputPattern( f )[0] != None] )
+    for idx, input_file in enumerate(input_files_list):
+        folder, patterns2include = _parseInputPattern( input_file )
+        # individual input file
+        if folder == None:
+            yield (inferSampleID( getFileOnly(input_file) ) if samplelist == [] else samplelist[idx], input_file)
+            continue
+        # files in a directory that match the pattern we are looking for
+        files = list(aws_s3_utils.PatternMatcher(patterns2include, []).filter( folder_files[folder] ))
+        print('SUBFILES: {} files in {}'.format(str(len(files)), input_file))
+        if input_file.endswith('**'):
+            # unique case of keeping file list as the enclosing folder
+            if files != []:
+                yield (inferSampleID( files[-1] ) if samplelist == [] else samplelist[idx], folder)
+        else:
+            sampleids = inferSampleIDs( files ) if samplelist == [] else [samplelist[idx]]*len(files)
+            for sampleid, f in zip(sampleids, files):
+                yield (sampleid, folder+f)
+
+
 def groupInputFilesBySample( input_files_list, samplelist = [] ):
     """ Groups all input files according to the full path and sample ID embedded in the names of the input files.
     Input can also be directories with the following syntax:
@@ -976,38 +1599,28 @@ def groupInputFilesBySample( input_files_list, samplelist = [] ):
       /dir/^fastq  gets all files that end with FASTQ
       /dir/sample^  gets all files that start with sample
       /dir/** gets sampleid from file names in dir but keeps input files as the enclosing folder (not the individual files in folder)
+    Each distinct directory is listed once - see iterInputFilesBySample().
+
+    >>> groupInputFilesBySample( ['s3://fastq/S1_R1.fastq.gz', 's3://fastq/S1_R2.fastq.gz'] )
+    INPUT FILES LIST: 2 input files
+    GROUPS: 1 samples
+    {'S1': ['s3://fastq/S1_R1.fastq.gz', 's3://fastq/S1_R2.fastq.gz']}
     """
-    # getSubFiles( root_folder, patterns2include = [], patterns2exclude = [] ):
     groups = {}
-    print('INPUT FILES LIST: '+str(input_files_list))
-    for input_file in input_files_list:
-        idx = input_files_list.index(input_file)
-        # if we are looking within a whole directory
-        if '*' in input_file or '^' in input_file:
-            # get files that match the pattern we are looking for
-            if '*' in input_file:
-                files = getSubFiles( input_file.rstrip('*') )
-            elif '^' in input_file:
-                files = getSubFiles( input_file[0:input_file.rfind('/')], [input_file[input_file.rfind('/')+1:]])
-            print('SUBFILES: '+str(files))
-            # group those files
-            for f in files:
-                sampleid = inferSampleID( getFileOnly(f) ) if samplelist == [] else samplelist[idx]
-                groups[sampleid] = groups[sampleid] + [f] if sampleid in groups else [f]
-            # unique case of keeping file list as the enclosing folder - **
-            if input_file.endswith('**'):
-                groups[sampleid] = [input_file.rstrip('*')]
-        # otherwise we have a list of individual files
+    print('INPUT FILES LIST: {} input files'.format(str(len(input_files_list))))
+    for sampleid, input_file in iterInputFilesBySample( input_files_list, samplelist ):
+        if input_file.endswith('/'):
+            groups[sampleid] = [input_file]
         else:
-            sampleid = inferSampleID( getFileOnly(input_file) ) if samplelist == []  else samplelist[idx]
-            groups[sampleid] = groups[sampleid] + [input_file] if sampleid in groups else [input_file]
-    print('GROUPS: '+str(groups))
+            groups.setdefault(sampleid, []).append(input_file)
+    print('GROUPS: {} samples'.format(str(len(groups))))
     return groups
 
 # file hierarchy:
 # /team_id/user_id/run_id/file_id/module_id/<file_id>...<file_extension>
 def getSubPath(file_folder, loc):
     # print('SUBPATH FOR: '+str(file_folder))
+    file_folder = _getPaths( file_folder )
     if file_folder.startswith('s3://'):
         return file_folder[4:].split('/')[loc] if len(file_folder[4:].split('/')) > loc else ''
     elif file_folder.startswith('/') or file_folder.startswith('~/'):
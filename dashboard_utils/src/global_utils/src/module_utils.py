@@ -6,8 +6,9 @@
 #
 # Program Arguments
 import file_utils
-import os, subprocess, sys, json, uuid
+import os, subprocess, sys, json, uuid, copy, shutil, hashlib, threading, time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 """
 ORDER OF RUNNING IN A DOCKER MODULE VIA PIPELINE:
@@ -31,6 +32,23 @@ TEMPLATE DIR: /npimodules/templates/
 
 MODULE_TEMPLATE_PATH = 's3://hubseq-data/templates/' 
 MODULE_DIR = 's3://hubseq-data/modules/'
+# local store of downloaded module templates: <cache dir>/<module version>/<template file>, with the S3 ETag in <template file>.etag
+MODULE_TEMPLATE_CACHE_DIR = os.environ.get('HUBSEQ_MODULE_TEMPLATE_CACHE', os.path.join(os.path.expanduser('~'), '.hubseq', 'templates'))
+
+# parsed module templates, by (module, submodule, version, filesystem) - each template is read (or revalidated) once per process
+_module_templates = {}
+_module_templates_lock = threading.Lock()
+# one lock per template, so that different templates load concurrently but each is read only once
+_module_template_locks = {}
+
+# content-addressed cache of module results: <result cache dir>/<module>/<cache key>.json - off ('') unless enabled
+# by HUBSEQ_RESULT_CACHE or by run_pipeline --resultcache (see setResultCachePath())
+DEFAULT_RESULT_CACHE_PATH = 's3://hubseq-data/result_cache/'
+RESULT_CACHE_PATH = os.environ.get('HUBSEQ_RESULT_CACHE', '')
+# module runs whose outputs are added to the result cache once uploaded, by local output dir - see initProgram() and uploadOutput()
+_pending_results = {}
+# fingerprint marker files of module runs, written once their outputs are uploaded (for resumed pipeline runs), by local output dir
+_pending_fingerprints = {}
 
 def getModuleDirectory():
     return MODULE_DIR
@@ -65,6 +83,8 @@ def getModuleRunNameID( module, job_id, name_type ):
         return module+'.'+job_id+'.io.json'
     elif name_type == 'job_json':
         return module+'.'+job_id+'.job.json'
+    elif name_type == 'io_manifest':
+        return module+'.'+job_id+'.io.jsonl.gz'
     elif name_type == 'job_name':
         return 'job_{}_{}'.format(module, job_id)
     elif name_type == 'job_def':
@@ -90,13 +110,88 @@ def downloadModuleTemplate( which_module, dest_folder, which_submodule = '', fil
         If local, assumes the module template file is in the same directory as the calling function.
     """
     if filesystem == 's3':
+        # served from the template store - see loadModuleTemplate()
         module_template_file = getModuleTemplate( which_module, which_submodule, MODULE_TEMPLATE_PATH )
-        module_template_path = file_utils.downloadFile( module_template_file, dest_folder )
+        module_template_path = file_utils.writeJSON( loadModuleTemplate( which_module, which_submodule, 's3' ), \
+                                                     os.path.join(dest_folder, module_template_file.split('/')[-1]) )
     elif filesystem == 'local':
         module_template_path = getModuleTemplate( which_module, which_submodule, os.getcwd() )
     else:
         module_template_path = ''
     return module_template_path
+
+
+def _writeFileAtomic( file_path, file_bytes ):
+    """ Writes a file via a temp file in the same folder, so that other processes never read a partly written file.
+    """
+    tmp_file = '{}.{}.tmp'.format(file_path, str(uuid.uuid4()))
+    with open(tmp_file, 'wb') as f:
+        f.write(file_bytes)
+    os.replace(tmp_file, file_path)
+    return file_path
+
+
+def _readTemplateStore( template_path, version ):
+    """ Reads a template from S3 via the local template store - the stored copy is revalidated with its ETag,
+        and only downloaded again if the S3 template changed. If S3 cannot be reached, the stored copy is used.
+    """
+    store_file = os.path.join(MODULE_TEMPLATE_CACHE_DIR, str(version), template_path.split('/')[-1])
+    etag_file = store_file + '.etag'
+    etag = ''
+    if os.path.isfile(store_file) and os.path.isfile(etag_file):
+        with open(etag_file) as f:
+            etag = f.read().strip()
+    try:
+        template_bytes, new_etag = file_utils.readFileIfChanged( template_path, etag )
+    except Exception as e:
+        if etag == '':
+            raise
+        print('WARNING: could not revalidate module template {} - using stored copy: {}'.format(template_path, str(e)))
+        template_bytes = None
+    if template_bytes != None:
+        try:
+            os.makedirs(os.path.dirname(store_file), exist_ok=True)
+            # other processes may be reading the store - the template goes first, so that a new ETag never comes with an old template
+            _writeFileAtomic( store_file, template_bytes )
+            _writeFileAtomic( etag_file, new_etag.encode('utf-8') )
+        except OSError as e:
+            print('WARNING: could not store module template {}: {}'.format(template_path, str(e)))
+        return json.loads(template_bytes.decode('utf-8'))
+    return file_utils.loadJSON(store_file)
+
+
+def loadModuleTemplate( which_module, which_submodule = '', filesystem = 's3', version = '' ):
+    """ Returns the parsed module template JSON. Templates are memoized per (module, submodule, version):
+        the first call in a process reads the template (from S3 via the local template store, or from the current directory if local),
+        and later calls return a copy of the parsed template.
+    """
+    version = version if version not in ['', None] else getModuleVersion( which_module )
+    template_key = (which_module, which_submodule if which_submodule not in [[], None] else '', str(version), filesystem)
+    with _module_templates_lock:
+        if template_key not in _module_template_locks:
+            _module_template_locks[template_key] = threading.Lock()
+        template_lock = _module_template_locks[template_key]
+    with template_lock:
+        if template_key not in _module_templates:
+            if filesystem == 's3':
+                _module_templates[template_key] = _readTemplateStore( getModuleTemplate( which_module, template_key[1], MODULE_TEMPLATE_PATH ), version )
+            elif filesystem == 'local':
+                _module_templates[template_key] = file_utils.loadJSON( getModuleTemplate( which_module, template_key[1], os.getcwd() ))
+            else:
+                _module_templates[template_key] = {}
+        # callers may modify the template they get
+        return copy.deepcopy(_module_templates[template_key])
+
+
+def preloadModuleTemplates( modules, filesystem = 's3', max_workers = 8 ):
+    """ Loads the templates of all given modules concurrently, so later loadModuleTemplate() calls are served from memory.
+        modules: LIST of module names, or of (module, submodule) tuples
+        RETURN: number of templates loaded
+    """
+    module_pairs = set([(m, '') if type(m) == type('') else (m[0], m[1] if m[1] not in [[], None] else '') for m in modules])
+    with ThreadPoolExecutor( max_workers = max(1, min(max_workers, len(module_pairs))) ) as executor:
+        list(executor.map( lambda m: loadModuleTemplate( m[0], m[1], filesystem ), module_pairs ))
+    return len(module_pairs)
     
 
 def getModuleTemplateInputFileTypes( template_file ):
@@ -179,19 +274,39 @@ def getModule_environment( module_json ):
     return module_json['compute']['environment'] if ('compute' in module_json and 'environment' in module_json['compute']) else 'aws'
 
 
+def getModule_transfer( module_json ):
+    """ S3 transfer profile for this module - a profile name (e.g., 'large') or a dict such as
+        {"profile": "large", "multipart_chunksize": 134217728, "max_concurrency": 16, "use_threads": true}
+    """
+    return module_json['compute']['transfer'] if ('compute' in module_json and 'transfer' in module_json['compute']) else 'default'
+
+
 
-def generateWorkingDir(base_dir):
+def generateWorkingDir(base_dir, job_id = ''):
     """ Creates a unique working data directory for this Docker run, if possible.
         This allows multiple dockers running on same machine to have their own working directories.
+        If a job ID is given, the directory is named after the job and is reused if it already exists,
+        so that a retried job finds the input files downloaded by a previous attempt. Only inputs are reused -
+        the output dir is emptied at the start of each attempt (see resetOutputDir()).
     """
-    working_dir = os.path.join(base_dir, str(uuid.uuid4()))
+    working_dir = os.path.join(base_dir, job_id if job_id != '' else str(uuid.uuid4()))
     try:
-        os.mkdir(working_dir)
+        os.makedirs(working_dir, exist_ok = (job_id != ''))
     except Exception as e:
         return base_dir
     return working_dir
 
 
+def resetOutputDir( out_dir ):
+    """ Creates an empty local output dir for this attempt of a job. Files left in it by a failed earlier attempt are deleted,
+        so that they are neither uploaded nor added to the result cache.
+    """
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    return out_dir
+
+
 def getRunArgs( ):
     """ Dockerfile ENTRYPOINT is always the wrapper script run_program.py. This wrapper script takes the arguments:
         (1) --module_name: name of the docker module
@@ -443,6 +558,14 @@ def createIOJSON( run_args_json ):
         
         if ('dryrun' in run_args_json and run_args_json['dryrun'] == ''):
             io_json['dryrun'] = run_args_json['dryrun'] 
+
+        # result cache of this run, if enabled - see setResultCachePath()
+        if ('result_cache' in run_args_json and run_args_json['result_cache'] not in ['', None]):
+            io_json['result_cache'] = run_args_json['result_cache']
+
+        # fingerprint marker to write once the outputs are uploaded - see batch/src/pipeline_resume.py
+        if ('fingerprint_file' in run_args_json and run_args_json['fingerprint_file'] not in ['', None]):
+            io_json['fingerprint_file'] = run_args_json['fingerprint_file']
     
     except IOError:
         print('RUN ARGUMENTS NOT SPECIFIED CORRECTLY.')
@@ -520,8 +643,9 @@ def createModuleInstanceJSON( module_template_json, io_json, file_system = 's3'
                                             else (module_template_json['options'] if ('options' in module_template_json) else '')
     mi_json['sample_id'] = io_json['sample_id']
     # main input
+    input_file_type = file_utils.inferFileType(io_json['input']).upper()
     for pi in module_template_json['program_input']:
-        if file_utils.inferFileType(io_json['input']).upper() == pi['input_file_type'].upper():
+        if input_file_type == pi['input_file_type'].upper():
             mi_json['program_input'] = {'input': io_json['input'], \
                                         'input_type': pi['input_type'],
                                         'input_file_type': pi['input_file_type'],
@@ -529,8 +653,9 @@ def createModuleInstanceJSON( module_template_json, io_json, file_system = 's3'
                                         'input_position': pi['input_position'],
                                         'input_prefix': pi['input_prefix']}
     # main output
+    output_file_type = file_utils.inferFileType(io_json['output']).upper()
     for pi in module_template_json['program_output']:
-        if file_utils.inferFileType(io_json['output']).upper() == pi['output_file_type'].upper():
+        if output_file_type == pi['output_file_type'].upper():
             mi_json['program_output'] = {'output': io_json['output'], \
                                          'output_type': pi['output_type'],
                                          'output_file_type': pi['output_file_type'],
@@ -539,22 +664,25 @@ def createModuleInstanceJSON( module_template_json, io_json, file_system = 's3'
                                          'output_prefix': pi['output_prefix']}
     # alternate input - input and input_directory needs to be fixed
     for alt_input in io_json['alternate_inputs']:
+        # parse each alternate file path once
+        alt_path = file_utils.parsePath(alt_input) if type(alt_input) == type('') else alt_input
         for pi in module_template_json['alternate_inputs']:
-            if file_utils.inferFileType(alt_input).upper() == pi['input_file_type'].upper():
-                mi_json['alternate_inputs'].append({'input': file_utils.getFileOnly(alt_input),
+            if file_utils.inferFileType(alt_path).upper() == pi['input_file_type'].upper():
+                mi_json['alternate_inputs'].append({'input': file_utils.getFileOnly(alt_path),
                                                     'input_type': pi['input_type'],
                                                     'input_file_type': pi['input_file_type'],
-                                                    'input_directory': getDirectory(alt_input['input'], alt_input['inputdir']) if 'inputdir' in alt_input else file_utils.getFileFolder(alt_input),
+                                                    'input_directory': getDirectory(alt_input['input'], alt_input['inputdir']) if 'inputdir' in alt_input else file_utils.getFileFolder(alt_path),
                                                     'input_position': pi['input_position'],
                                                     'input_prefix': pi['input_prefix']})
     # altenrate output
     for alt_output in io_json['alternate_outputs']:
+        alt_path = file_utils.parsePath(alt_output) if type(alt_output) == type('') else alt_output
         for pi in module_template_json['alternate_outputs']:
-            if file_utils.inferFileType(alt_output).upper() == pi['output_file_type'].upper():
-                mi_json['alternate_outputs'].append({'output': file_utils.getFileOnly(alt_output),
+            if file_utils.inferFileType(alt_path).upper() == pi['output_file_type'].upper():
+                mi_json['alternate_outputs'].append({'output': file_utils.getFileOnly(alt_path),
                                                     'output_type': pi['output_type'],
                                                     'output_file_type': pi['output_file_type'],
-                                                    'output_directory': getDirectory(alt_output['output'], alt_output['outputdir']) if 'outputdir' in alt_output else file_utils.getFileFolder(alt_output),
+                                                    'output_directory': getDirectory(alt_output['output'], alt_output['outputdir']) if 'outputdir' in alt_output else file_utils.getFileFolder(alt_path),
                                                     'output_position': pi['output_position'],
                                                     'output_prefix': pi['output_prefix']})
 
@@ -765,9 +893,17 @@ def executeProgram( pargs, fout_name = '' ):
 
 def uploadOutput( local_out, remote_out ):
     """ Upload data output files
+        If this run has a result cache key (see initProgram()), the uploaded outputs are added to the result cache.
+        If this run has a fingerprint marker file, it is written last - it marks the run as complete for resumed pipeline runs.
     """
     print('Uploading output data files...')
     file_utils.uploadFolder(local_out, remote_out)
+    file_utils.invalidateListingCache(remote_out)
+    if local_out.rstrip('/') in _pending_results:
+        module_name, cache_key = _pending_results.pop(local_out.rstrip('/'))
+        print('Saved result cache entry: '+str(saveResultCache( module_name, cache_key, local_out, remote_out )))
+    if local_out.rstrip('/') in _pending_fingerprints:
+        print('Wrote fingerprint marker: '+str(file_utils.touchFile( _pending_fingerprints.pop(local_out.rstrip('/')), os.path.dirname(local_out.rstrip('/')) )))
     return
 
 
@@ -781,32 +917,181 @@ def runProgram( program_arguments, local_output_file = '' ):
     return
 
 
+#####################################################
+# RESULT CACHE
+#####################################################
+
+def getModuleInputFiles( mi_json ):
+    """ Gets the full paths of all input files of a module instance - main and alternate inputs.
+
+    >>> getModuleInputFiles( {'program_input': {'input': ['s3://fastq/my.fastq'], 'input_directory': ''}, 'alternate_inputs': [{'input': 'hg38.fasta', 'input_directory': 's3://fasta/'}]} )
+    ['s3://fastq/my.fastq', 's3://fasta/hg38.fasta']
+    """
+    input_files = []
+    main_inputs = mi_json['program_input']['input'] if 'input' in mi_json['program_input'] else []
+    for f in (main_inputs if type(main_inputs) == type([]) else [main_inputs]):
+        if f not in ['', None]:
+            input_files.append(f if '/' in f else file_utils.getFullPath(mi_json['program_input']['input_directory'], f))
+    for alt_input in mi_json['alternate_inputs']:
+        input_files.append(alt_input['input'] if '/' in alt_input['input'] else file_utils.getFullPath(alt_input['input_directory'], alt_input['input']))
+    return input_files
+
+
+def getResultCacheKey( mi_json, input_etags = None ):
+    """ Content address of a module run: hash of the module instance JSON - program, versions, arguments and
+        I/O file names, but not I/O folders - and the ETags of its input files.
+        The same program run on the same input data therefore gets the same key in any run folder.
+
+    input_etags: {<input file>: <etag>} (default: get the ETags of the inputs)
+    RETURN: cache key, or '' if the run cannot be cached (dry runs, or input files that were not found)
+
+    >>> mi_json = {'program_input': {'input': ['s3://run1/fastq/my.fastq'], 'input_directory': ''}, 'program_output': {'output': ['s3://run1/fastqc/my.html'], 'output_directory': ''}, 'alternate_inputs': [], 'alternate_outputs': [], 'program_name': 'fastqc', 'program_version': '0.11.9', 'program_arguments': ''}
+    >>> mi_json2 = {'program_input': {'input': ['s3://run2/fastq/my.fastq'], 'input_directory': ''}, 'program_output': {'output': ['s3://run2/fastqc/my.html'], 'output_directory': ''}, 'alternate_inputs': [], 'alternate_outputs': [], 'program_name': 'fastqc', 'program_version': '0.11.9', 'program_arguments': ''}
+    >>> getResultCacheKey( mi_json, {'s3://run1/fastq/my.fastq': 'abc'} ) == getResultCacheKey( mi_json2, {'s3://run2/fastq/my.fastq': 'abc'} )
+    True
+    >>> getResultCacheKey( mi_json, {'s3://run1/fastq/my.fastq': ''} )
+    ''
+    """
+    def stripDirectories( io_entry, io_key ):
+        io_entry = {k: v for k, v in io_entry.items() if k != io_key+'_directory'}
+        if io_key in io_entry:
+            io_entry[io_key] = [file_utils.getFileOnly(f) for f in io_entry[io_key]] if type(io_entry[io_key]) == type([]) else file_utils.getFileOnly(io_entry[io_key])
+        return io_entry
+
+    if 'dryrun' in mi_json:
+        return ''
+    input_files = getModuleInputFiles( mi_json )
+    if input_etags == None:
+        input_etags = file_utils.getFileETags( input_files )
+    if any(input_etags.get(f, '') == '' for f in input_files):
+        return ''
+    key_json = copy.deepcopy(mi_json)
+    key_json['program_input'] = stripDirectories( key_json['program_input'], 'input' )
+    key_json['program_output'] = stripDirectories( key_json['program_output'], 'output' )
+    key_json['alternate_inputs'] = [stripDirectories( e, 'input' ) for e in key_json['alternate_inputs']]
+    key_json['alternate_outputs'] = [stripDirectories( e, 'output' ) for e in key_json['alternate_outputs']]
+    key_json['input_etags'] = [input_etags[f] for f in input_files]
+    return hashlib.sha256(json.dumps(key_json, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def setResultCachePath( cache_path = DEFAULT_RESULT_CACHE_PATH ):
+    """ Enables the result cache in this process, with entries under cache_path. '' disables the result cache.
+    RETURN: result cache path
+    """
+    global RESULT_CACHE_PATH
+    RESULT_CACHE_PATH = cache_path.rstrip('/')+'/' if cache_path not in ['', None] else ''
+    return RESULT_CACHE_PATH
+
+
+def getResultCacheFile( module_name, cache_key ):
+    """ Path of the result cache entry of a module run.
+
+    >>> getResultCacheFile( 'fastqc', 'abc' ).endswith('/fastqc/abc.json')
+    True
+    """
+    return file_utils.getFullPath( file_utils.getFullPath( RESULT_CACHE_PATH, module_name ), cache_key+'.json' )
+
+
+def saveResultCache( module_name, cache_key, local_output_dir, remote_output_dir ):
+    """ Adds the outputs of a module run to the result cache, once they are uploaded to remote_output_dir.
+        The cache entry lists the output files of this run only (the files in its local output dir), relative to remote_output_dir.
+    RETURN: path of cache entry, or '' if the result cache is disabled
+    """
+    if RESULT_CACHE_PATH in ['', None] or cache_key == '':
+        return ''
+    output_files = []
+    for dir_path, dir_names, file_names in os.walk(local_output_dir):
+        output_files += [os.path.relpath(os.path.join(dir_path, f), local_output_dir) for f in file_names]
+    cache_entry = {'key': cache_key, 'module': module_name, 'output_dir': remote_output_dir.rstrip('/')+'/',
+                   'files': sorted(output_files), 'created': time.time()}
+    cache_file = getResultCacheFile( module_name, cache_key )
+    if file_utils.inferFileSystem( cache_file ) != 's3':
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        return file_utils.writeJSON( cache_entry, cache_file )
+    # uploads go to a folder, under the local file name (<cache key>.json)
+    local_file = file_utils.writeJSON( cache_entry, os.path.join(os.path.dirname(local_output_dir.rstrip('/')), cache_key+'.json') )
+    return file_utils.uploadFile( local_file, cache_file[0:cache_file.rfind('/')+1] )
+
+
+def restoreResultCache( module_name, cache_key, remote_output_dir ):
+    """ On a result cache hit, copies the cached outputs of an identical earlier run to remote_output_dir - server-side for S3.
+        It is only a hit if all cached output files still exist - also when the entry points at remote_output_dir itself.
+    RETURN: LIST of restored output files, or None on a cache miss (or if the cached outputs no longer exist)
+    """
+    if RESULT_CACHE_PATH in ['', None] or cache_key == '':
+        return None
+    try:
+        cache_entry = json.loads( file_utils.readFileRange( getResultCacheFile( module_name, cache_key ) ).decode('utf-8') )
+    except Exception:
+        return None
+    remote_output_dir = remote_output_dir.rstrip('/')+'/'
+    cached_files = file_utils.listFileETags( cache_entry['output_dir'], True )
+    if cache_entry['files'] == [] or any(cache_entry['output_dir']+f not in cached_files for f in cache_entry['files']):
+        print('RESULT CACHE: outputs of {} no longer exist in {}'.format(cache_key, cache_entry['output_dir']))
+        return None
+    if cache_entry['output_dir'] == remote_output_dir:
+        return [remote_output_dir+f for f in cache_entry['files']]
+    restored_files = [file_utils.copyFile( cache_entry['output_dir']+f, remote_output_dir+f ) for f in cache_entry['files']]
+    file_utils.invalidateListingCache( remote_output_dir )
+    return restored_files
+
+
+def getArrayIndex( ):
+    """ Index of this child job within a Batch array job, or None if this is not an array job.
+    """
+    array_index = os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX', '')
+    return int(array_index) if array_index != '' else None
+
+
+def getArrayRunArguments( run_arguments_json, array_index ):
+    """ Array jobs share one IO list JSON - each child job runs the IO JSON at its array index.
+        A single IO JSON is returned as is.
+
+    >>> getArrayRunArguments( [{'sample_id': 'S1'}, {'sample_id': 'S2'}], 1 )
+    {'sample_id': 'S2'}
+    >>> getArrayRunArguments( {'sample_id': 'S1'}, None )
+    {'sample_id': 'S1'}
+    """
+    if type(run_arguments_json) == type([]):
+        return run_arguments_json[array_index if array_index != None else 0]
+    return run_arguments_json
+
+
 def initProgram( ):
     """ Entrypoint for initializing program arguments before run.
     """
     # parse run input arguments
     args = getRunArgs( )
     
-    # create a working directory
+    # jobs in an IO manifest read just their own entry, with their job ID, IO JSON and job JSON
+    manifest_entry = file_utils.readJSONManifestEntry( args.run_arguments ) if file_utils.isJSONManifestEntry( args.run_arguments ) else None
+    run_job_id = manifest_entry['job_id'] if manifest_entry != None else str(args.run_arguments).split('/')[-1].split('.')[1]
+    # child jobs of an array job share the job ID - add the array index, so each child has its own working dir and log
+    array_index = getArrayIndex( )
+    run_child_id = run_job_id if array_index == None else '{}_{}'.format(run_job_id, str(array_index))
+    
+    # create a working directory - reused by retries of this job
     print('Creating working directory')
     DOCKER_DIR = os.getcwd()
-    WORKING_DIR = generateWorkingDir(args.working_dir)
+    WORKING_DIR = generateWorkingDir(args.working_dir, run_child_id)
     os.chdir(WORKING_DIR)
-    OUT_DIR = os.path.join(WORKING_DIR, 'module_out')
-    os.mkdir(OUT_DIR)
+    OUT_DIR = resetOutputDir( os.path.join(WORKING_DIR, 'module_out') )
     
     # setup I/O
     print('Setting up I/O')
-    run_arguments_file = file_utils.downloadFile(args.run_arguments, WORKING_DIR)
-    run_arguments_json = file_utils.loadJSON( run_arguments_file )
+    if manifest_entry != None:
+        run_arguments_json = manifest_entry['io']
+    else:
+        run_arguments_file = file_utils.downloadFile(args.run_arguments, WORKING_DIR)
+        run_arguments_json = getArrayRunArguments( file_utils.loadJSON( run_arguments_file ), array_index )
     run_module_name = args.module_name
     run_submodule_name = args.submodule_name if 'submodule_name' in args and args.submodule_name not in [[], '', None] else ''
-    run_job_id = str(args.run_arguments).split('/')[-1].split('.')[1]
     
     # get module template for this docker module
-    module_template_path = getModuleTemplate( args.module_name, run_submodule_name )
-    module_template_file = file_utils.downloadFile( module_template_path, WORKING_DIR )
-    module_template_json = file_utils.loadJSON( module_template_file )
+    module_template_json = loadModuleTemplate( args.module_name, run_submodule_name, 's3' )
+
+    # multipart transfer settings for input and output data files of this module
+    print('Setting S3 transfer profile: '+str(file_utils.setTransferProfile( getModule_transfer( module_template_json ))))
     
     # parse run arguments and create program arguments to be run via command line
     module_instance_json = createModuleInstanceJSON( module_template_json, run_arguments_json )
@@ -820,12 +1105,27 @@ def initProgram( ):
     program_arguments = createProgramArguments( module_instance_json, WORKING_DIR, OUT_DIR )  # files will be downloaded here
     
     run_json = {'module': run_module_name, 'submodule': run_submodule_name, \
-                'run_job_id': run_job_id, 'docker_entry_dir': DOCKER_DIR, \
+                'run_job_id': run_child_id, 'docker_entry_dir': DOCKER_DIR, \
                 'local_input_dir': WORKING_DIR, 'local_output_dir': OUT_DIR, \
                 'remote_input_dir': remote_input_directory, 'remote_output_dir': remote_output_directory, \
                 'local_input_file': local_input_file, 'local_output_file': local_output_file, \
                 'program_arguments': program_arguments, 'run_arguments': run_arguments_json, \
-                'module_instance_json': module_instance_json, 'job_json': getModuleRunJobFileJSON(run_module_name, run_job_id, WORKING_DIR)}
+                'module_instance_json': module_instance_json, 'job_json': manifest_entry['job'] if manifest_entry != None else getModuleRunJobFileJSON(run_module_name, run_job_id, WORKING_DIR)}
+    
+    # result cache - if the same program already ran on the same input data, copy its outputs instead of running it again
+    if 'result_cache' in run_arguments_json:
+        setResultCachePath( run_arguments_json['result_cache'] )
+    run_json['result_cache_key'] = getResultCacheKey( module_instance_json ) if RESULT_CACHE_PATH not in ['', None] else ''
+    restored_files = restoreResultCache( run_module_name, run_json['result_cache_key'], remote_output_directory )
+    if restored_files != None:
+        print('RESULT CACHE HIT {} - restored {} output files to {}. Program not run.'.format(run_json['result_cache_key'], len(restored_files), remote_output_directory))
+        if 'fingerprint_file' in run_arguments_json:
+            file_utils.touchFile( run_arguments_json['fingerprint_file'], WORKING_DIR )
+        sys.exit(0)
+    if run_json['result_cache_key'] != '':
+        _pending_results[OUT_DIR.rstrip('/')] = (run_module_name, run_json['result_cache_key'])
+    if 'fingerprint_file' in run_arguments_json:
+        _pending_fingerprints[OUT_DIR.rstrip('/')] = run_arguments_json['fingerprint_file']
     
     return run_json
 